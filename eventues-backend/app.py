@@ -5,6 +5,7 @@ from chalicelib.src.api.public_api import public_api
 from chalicelib.src.api.payment_api import payment_api
 from chalicelib.src.api.coupon_api import coupon_api
 from chalicelib.src.api.transfer_api import transfer_api
+from chalicelib.src.api.export_api import export_api
 from chalicelib.src.config.environment import env_config
 
 # Configure CORS based on environment
@@ -25,3 +26,4 @@ app.register_blueprint(public_api)
 app.register_blueprint(payment_api)
 app.register_blueprint(coupon_api)
 app.register_blueprint(transfer_api)
+app.register_blueprint(export_api)
@@ -2,12 +2,21 @@
 
 import base64
 import json
-from chalice import Blueprint, Response, CORSConfig
+from datetime import datetime
+from chalice import Blueprint, Response, CORSConfig, Rate
 from chalicelib.src.usecases.event_usecase import EventUseCase
 from chalicelib.src.usecases.form_usecase import FormUseCase
 from chalicelib.src.repositories.analytics_repository import AnalyticsRepository
+from chalicelib.src.repositories.event_stats_repository import EventStatsRepository
+from chalicelib.src.repositories.inventory_repository import InventoryRepository
+from chalicelib.src.repositories.lot_repository import current_lot_index, lot_summary
+from chalicelib.src.tasks.pageview_buffer import PageViewBuffer
+from chalicelib.src.config.environment import env_config
 from chalicelib.src.utils.firebase import verify_token, db
 from chalicelib.src.utils.formatters import generate_slug
+from chalicelib.src.utils.json_encoder import firestore_json_dumps
+from chalicelib.src.utils.authorization import check_admin
+from chalicelib.src.api.payment_api import firebase_auth
 
 cors_config = CORSConfig(
     allow_origin='*',
@@ -20,6 +29,41 @@ event_api.cors = cors_config
 use_case = EventUseCase()
 form_use_case = FormUseCase()
 analytics_repository = AnalyticsRepository(db)
+event_stats_repository = EventStatsRepository(db)
+inventory_repository = InventoryRepository(db)
+
+# Orçamentos do backfill do agregado financeiro (rota de admin e worker agendado)
+STATS_BACKFILL_REQUEST_SECONDS = 20
+STATS_BACKFILL_TASK_SECONDS = 240
+STATS_BACKFILL_MARGIN_SECONDS = 10
+
+analytics_config = env_config.get_analytics_config()
+pageview_buffer = None
+if analytics_config['pageview_buffer_enabled']:
+    pageview_buffer = PageViewBuffer(
+        db,
+        analytics_repository,
+        flush_interval=analytics_config['pageview_flush_interval'],
+        flush_max_hits=analytics_config['pageview_flush_max_hits'],
+        max_pending=analytics_config['pageview_buffer_max_pending'],
+        flush_max_events=analytics_config['pageview_flush_max_events'],
+        flush_max_sketch_merges=analytics_config['pageview_flush_max_sketch_merges']
+    )
+
+@event_api.middleware('http')
+def flush_page_views(event, get_response):
+    """
+    Grava o buffer de visualizações ao fim da invocação, quando devido.
+    O Lambda congela o container entre invocações, então não há flush em
+    segundo plano.
+    """
+    response = get_response(event)
+    if pageview_buffer:
+        try:
+            pageview_buffer.flush_if_due()
+        except Exception as e:
+            print(f"[ERROR] Falha no flush de visualizações ao fim da invocação: {str(e)}")
+    return response
 
 @event_api.route('/organizer_detail/{event_id}/dashboard', methods=['GET'], cors=cors_config)
 def get_event_dashboard(event_id):
@@ -35,109 +79,39 @@ def get_event_dashboard(event_id):
                 headers={'Content-Type': 'application/json'}
             )
 
-        # Buscar todos os pedidos relacionados a este evento
-        orders = db.collection('orders').where('event_id', '==', event_id).stream()
+        # Agregado financeiro mantido incrementalmente (uma única leitura);
+        # incompleto enquanto o backfill de pedidos antigos não termina
+        event_stats = event_stats_repository.get_stats(event_id)
+        metodos = event_stats.get('metodosPagamento', {})
         
         # Inicializar estatísticas
         stats = {
-            'receitaTotal': 0,
-            'valorConfirmado': 0,
-            'valorPendente': 0,
-            'valorRepassado': 0,
-            'valorCancelado': 0,
+            'receitaTotal': round(event_stats.get('receitaTotal', 0), 2),
+            'valorConfirmado': round(event_stats.get('valorConfirmado', 0), 2),
+            'valorPendente': round(event_stats.get('valorPendente', 0), 2),
+            'valorRepassado': round(event_stats.get('valorRepassado', 0), 2),
+            'valorCancelado': round(event_stats.get('valorCancelado', 0), 2),
             'valorAReceber': 0,
             'receitaLiquida': 0,
             'visualizacoes': event.to_dict().get('views', 0),
             'taxaConversao': 0,
-            'totalPedidos': 0,
-            'pedidosConfirmados': 0,
+            'totalPedidos': event_stats.get('totalPedidos', 0),
+            'pedidosConfirmados': event_stats.get('pedidosConfirmados', 0),
+            'estatisticasCompletas': event_stats.get('initialized', False),
             'metodosPagamento': {
-                'cartaoCredito': 0,
-                'pix': 0,
-                'boleto': 0,
-                'outros': 0
-            },
-            'pedidos': []
+                'cartaoCredito': metodos.get('cartaoCredito', 0),
+                'pix': metodos.get('pix', 0),
+                'boleto': metodos.get('boleto', 0),
+                'outros': metodos.get('outros', 0)
+            }
         }
         
-        # Processar pedidos
-        all_orders = []
-        for order in orders:
-            order_data = order.to_dict()
-            all_orders.append(order_data)
-            
-            order_total = order_data.get('total_amount', 0)
-            order_status = order_data.get('status', '')
-            
-            # Obter o método de pagamento dos detalhes de pagamento
-            payment_details = order_data.get('payment_details', {})
-            billing_type = payment_details.get('billingType', '') if payment_details else ''
-            
-            # Contabilizar métodos de pagamento
-            if billing_type == 'CREDIT_CARD':
-                stats['metodosPagamento']['cartaoCredito'] += 1
-            elif billing_type == 'PIX':
-                stats['metodosPagamento']['pix'] += 1
-            elif billing_type == 'BOLETO':
-                stats['metodosPagamento']['boleto'] += 1
-            else:
-                stats['metodosPagamento']['outros'] += 1
-            
-            # Incrementar contagem total de pedidos
-            stats['totalPedidos'] += 1
-            
-            # Classificar por status de pagamento baseado no Asaas e estados internos
-            payment_details = order_data.get('payment_details', {})
-            asaas_status = payment_details.get('status', '')
-            is_transferred = payment_details.get('transferred_to_organizer', False)
-            
-            # Mapear status do Asaas para classificação interna
-            if order_status in ['CONFIRMADO', 'CONFIRMED', 'RECEIVED'] or asaas_status in ['CONFIRMED', 'RECEIVED']:
-                stats['receitaTotal'] += order_total
-                stats['valorConfirmado'] += order_total
-                stats['pedidosConfirmados'] += 1
-                
-                # Verificar se já foi repassado para o organizador
-                if is_transferred:
-                    stats['valorRepassado'] += order_total
-                else:
-                    # Para pagamentos confirmados, o valor a receber é o valor líquido (subtotal)
-                    valor_liquido = order_data.get('subtotal_amount', order_data.get('valor', 0))
-                    stats['valorAReceber'] += valor_liquido
-                    
-            elif order_status in ['PAGAMENTO PENDENTE', 'PENDING'] or asaas_status in ['PENDING', 'AWAITING_PAYMENT']:
-                stats['receitaTotal'] += order_total
-                stats['valorPendente'] += order_total
-                # Pagamentos pendentes não são contados em valorAReceber até serem confirmados
-                
-            elif order_status in ['CANCELADO', 'REFUNDED', 'DELETED', 'CHARGEBACK_REQUESTED'] or asaas_status in ['REFUNDED', 'CHARGEBACK_REQUESTED', 'CHARGEBACK_DISPUTE', 'AWAITING_CHARGEBACK_REVERSAL']:
-                stats['valorCancelado'] += order_total
-                
-            # Tratar casos de pagamentos expirados
-            elif order_status in ['EXPIRADO', 'EXPIRED'] or asaas_status in ['OVERDUE']:
-                stats['valorCancelado'] += order_total
-                
-            # Status AGUARDANDO INFORMAÇÕES não conta para totais financeiros
-            elif 'AGUARDANDO' in order_status.upper() or order_status in ['AWAITING_INFO', 'INFO_PENDING']:
-                # Apenas conta para totalPedidos, mas não para valores financeiros
-                pass
-        
         # Calcular receita líquida (total - cancelamentos)
-        stats['receitaLiquida'] = stats['receitaTotal'] - stats['valorCancelado']
-        
-        # Buscar solicitações de repasse pendentes para subtrair do valor disponível
-        pending_transfers = db.collection('transfer_requests')\
-                             .where('event_id', '==', event_id)\
-                             .where('status', 'in', ['PENDING', 'APPROVED', 'PROCESSING'])\
-                             .stream()
-        
-        total_pending_transfers = 0
-        for transfer in pending_transfers:
-            transfer_data = transfer.to_dict()
-            total_pending_transfers += transfer_data.get('amount', 0)
+        stats['receitaLiquida'] = round(stats['receitaTotal'] - stats['valorCancelado'], 2)
         
         # Subtrair repasses pendentes do valor disponível para repasse
-        stats['valorAReceber'] = max(0, stats['valorAReceber'] - total_pending_transfers)
+        valor_a_receber = event_stats.get('valorAReceberBruto', 0) - event_stats.get('repassesPendentes', 0)
+        stats['valorAReceber'] = round(max(0, valor_a_receber), 2)
         
         # Obter total de visualizações do repositório de analytics
         visualizacoes = analytics_repository.get_page_views(event_id)
@@ -147,45 +121,179 @@ def get_event_dashboard(event_id):
         if stats['visualizacoes'] > 0:
             stats['taxaConversao'] = round((stats['pedidosConfirmados'] / stats['visualizacoes']) * 100, 2)
         
-        # Obter todos os pedidos ordenados por data (mais recentes primeiro)
-        # Função para converter created_at para um formato comparável
-        def get_created_at_key(order):
-            created_at = order.get('created_at')
-            if not created_at:
-                return 0.0  # Garantir que retorne float
-            # Se for um objeto datetime, converter para timestamp
-            if hasattr(created_at, 'timestamp'):
-                return float(created_at.timestamp())
-            # Se for string, tentar converter para timestamp ou usar um valor padrão
-            try:
-                # Tentar converter string ISO para datetime e depois para timestamp
-                from datetime import datetime
-                dt = datetime.fromisoformat(str(created_at).replace('Z', '+00:00'))
-                return float(dt.timestamp())
-            except (ValueError, TypeError):
-                # Se falhar, usar um valor padrão
-                return 0.0
-            
-        all_orders.sort(key=get_created_at_key, reverse=True)
+        # Visitantes únicos aproximados (HyperLogLog) e conversão por visitante
+        stats['visitantesUnicos'] = analytics_repository.get_unique_visitors(event_id)
+        stats['taxaConversaoUnicos'] = 0
+        if stats['visitantesUnicos'] > 0:
+            stats['taxaConversaoUnicos'] = round((stats['pedidosConfirmados'] / stats['visitantesUnicos']) * 100, 2)
+        
+        # Primeira página de pedidos (compatível com o campo 'pedidos' do
+        # dashboard); as demais vêm de /organizer_detail/{event_id}/orders
+        stats['pedidos'], stats['pedidosCursor'] = list_order_page(event_id, limit=DASHBOARD_ORDERS_LIMIT)
         
-        stats['pedidos'] = [{
+        return Response(
+            body=json.dumps(stats),
+            status_code=200,
+            headers={'Content-Type': 'application/json'}
+        )
+    except Exception as e:
+        print(f"Erro ao buscar dashboard do evento: {str(e)}")
+        return Response(
+            body=json.dumps({'error': str(e)}),
+            status_code=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
+
+DASHBOARD_ORDERS_LIMIT = 100
+ORDERS_PAGE_DEFAULT_LIMIT = 20
+ORDERS_PAGE_MAX_LIMIT = 100
+
+ORDER_LIST_FIELDS = [
+    'payment_id', 'status', 'subtotal_amount', 'total_amount', 'fee_amount',
+    'payment_url', 'created_at', 'payment_details.billingType'
+]
+
+def encode_order_cursor(order_doc):
+    """Codifica a posição (created_at, id) do último pedido da página"""
+    if not order_doc:
+        return None
+    created_at = order_doc.get('created_at')
+    cursor_data = {
+        'id': order_doc.id,
+        'created_at': created_at.isoformat() if hasattr(created_at, 'isoformat') else created_at
+    }
+    return base64.urlsafe_b64encode(json.dumps(cursor_data).encode()).decode()
+
+def decode_order_cursor(cursor_str):
+    """Decodifica o cursor de paginação de pedidos"""
+    if not cursor_str:
+        return None
+    try:
+        cursor_data = json.loads(base64.urlsafe_b64decode(cursor_str))
+        created_at = cursor_data.get('created_at')
+        if created_at:
+            try:
+                created_at = datetime.fromisoformat(created_at)
+            except ValueError:
+                pass
+        return {'created_at': created_at, '__name__': cursor_data['id']}
+    except Exception:
+        return None
+
+def list_order_page(event_id, limit=20, cursor=None, status_filter=None, payment_method=None):
+    """
+    Uma página de pedidos do evento (mais recentes primeiro), com projeção
+    apenas das colunas exibidas na tabela.
+
+    Returns:
+        tuple: (pedidos, cursor da próxima página ou None)
+    """
+    query = db.collection('orders').where('event_id', '==', event_id)
+    if status_filter:
+        query = query.where('status', '==', status_filter)
+    if payment_method:
+        query = query.where('payment_details.billingType', '==', payment_method.upper())
+
+    query = query.order_by('created_at', direction='DESCENDING')\
+                 .order_by('__name__', direction='DESCENDING')\
+                 .select(ORDER_LIST_FIELDS)
+    if cursor:
+        query = query.start_after(cursor)
+
+    docs = list(query.limit(limit + 1).stream())
+    page = docs[:limit]
+
+    pedidos = []
+    for doc in page:
+        order = doc.to_dict()
+        created_at = order.get('created_at')
+        payment_details = order.get('payment_details')
+        pedidos.append({
             'idPedido': order.get('payment_id', ''),
             'status': order.get('status', ''),
             'valor': order.get('subtotal_amount', 0),
             'total_amount': order.get('total_amount', ''),
             'fee_amount': order.get('fee_amount', ''),
             'payment_url': order.get('payment_url', ''),
-            'data': order.get('created_at').isoformat() if hasattr(order.get('created_at'), 'isoformat') else str(order.get('created_at')) if order.get('created_at') else '',
-            'metodoPagamento': order.get('payment_details', {}).get('billingType', '') if order.get('payment_details') else 'Não especificado'
-        } for order in all_orders]
-        
+            'data': created_at.isoformat() if hasattr(created_at, 'isoformat') else str(created_at) if created_at else '',
+            'metodoPagamento': payment_details.get('billingType', '') if payment_details else 'Não especificado'
+        })
+
+    return pedidos, encode_order_cursor(page[-1]) if len(docs) > limit else None
+
+@event_api.route('/organizer_detail/{event_id}/orders', methods=['GET'], cors=cors_config)
+def list_event_orders(event_id):
+    """
+    Lista os pedidos do evento (mais recentes primeiro) com paginação por
+    cursor, projeção apenas das colunas exibidas na tabela e filtros
+    opcionais por status e método de pagamento.
+    """
+    try:
+        params = event_api.current_request.query_params or {}
+        try:
+            limit = int(params.get('limit', ORDERS_PAGE_DEFAULT_LIMIT))
+        except (TypeError, ValueError):
+            limit = 0
+        if limit < 1:
+            return Response(
+                body=json.dumps({'error': 'limit deve ser um inteiro positivo'}),
+                status_code=400,
+                headers={'Content-Type': 'application/json'}
+            )
+
+        pedidos, next_cursor = list_order_page(
+            event_id,
+            limit=min(limit, ORDERS_PAGE_MAX_LIMIT),
+            cursor=decode_order_cursor(params.get('cursor')),
+            status_filter=params.get('status'),
+            payment_method=params.get('payment_method')
+        )
+
         return Response(
-            body=json.dumps(stats),
+            body=json.dumps({
+                'pedidos': pedidos,
+                'next_cursor': next_cursor
+            }),
             status_code=200,
             headers={'Content-Type': 'application/json'}
         )
     except Exception as e:
-        print(f"Erro ao buscar dashboard do evento: {str(e)}")
+        print(f"Erro ao listar pedidos do evento: {str(e)}")
+        return Response(
+            body=json.dumps({'error': str(e)}),
+            status_code=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
+
+@event_api.route('/organizer_detail/{event_id}/dashboard/rebuild', methods=['POST'], cors=cors_config, authorizer=firebase_auth)
+def rebuild_event_dashboard(event_id):
+    """
+    Agenda o backfill do agregado financeiro do evento e processa páginas
+    dentro do orçamento de tempo da requisição; o restante é concluído pelo
+    worker agendado. Útil para inicializar eventos antigos.
+    """
+    try:
+        denied = check_admin(event_api.current_request)
+        if denied:
+            result, status_code = denied
+            return Response(
+                body=json.dumps(result),
+                status_code=status_code,
+                headers={'Content-Type': 'application/json'}
+            )
+
+        event_stats_repository.request_backfill(event_id)
+        progress = event_stats_repository.backfill(event_id, STATS_BACKFILL_REQUEST_SECONDS)
+        
+        return Response(
+            body=firestore_json_dumps({'event_id': event_id, 'backfill': progress}),
+            status_code=200 if progress.get('status') == 'done' else 202,
+            headers={'Content-Type': 'application/json'}
+        )
+    except Exception as e:
+        print(f"Erro ao reconstruir estatísticas do evento: {str(e)}")
         return Response(
             body=json.dumps({'error': str(e)}),
             status_code=500,
@@ -193,6 +301,40 @@ def get_event_dashboard(event_id):
         )
 
 
+@event_api.schedule(Rate(1, unit=Rate.MINUTES))
+def backfill_event_stats(event):
+    """
+    Worker agendado: continua os backfills pendentes do agregado financeiro,
+    com folga antes do timeout do Lambda.
+    """
+    time_budget = STATS_BACKFILL_TASK_SECONDS
+    if getattr(event, 'context', None) is not None:
+        time_budget = min(time_budget, event.context.get_remaining_time_in_millis() / 1000 - STATS_BACKFILL_MARGIN_SECONDS)
+    if time_budget > 0:
+        event_stats_repository.backfill_pending(time_budget)
+
+
+def get_visitor_id(request) -> str:
+    """
+    Identifica o visitante pelo visitor_id enviado pelo cliente (corpo ou
+    header X-Visitor-Id) ou, na falta dele, pelo IP de origem e User-Agent.
+    """
+    headers = request.headers or {}
+    visitor_id = headers.get('x-visitor-id')
+    if not visitor_id and request.raw_body:
+        try:
+            body = json.loads(request.raw_body)
+            if isinstance(body, dict):
+                visitor_id = body.get('visitor_id')
+        except ValueError:
+            pass
+    if visitor_id:
+        return str(visitor_id)
+
+    source_ip = request.context.get('identity', {}).get('sourceIp', '')
+    return f"{source_ip}|{headers.get('user-agent', '')}"
+
+
 @event_api.route('/events/{event_id}/pageview', methods=['POST'], cors=cors_config)
 def record_page_view(event_id):
     """
@@ -200,11 +342,20 @@ def record_page_view(event_id):
     Não requer autenticação para permitir contabilizar todas as visualizações públicas.
     """
     try:
-        # Incrementar contador de visualizações
-        total_views = analytics_repository.increment_page_view(event_id)
+        visitor_id = get_visitor_id(event_api.current_request)
+        
+        # Acumular no buffer write-behind ou incrementar diretamente um shard
+        if pageview_buffer:
+            pageview_buffer.add(event_id, visitor_id=visitor_id)
+        else:
+            # Escritas cegas (Increment e Maximum) num único commit
+            batch = db.batch()
+            analytics_repository.increment_page_view(event_id, writer=batch)
+            analytics_repository.record_unique_visitor(event_id, visitor_id, writer=batch)
+            batch.commit()
         
         return Response(
-            body=json.dumps({'visualizacoes': total_views}),
+            body=json.dumps({'success': True}),
             status_code=200,
             headers={'Content-Type': 'application/json'}
         )
@@ -217,6 +368,22 @@ def record_page_view(event_id):
         )
 
 
+@event_api.route('/analytics/pageview-buffer', methods=['GET'], cors=cors_config)
+def get_pageview_buffer_stats():
+    """
+    Expõe as métricas do buffer de visualizações deste container
+    (flushes realizados, visualizações gravadas, descartadas e pendentes).
+    """
+    return Response(
+        body=json.dumps({
+            'enabled': pageview_buffer is not None,
+            **(pageview_buffer.stats() if pageview_buffer else {})
+        }),
+        status_code=200,
+        headers={'Content-Type': 'application/json'}
+    )
+
+
 @event_api.route('/events', methods=['POST'], cors=cors_config)
 def create_event():
     request = event_api.current_request
@@ -424,10 +591,12 @@ def get_tickets(event_id):
         for ticket in tickets_ref:
             ticket_data = ticket.to_dict()
             ticket_data['id'] = ticket.id  # Adiciona o ID do documento
+            # Lote à venda agora (sem escrita; o ponteiro é persistido no checkout)
+            ticket_data['loteAtual'] = lot_summary(ticket_data, current_lot_index(ticket_data))
             tickets.append(ticket_data)
 
         return Response(
-            body=json.dumps(tickets),
+            body=firestore_json_dumps(tickets),
             status_code=200,
             headers={'Content-Type': 'application/json'}
         )
@@ -503,6 +672,8 @@ def update_ticket(event_id, ticket_id):
 
         # Atualiza o documento
         ticket_ref.update(ticket_data)
+        # Estoques já criados passam a refletir a nova capacidade
+        inventory_repository.resync_capacity(event_id, ticket_id, {**ticket.to_dict(), **ticket_data})
 
         # Busca o documento atualizado
         updated_ticket = ticket_ref.get()
@@ -510,7 +681,7 @@ def update_ticket(event_id, ticket_id):
         response_data['id'] = ticket_id
 
         return Response(
-            body=json.dumps(response_data),
+            body=firestore_json_dumps(response_data),
             status_code=200,
             headers={'Content-Type': 'application/json'}
         )
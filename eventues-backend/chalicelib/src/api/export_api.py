@@ -0,0 +1,69 @@
+import json
+from chalice import Blueprint, Response, CORSConfig, Rate
+from chalicelib.src.tasks.export_task import ExportTask
+from chalicelib.src.utils.firebase import db, bucket
+from chalicelib.src.utils.json_encoder import firestore_json_dumps
+
+cors_config = CORSConfig(
+    allow_origin='*',
+    allow_headers=['*'],
+    max_age=600
+)
+
+export_api = Blueprint(__name__)
+export_api.cors = cors_config
+
+@export_api.route('/events/{event_id}/exports', methods=['POST'], cors=cors_config)
+def create_export(event_id):
+    """
+    Solicita a exportação de participantes ou pedidos do evento.
+    Body: {"type": "participants" | "orders", "format": "csv" | "xlsx", "user_id": "..."}
+    Retorna o job_id; o download fica disponível em GET /exports/{job_id}.
+    """
+    try:
+        data = export_api.current_request.json_body or {}
+        job, status_code = ExportTask(db, bucket).create_job(
+            event_id,
+            data.get('type', 'participants'),
+            data.get('format', 'csv').lower(),
+            data.get('user_id')
+        )
+        return Response(
+            body=firestore_json_dumps(job),
+            status_code=status_code,
+            headers={'Content-Type': 'application/json'}
+        )
+    except Exception as e:
+        return Response(
+            body=json.dumps({'error': str(e)}),
+            status_code=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
+@export_api.route('/exports/{job_id}', methods=['GET'], cors=cors_config)
+def get_export(job_id):
+    """
+    Consulta o status do job de exportação e, quando concluído, a URL de download.
+    """
+    try:
+        job, status_code = ExportTask(db, bucket).get_job(job_id)
+        return Response(
+            body=firestore_json_dumps(job),
+            status_code=status_code,
+            headers={'Content-Type': 'application/json'}
+        )
+    except Exception as e:
+        return Response(
+            body=json.dumps({'error': str(e)}),
+            status_code=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
+@export_api.schedule(Rate(1, unit=Rate.MINUTES))
+def process_export_jobs(event):
+    """
+    Worker agendado: processa os jobs de exportação pendentes.
+    """
+    processed = ExportTask(db, bucket).process_pending()
+    if processed:
+        print(f"[DEBUG] {processed} job(s) de exportação processado(s)")
@@ -1,9 +1,19 @@
 from datetime import datetime
-from chalice import Blueprint, Response, CORSConfig, UnauthorizedError, NotFoundError
+from chalice import Blueprint, Response, CORSConfig, UnauthorizedError, NotFoundError, Rate, AuthResponse
 from chalicelib.src.usecases.assas_usecase import AsaasUseCase
 from chalicelib.src.usecases.payment_usecase import PaymentUseCase
+from chalicelib.src.usecases.waiting_room_usecase import WaitingRoomUseCase, QUEUE_TOKEN_HEADER
+from chalicelib.src.repositories.qr_index_repository import QrIndexRepository
+from chalicelib.src.repositories.checkin_stats_repository import CheckinStatsRepository
+from chalicelib.src.repositories.participant_repository import ParticipantRepository
+from chalicelib.src.repositories.webhook_queue_repository import WebhookQueueRepository
+from chalicelib.src.repositories.payment_index_repository import PaymentIndexRepository
+from chalicelib.src.repositories.idempotency_repository import IdempotencyRepository
+from chalicelib.src.tasks.webhook_worker import WebhookWorker
+from chalicelib.src.config.environment import env_config
 from chalicelib.src.utils.firebase import db, verify_token
 from chalicelib.src.utils.json_encoder import firestore_json_dumps
+from chalicelib.src.utils.authorization import check_admin, check_event_organizer, request_user_id
 
 cors_config = CORSConfig(
     allow_origin='*',
@@ -14,18 +24,70 @@ cors_config = CORSConfig(
 payment_api = Blueprint(__name__)
 
 asaas_usecase = AsaasUseCase()
+webhook_config = env_config.get_webhook_config()
+
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+# Folga entre o fim da drenagem de webhooks e o timeout do Lambda
+WEBHOOK_DRAIN_MARGIN_SECONDS = 10
+
+def _response_headers(result, status_code, replayed=False):
+    """
+    Cabeçalhos JSON, com Retry-After quando o circuito do Asaas está aberto,
+    o token da fila virtual ainda não foi liberado ou a mesma Idempotency-Key
+    ainda está em execução.
+    """
+    headers = {'Content-Type': 'application/json'}
+    if status_code in (409, 429, 503) and isinstance(result, dict) and result.get('retry_after'):
+        headers['Retry-After'] = str(result['retry_after'])
+    if replayed:
+        headers['Idempotent-Replayed'] = 'true'
+    return headers
+
+def _idempotent(request, scope, data, handler):
+    """
+    Executa handler() uma vez por Idempotency-Key (quando enviada).
+
+    Returns:
+        tuple: (resultado, status, replayed)
+    """
+    key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+    if not key:
+        result, status_code = handler()
+        return result, status_code, False
+    return IdempotencyRepository(db).run(scope, key, data, handler)
+
+def _queue_rejection(request, data):
+    """Recusa o checkout de eventos com fila virtual ativa sem token liberado."""
+    event_id = data.get('event_id') if isinstance(data, dict) else None
+    token = request.headers.get(QUEUE_TOKEN_HEADER)
+    return WaitingRoomUseCase().check_admission(event_id, token, db)
 
 @payment_api.authorizer()
 def firebase_auth(auth_request):
-    token = auth_request.token
-    if not token:
-        raise Exception('No authorization token provided')
-    
-    claims = verify_token(token)
-    if not claims:
-        raise Exception('Invalid token')
-    
-    return claims
+    """
+    Valida o ID token do Firebase (cabeçalho Authorization, com ou sem
+    "Bearer "). O UID fica em context['authorizer']['principalId'].
+    """
+    token = auth_request.token or ''
+    if token.startswith('Bearer '):
+        token = token[len('Bearer '):]
+    try:
+        user_id = verify_token(token) if token else None
+    except ValueError as e:
+        print(f"[DEBUG] Token recusado pelo authorizer: {str(e)}")
+        user_id = None
+    if not user_id:
+        return AuthResponse(routes=[], principal_id='anonymous')
+    return AuthResponse(routes=['*'], principal_id=user_id)
+
+def _forbidden(denied):
+    """Resposta de erro de uma verificação de permissão."""
+    result, status_code = denied
+    return Response(
+        body=firestore_json_dumps(result),
+        status_code=status_code,
+        headers={'Content-Type': 'application/json'}
+    )
 
 @payment_api.route('/create-customer', methods=['POST'], cors=cors_config)
 def create_customer():
@@ -37,7 +99,7 @@ def create_customer():
         return Response(
             body=firestore_json_dumps(result) if isinstance(result, dict) else result,
             status_code=status_code,
-            headers={'Content-Type': 'application/json'}
+            headers=_response_headers(result, status_code)
         )
     except Exception as e:
         return Response(
@@ -57,7 +119,7 @@ def tokenize_card():
         return Response(
             body=firestore_json_dumps(result) if isinstance(result, dict) else result,
             status_code=status_code,
-            headers={'Content-Type': 'application/json'}
+            headers=_response_headers(result, status_code)
         )
     except Exception as e:
         return Response(
@@ -71,12 +133,22 @@ def create_payment_session():
     try:
         request = payment_api.current_request
         data = request.json_body
-        payment_usecase = PaymentUseCase()
-        result, status_code = payment_usecase.create_payment_session(data, asaas_usecase, db)
+        rejection = _queue_rejection(request, data)
+        replayed = False
+        if rejection:
+            result, status_code = rejection
+        else:
+            payment_usecase = PaymentUseCase()
+            result, status_code, replayed = _idempotent(
+                request, 'create_payment_session', data,
+                lambda: payment_usecase.create_payment_session(
+                    data, asaas_usecase, db, queue_token=request.headers.get(QUEUE_TOKEN_HEADER)
+                )
+            )
         return Response(
             body=firestore_json_dumps(result) if isinstance(result, dict) else result,
             status_code=status_code,
-            headers={'Content-Type': 'application/json'}
+            headers=_response_headers(result, status_code, replayed)
         )
     except Exception as e:
         return Response(
@@ -89,11 +161,11 @@ def create_payment_session():
 def get_pix_qrcode(payment_id):
     try:
         payment_usecase = PaymentUseCase()
-        result, status_code = payment_usecase.get_pix_qrcode(payment_id, asaas_usecase)
+        result, status_code = payment_usecase.get_pix_qrcode(payment_id, asaas_usecase, db)
         return Response(
             body=firestore_json_dumps(result) if isinstance(result, dict) else result,
             status_code=status_code,
-            headers={'Content-Type': 'application/json'}
+            headers=_response_headers(result, status_code)
         )
     except Exception as e:
         return Response(
@@ -104,14 +176,30 @@ def get_pix_qrcode(payment_id):
 
 @payment_api.route('/webhook/asaas', methods=['POST'], cors=cors_config)
 def webhook():
+    """
+    Persiste o payload do Asaas com uma única escrita e responde em seguida;
+    o processamento fica a cargo do worker da fila (ou é feito na hora no
+    modo inline, usado em desenvolvimento e testes).
+    """
     try:
         request = payment_api.current_request
         event = request.json_body
-        payment_usecase = PaymentUseCase()
-        result, status_code = payment_usecase.process_webhook(event, db)
+        if not event or not event.get('event'):
+            return Response(
+                body=firestore_json_dumps({'error': 'Invalid webhook data: missing event type'}),
+                status_code=400,
+                headers={'Content-Type': 'application/json'}
+            )
+        queue_id, created = WebhookQueueRepository(db).enqueue(event)
+        result = {'status': 'queued' if created else 'duplicate', 'queue_id': queue_id}
+
+        if webhook_config['worker_mode'] == 'inline':
+            payment_id = (event.get('payment') or {}).get('id')
+            result['worker'] = WebhookWorker(db).drain(payment_id=payment_id)
+
         return Response(
-            body=firestore_json_dumps(result) if isinstance(result, dict) else result,
-            status_code=status_code,
+            body=firestore_json_dumps(result),
+            status_code=200,
             headers={'Content-Type': 'application/json'}
         )
     except Exception as e:
@@ -121,6 +209,26 @@ def webhook():
             headers={'Content-Type': 'application/json'}
         )
 
+@payment_api.schedule(Rate(1, unit=Rate.MINUTES))
+def process_webhook_queue(event):
+    """
+    Worker agendado: drena a fila de webhooks do Asaas em lotes até
+    esvaziá-la ou esgotar o orçamento de tempo, com folga antes do timeout
+    do Lambda.
+    """
+    if webhook_config['worker_mode'] == 'queue':
+        time_budget = webhook_config['drain_budget_seconds']
+        if getattr(event, 'context', None) is not None:
+            time_budget = min(time_budget, event.context.get_remaining_time_in_millis() / 1000 - WEBHOOK_DRAIN_MARGIN_SECONDS)
+        WebhookWorker(db).drain_all(max(time_budget, 0))
+
+@payment_api.schedule(Rate(1, unit=Rate.MINUTES))
+def expire_reservations(event):
+    """
+    Worker agendado: expira reservas de estoque de pedidos não pagos.
+    """
+    PaymentUseCase().expire_reservations(db)
+
 @payment_api.route('/check-payment-status/{payment_id}', methods=['GET'], cors=cors_config)
 def check_payment_status(payment_id):
     try:
@@ -136,7 +244,7 @@ def check_payment_status(payment_id):
         return Response(
             body=firestore_json_dumps(result) if isinstance(result, dict) else result,
             status_code=status_code,
-            headers={'Content-Type': 'application/json'}
+            headers=_response_headers(result, status_code)
         )
     except Exception:
         return Response(
@@ -150,11 +258,80 @@ def create_order():
     try:
         request = payment_api.current_request
         data = request.json_body
-        payment_usecase = PaymentUseCase()
-        result, status_code = payment_usecase.create_order(data, db)
+        rejection = _queue_rejection(request, data)
+        replayed = False
+        if rejection:
+            result, status_code = rejection
+        else:
+            payment_usecase = PaymentUseCase()
+            result, status_code, replayed = _idempotent(
+                request, 'create-order', data,
+                lambda: payment_usecase.create_order(data, db, queue_token=request.headers.get(QUEUE_TOKEN_HEADER))
+            )
         return Response(
             body=firestore_json_dumps(result) if isinstance(result, dict) else result,
             status_code=status_code,
+            headers=_response_headers(result, status_code, replayed)
+        )
+    except Exception as e:
+        return Response(
+            body=firestore_json_dumps({'error': str(e)}),
+            status_code=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
+@payment_api.route('/events/{event_id}/waiting-room', methods=['PUT'], cors=cors_config, authorizer=firebase_auth)
+def update_waiting_room(event_id):
+    """
+    Ativa/desativa a fila virtual do evento.
+    Body: {"enabled": true, "admission_rate": 5} (admissões por segundo).
+    """
+    try:
+        denied = check_event_organizer(payment_api.current_request, event_id, db)
+        if denied:
+            return _forbidden(denied)
+        data = payment_api.current_request.json_body
+        result, status_code = WaitingRoomUseCase().update_settings(event_id, data, db)
+        return Response(
+            body=firestore_json_dumps(result),
+            status_code=status_code,
+            headers={'Content-Type': 'application/json'}
+        )
+    except Exception as e:
+        return Response(
+            body=firestore_json_dumps({'error': str(e)}),
+            status_code=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
+@payment_api.route('/events/{event_id}/waiting-room/join', methods=['POST'], cors=cors_config)
+def join_waiting_room(event_id):
+    """
+    Entra na fila virtual e retorna o token a enviar no cabeçalho
+    X-Queue-Token do checkout a partir de admit_at.
+    """
+    try:
+        result, status_code = WaitingRoomUseCase().join(event_id, db)
+        return Response(
+            body=firestore_json_dumps(result),
+            status_code=status_code,
+            headers={'Content-Type': 'application/json'}
+        )
+    except Exception as e:
+        return Response(
+            body=firestore_json_dumps({'error': str(e)}),
+            status_code=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
+@payment_api.route('/events/{event_id}/waiting-room/status', methods=['GET'], cors=cors_config)
+def get_waiting_room_status(event_id):
+    try:
+        request = payment_api.current_request
+        result, status_code = WaitingRoomUseCase().get_status(event_id, request.headers.get(QUEUE_TOKEN_HEADER), db)
+        return Response(
+            body=firestore_json_dumps(result),
+            status_code=status_code,
             headers={'Content-Type': 'application/json'}
         )
     except Exception as e:
@@ -243,9 +420,18 @@ def get_order(order_id):
 
 @payment_api.route('/events/{event_id}/participants', methods=['GET'], cors=cors_config)
 def get_event_participants(event_id):
+    """
+    Lista os participantes do evento. Com algum dos parâmetros limit, cursor,
+    search, ticket_id, checkin ou category, a consulta é paginada e servida
+    pela projeção participants; sem parâmetros, mantém a lista completa.
+    """
     try:
+        query_params = payment_api.current_request.query_params or {}
         payment_usecase = PaymentUseCase()
-        result, status_code = payment_usecase.get_event_participants(event_id, db)
+        if query_params:
+            result, status_code = payment_usecase.list_event_participants(event_id, query_params, db)
+        else:
+            result, status_code = payment_usecase.get_event_participants(event_id, db)
         return Response(
             body=firestore_json_dumps(result) if isinstance(result, dict) else result,
             status_code=status_code,
@@ -258,6 +444,28 @@ def get_event_participants(event_id):
             headers={'Content-Type': 'application/json'}
         )
 
+@payment_api.route('/events/{event_id}/participants/rebuild', methods=['POST'], cors=cors_config, authorizer=firebase_auth)
+def rebuild_participants(event_id):
+    """
+    Reconstrói a projeção de participantes do evento a partir dos pedidos.
+    """
+    try:
+        denied = check_event_organizer(payment_api.current_request, event_id, db)
+        if denied:
+            return _forbidden(denied)
+        projected = ParticipantRepository(db).rebuild(event_id)
+        return Response(
+            body=firestore_json_dumps({'event_id': event_id, 'participants': projected}),
+            status_code=200,
+            headers={'Content-Type': 'application/json'}
+        )
+    except Exception as e:
+        return Response(
+            body=firestore_json_dumps({'error': str(e)}),
+            status_code=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
 @payment_api.route('/events/{event_id}/participants/{order_id}/checkin', methods=['POST'], cors=cors_config)
 def update_participant_checkin(event_id, order_id):
     try:
@@ -288,6 +496,53 @@ def update_participant_checkin(event_id, order_id):
             headers={'Content-Type': 'application/json'}
         )
 
+@payment_api.route('/events/{event_id}/checkins', methods=['GET'], cors=cors_config, authorizer=firebase_auth)
+def get_checkin_changes(event_id):
+    """
+    Feed incremental de check-ins. Query param opcional since (ISO): sem ele,
+    retorna apenas os contadores e o next_since para as próximas consultas.
+    """
+    try:
+        denied = check_event_organizer(payment_api.current_request, event_id, db)
+        if denied:
+            return _forbidden(denied)
+        query_params = payment_api.current_request.query_params or {}
+        payment_usecase = PaymentUseCase()
+        result, status_code = payment_usecase.get_checkin_changes(event_id, query_params.get('since'), db)
+        return Response(
+            body=firestore_json_dumps(result),
+            status_code=status_code,
+            headers={'Content-Type': 'application/json'}
+        )
+    except Exception as e:
+        return Response(
+            body=firestore_json_dumps({'error': str(e)}),
+            status_code=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
+@payment_api.route('/events/{event_id}/checkins/stats/rebuild', methods=['POST'], cors=cors_config, authorizer=firebase_auth)
+def rebuild_checkin_stats(event_id):
+    """
+    Recalcula os contadores de check-in do evento a partir dos pedidos.
+    """
+    try:
+        denied = check_event_organizer(payment_api.current_request, event_id, db)
+        if denied:
+            return _forbidden(denied)
+        stats = CheckinStatsRepository(db).rebuild(event_id)
+        return Response(
+            body=firestore_json_dumps(stats),
+            status_code=200,
+            headers={'Content-Type': 'application/json'}
+        )
+    except Exception as e:
+        return Response(
+            body=firestore_json_dumps({'error': str(e)}),
+            status_code=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
 @payment_api.route('/events/{event_id}/qr-checkin', methods=['POST'], cors=cors_config)
 def qr_code_checkin(event_id):
     try:
@@ -316,6 +571,166 @@ def qr_code_checkin(event_id):
             headers={'Content-Type': 'application/json'}
         )
 
+@payment_api.route('/events/{event_id}/checkin-snapshot', methods=['GET'], cors=cors_config, authorizer=firebase_auth)
+def get_checkin_snapshot(event_id):
+    """
+    Snapshot versionado e compactado (gzip) dos QR codes válidos do evento,
+    para validação offline nos portões. Responde 304 se o dispositivo já
+    possui a versão atual (If-None-Match). O cliente deve enviar
+    Accept: application/octet-stream.
+    """
+    try:
+        denied = check_event_organizer(payment_api.current_request, event_id, db)
+        if denied:
+            return _forbidden(denied)
+        payment_usecase = PaymentUseCase()
+        result, status_code = payment_usecase.get_checkin_snapshot(event_id, db)
+        if status_code != 200:
+            return Response(
+                body=firestore_json_dumps(result),
+                status_code=status_code,
+                headers={'Content-Type': 'application/json'}
+            )
+        payload, version = result
+        headers = {'ETag': f'"{version}"', 'X-Snapshot-Version': version}
+        if_none_match = payment_api.current_request.headers.get('if-none-match', '')
+        if if_none_match.strip('"') == version:
+            return Response(body='', status_code=304, headers=headers)
+        return Response(
+            body=payload,
+            status_code=200,
+            headers={**headers, 'Content-Type': 'application/octet-stream'}
+        )
+    except Exception as e:
+        return Response(
+            body=firestore_json_dumps({'error': str(e)}),
+            status_code=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
+@payment_api.route('/events/{event_id}/checkins/bulk', methods=['POST'], cors=cors_config, authorizer=firebase_auth)
+def bulk_checkin(event_id):
+    """
+    Recebe em lote os check-ins coletados offline pelos portões. Os
+    check-ins são atribuídos ao usuário autenticado.
+    """
+    try:
+        request = payment_api.current_request
+        denied = check_event_organizer(request, event_id, db)
+        if denied:
+            return _forbidden(denied)
+        data = request.json_body
+        if not data or 'checkins' not in data:
+            return Response(
+                body={'error': 'Missing required field: checkins'},
+                status_code=400,
+                headers={'Content-Type': 'application/json'}
+            )
+        payment_usecase = PaymentUseCase()
+        result, status_code = payment_usecase.bulk_checkin(event_id, data['checkins'], request_user_id(request), db)
+        return Response(
+            body=firestore_json_dumps(result) if isinstance(result, dict) else result,
+            status_code=status_code,
+            headers={'Content-Type': 'application/json'}
+        )
+    except Exception as e:
+        return Response(
+            body=firestore_json_dumps({'error': str(e)}),
+            status_code=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
+@payment_api.route('/events/{event_id}/qr-index/backfill', methods=['POST'], cors=cors_config, authorizer=firebase_auth)
+def backfill_qr_index(event_id):
+    """
+    Indexa em qr_index os QR codes dos pedidos já existentes do evento.
+    """
+    try:
+        denied = check_event_organizer(payment_api.current_request, event_id, db)
+        if denied:
+            return _forbidden(denied)
+        indexed = QrIndexRepository(db).backfill(event_id)
+        return Response(
+            body=firestore_json_dumps({'event_id': event_id, 'indexed': indexed}),
+            status_code=200,
+            headers={'Content-Type': 'application/json'}
+        )
+    except Exception as e:
+        return Response(
+            body=firestore_json_dumps({'error': str(e)}),
+            status_code=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
+@payment_api.route('/events/{event_id}/qr-keys/rotate', methods=['POST'], cors=cors_config, authorizer=firebase_auth)
+def rotate_qr_key(event_id):
+    """
+    Rotaciona a chave de assinatura dos QR codes do evento.
+    Body opcional: {"revoke_previous": true} para invalidar tokens antigos.
+    """
+    try:
+        denied = check_event_organizer(payment_api.current_request, event_id, db)
+        if denied:
+            return _forbidden(denied)
+        data = payment_api.current_request.json_body or {}
+        payment_usecase = PaymentUseCase()
+        result, status_code = payment_usecase.rotate_qr_key(event_id, bool(data.get('revoke_previous', False)), db)
+        return Response(
+            body=firestore_json_dumps(result),
+            status_code=status_code,
+            headers={'Content-Type': 'application/json'}
+        )
+    except Exception as e:
+        return Response(
+            body=firestore_json_dumps({'error': str(e)}),
+            status_code=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
+@payment_api.route('/payments-index/backfill', methods=['POST'], cors=cors_config, authorizer=firebase_auth)
+def backfill_payments_index():
+    """
+    Indexa em payments_index as cobranças dos pedidos já existentes.
+    """
+    try:
+        denied = check_admin(payment_api.current_request)
+        if denied:
+            return _forbidden(denied)
+        indexed = PaymentIndexRepository(db).backfill()
+        return Response(
+            body=firestore_json_dumps({'indexed': indexed}),
+            status_code=200,
+            headers={'Content-Type': 'application/json'}
+        )
+    except Exception as e:
+        return Response(
+            body=firestore_json_dumps({'error': str(e)}),
+            status_code=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
+@payment_api.route('/asaas/metrics', methods=['GET'], cors=cors_config, authorizer=firebase_auth)
+def get_asaas_metrics():
+    """
+    Latência, erros e estado do circuit breaker por endpoint do Asaas
+    (métricas do container que atendeu a requisição). Restrito a administradores.
+    """
+    try:
+        denied = check_admin(payment_api.current_request)
+        if denied:
+            return _forbidden(denied)
+        return Response(
+            body=firestore_json_dumps(asaas_usecase.get_metrics()),
+            status_code=200,
+            headers={'Content-Type': 'application/json'}
+        )
+    except Exception as e:
+        return Response(
+            body=firestore_json_dumps({'error': str(e)}),
+            status_code=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
 @payment_api.route('/update-order-status/{order_id}', methods=['POST'], cors=cors_config)
 def update_order_status(order_id):
     """
@@ -1,6 +1,7 @@
 import json
 from datetime import datetime, timedelta
 from chalice import Blueprint, Response, CORSConfig
+from chalicelib.src.repositories.event_stats_repository import EventStatsRepository
 from chalicelib.src.utils.firebase import db
 
 cors_config = CORSConfig(
@@ -11,6 +12,7 @@ cors_config = CORSConfig(
 
 transfer_api = Blueprint(__name__)
 transfer_api.cors = cors_config
+event_stats_repository = EventStatsRepository(db)
 
 @transfer_api.route('/events/{event_id}/transfers', methods=['GET'], cors=cors_config)
 def get_transfer_requests(event_id):
@@ -96,28 +98,17 @@ def create_transfer_request(event_id):
                 headers={'Content-Type': 'application/json'}
             )
         
-        # Buscar dados financeiros do evento para validação
-        orders = db.collection('orders').where('event_id', '==', event_id).stream()
-        
-        valor_confirmado = 0
-        valor_pendente = 0
-        valor_repassado = 0
-        
-        for order in orders:
-            order_data = order.to_dict()
-            order_total = order_data.get('total_amount', 0)
-            order_status = order_data.get('status', '')
-            
-            payment_details = order_data.get('payment_details', {})
-            is_transferred = payment_details.get('transferred_to_organizer', False)
-            
-            if order_status in ['CONFIRMADO', 'CONFIRMED', 'RECEIVED']:
-                if is_transferred:
-                    valor_repassado += order_total
-                else:
-                    valor_confirmado += order_data.get('subtotal_amount', order_data.get('valor', 0))
-            elif order_status in ['PAGAMENTO PENDENTE', 'PENDING']:
-                valor_pendente += order_data.get('subtotal_amount', order_data.get('valor', 0))
+        # Buscar dados financeiros do evento para validação (agregado incremental)
+        event_stats = event_stats_repository.get_stats(event_id)
+        if not event_stats.get('initialized'):
+            # Saldo incompleto enquanto pedidos antigos não foram contados
+            return Response(
+                body=json.dumps({"error": "Saldo do evento em atualização. Tente novamente em alguns minutos."}),
+                status_code=503,
+                headers={'Content-Type': 'application/json'}
+            )
+        valor_confirmado = event_stats.get('saldoRepasse', 0)
+        valor_pendente = event_stats.get('saldoRepassePendente', 0)
         
         # Validar se há valor disponível
         max_amount = valor_confirmado + (valor_pendente if is_advance else 0)
@@ -153,9 +144,12 @@ def create_transfer_request(event_id):
             'updated_at': datetime.now()
         }
         
-        # Salvar no Firestore
-        transfer_ref = db.collection('transfer_requests').add(transfer_data)
-        transfer_id = transfer_ref[1].id
+        # Salvar no Firestore junto com o total de repasses pendentes do evento
+        transfer_ref = db.collection('transfer_requests').document()
+        batch = db.batch()
+        event_stats_repository.create_transfer(batch, transfer_ref, transfer_data)
+        batch.commit()
+        transfer_id = transfer_ref.id
         
         # Retornar dados da solicitação criada
         transfer_data['id'] = transfer_id
@@ -197,16 +191,7 @@ def update_transfer_status(event_id, transfer_id):
                 headers={'Content-Type': 'application/json'}
             )
         
-        # Buscar solicitação de repasse
         transfer_ref = db.collection('transfer_requests').document(transfer_id)
-        transfer = transfer_ref.get()
-        
-        if not transfer.exists:
-            return Response(
-                body=json.dumps({"error": "Solicitação de repasse não encontrada"}),
-                status_code=404,
-                headers={'Content-Type': 'application/json'}
-            )
         
         # Atualizar status
         new_status = request_data.get('status')
@@ -231,7 +216,14 @@ def update_transfer_status(event_id, transfer_id):
         if new_status == 'COMPLETED':
             update_data['completed_at'] = datetime.now()
         
-        transfer_ref.update(update_data)
+        # Buscar e atualizar a solicitação, ajustando os repasses pendentes do evento
+        updated = event_stats_repository.update_transfer(transfer_ref, event_id, update_data)
+        if not updated:
+            return Response(
+                body=json.dumps({"error": "Solicitação de repasse não encontrada"}),
+                status_code=404,
+                headers={'Content-Type': 'application/json'}
+            )
         
         return Response(
             body=json.dumps({"message": "Status atualizado com sucesso"}),
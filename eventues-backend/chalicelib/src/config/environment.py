@@ -57,17 +57,120 @@ class EnvironmentConfig:
         if not api_key:
             raise ValueError(f"ASAAS_API_KEY not defined for {self.environment} environment")
         
-        # Set API URL based on environment
+        # Set API URL based on environment (ASAAS_API_URL overrides it, e.g. for a local stub server)
         if self.is_production:
             api_url = "https://www.asaas.com/api/v3"
         else:
             api_url = "https://sandbox.asaas.com/api/v3"
+        api_url = os.getenv("ASAAS_API_URL") or api_url
         
         return {
             'api_key': api_key,
-            'api_url': api_url
+            'api_url': api_url,
+            'connect_timeout': float(os.getenv('ASAAS_CONNECT_TIMEOUT_SECONDS', '3.05')),
+            'read_timeout': float(os.getenv('ASAAS_READ_TIMEOUT_SECONDS', '10')),
+            'max_retries': int(os.getenv('ASAAS_MAX_RETRIES', '2')),
+            'retry_backoff': float(os.getenv('ASAAS_RETRY_BACKOFF_SECONDS', '0.2')),
+            'pool_size': int(os.getenv('ASAAS_POOL_SIZE', '10')),
+            'circuit_breaker': {
+                'window_seconds': float(os.getenv('ASAAS_BREAKER_WINDOW_SECONDS', '60')),
+                'min_calls': int(os.getenv('ASAAS_BREAKER_MIN_CALLS', '10')),
+                'error_rate_threshold': float(os.getenv('ASAAS_BREAKER_ERROR_RATE', '0.5')),
+                'p95_latency_ms': float(os.getenv('ASAAS_BREAKER_P95_LATENCY_MS', '5000')),
+                'open_seconds': float(os.getenv('ASAAS_BREAKER_OPEN_SECONDS', '30')),
+                'half_open_max_calls': int(os.getenv('ASAAS_BREAKER_HALF_OPEN_CALLS', '1'))
+            }
         }
     
+    def get_analytics_config(self) -> Dict[str, Any]:
+        """Get page view analytics configuration"""
+        return {
+            'pageview_shards': int(os.getenv('PAGEVIEW_SHARDS', '10')),
+            'pageview_cache_ttl': float(os.getenv('PAGEVIEW_CACHE_TTL_SECONDS', '30')),
+            'pageview_buffer_enabled': os.getenv('PAGEVIEW_BUFFER_ENABLED', 'true').lower() == 'true',
+            'pageview_flush_interval': float(os.getenv('PAGEVIEW_FLUSH_INTERVAL_SECONDS', '5')),
+            'pageview_flush_max_hits': int(os.getenv('PAGEVIEW_FLUSH_MAX_HITS', '100')),
+            'pageview_buffer_max_pending': int(os.getenv('PAGEVIEW_BUFFER_MAX_PENDING', '1000')),
+            'pageview_flush_max_events': int(os.getenv('PAGEVIEW_FLUSH_MAX_EVENTS', '100')),
+            'pageview_flush_max_sketch_merges': int(os.getenv('PAGEVIEW_FLUSH_MAX_SKETCH_MERGES', '5'))
+        }
+    
+    def get_stats_config(self) -> Dict[str, Any]:
+        """Get sharded event counter configuration"""
+        return {
+            'checkin_shards': int(os.getenv('CHECKIN_STATS_SHARDS', '10')),
+            'event_shards': int(os.getenv('EVENT_STATS_SHARDS', '10')),
+            'event_backfill_page_size': int(os.getenv('EVENT_STATS_BACKFILL_PAGE_SIZE', '200'))
+        }
+    
+    def get_export_config(self) -> Dict[str, Any]:
+        """Get participant/order export job configuration"""
+        return {
+            'worker_mode': os.getenv('EXPORT_WORKER_MODE', 'scheduled').lower(),
+            'page_size': int(os.getenv('EXPORT_PAGE_SIZE', '500')),
+            'url_expiration_minutes': int(os.getenv('EXPORT_URL_EXPIRATION_MINUTES', '60')),
+            'job_timeout_minutes': int(os.getenv('EXPORT_JOB_TIMEOUT_MINUTES', '15'))
+        }
+    
+    def get_webhook_config(self) -> Dict[str, Any]:
+        """Get Asaas webhook ingestion configuration"""
+        return {
+            'dedupe_ttl_days': int(os.getenv('WEBHOOK_DEDUPE_TTL_DAYS', '7')),
+            'worker_mode': os.getenv('WEBHOOK_WORKER_MODE', 'queue').lower(),
+            'batch_size': int(os.getenv('WEBHOOK_BATCH_SIZE', '200')),
+            'max_attempts': int(os.getenv('WEBHOOK_MAX_ATTEMPTS', '5')),
+            'drain_budget_seconds': float(os.getenv('WEBHOOK_DRAIN_BUDGET_SECONDS', '40'))
+        }
+    
+    def get_idempotency_config(self) -> Dict[str, Any]:
+        """Get Idempotency-Key retention and in-flight lock configuration"""
+        return {
+            'ttl_hours': int(os.getenv('IDEMPOTENCY_TTL_HOURS', '24')),
+            'lock_seconds': int(os.getenv('IDEMPOTENCY_LOCK_SECONDS', '60'))
+        }
+    
+    def get_checkout_config(self) -> Dict[str, Any]:
+        """Get checkout I/O configuration (worker pool and payment status caches)"""
+        return {
+            'io_workers': int(os.getenv('CHECKOUT_IO_WORKERS', '4')),
+            'status_fresh_seconds': float(os.getenv('PAYMENT_STATUS_FRESH_SECONDS', '15')),
+            'status_live_interval': float(os.getenv('PAYMENT_STATUS_LIVE_INTERVAL_SECONDS', '10'))
+        }
+    
+    def get_auth_config(self) -> Dict[str, Any]:
+        """Get Firebase ID token verification cache and platform admin configuration"""
+        return {
+            'token_cache_ttl': float(os.getenv('VERIFY_TOKEN_CACHE_TTL_SECONDS', '300')),
+            'admin_user_ids': [uid.strip() for uid in os.getenv('ADMIN_USER_IDS', '').split(',') if uid.strip()]
+        }
+    
+    def get_inventory_config(self) -> Dict[str, Any]:
+        """Get ticket inventory reservation configuration"""
+        return {
+            'shards': int(os.getenv('INVENTORY_SHARDS', '10')),
+            'hold_minutes': int(os.getenv('INVENTORY_HOLD_MINUTES', '15')),
+            'payment_grace_days': int(os.getenv('INVENTORY_PAYMENT_GRACE_DAYS', '1')),
+            'sweep_batch_size': int(os.getenv('INVENTORY_SWEEP_BATCH_SIZE', '100'))
+        }
+    
+    def get_waiting_room_config(self) -> Dict[str, Any]:
+        """Get virtual waiting room configuration (admission rate and queue tokens)"""
+        return {
+            'admission_rate': float(os.getenv('WAITING_ROOM_ADMISSION_RATE', '5')),
+            'token_ttl': int(os.getenv('WAITING_ROOM_TOKEN_TTL_SECONDS', '900')),
+            'shards': int(os.getenv('WAITING_ROOM_SHARDS', '50')),
+            'join_attempts': int(os.getenv('WAITING_ROOM_JOIN_ATTEMPTS', '5')),
+            'settings_cache_ttl': float(os.getenv('WAITING_ROOM_SETTINGS_CACHE_TTL_SECONDS', '10'))
+        }
+    
+    def get_debug_logging(self) -> bool:
+        """Whether per-request [DEBUG]/[PERF] timing logs are printed on hot paths"""
+        return os.getenv('DEBUG_LOGGING', 'false').lower() == 'true'
+    
+    def get_qr_signing_secret(self) -> str:
+        """Get the master secret used to derive per-event QR signing keys"""
+        return os.getenv('QR_SIGNING_SECRET', '')
+    
     def get_cors_origins(self) -> list:
         """Get allowed CORS origins for current environment"""
         if self.is_production:
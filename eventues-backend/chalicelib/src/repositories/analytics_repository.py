@@ -1,70 +1,209 @@
+import random
+from cachetools import TTLCache
 from firebase_admin import firestore
 from datetime import datetime
+from chalicelib.src.config.environment import env_config
+from chalicelib.src.utils.hyperloglog import HyperLogLog
+
+analytics_config = env_config.get_analytics_config()
+
+# Cache curto do total de visualizações, compartilhado entre invocações do container
+_page_views_cache = TTLCache(maxsize=1024, ttl=analytics_config['pageview_cache_ttl'])
+_unique_visitors_cache = TTLCache(maxsize=1024, ttl=analytics_config['pageview_cache_ttl'])
 
 class AnalyticsRepository:
-    def __init__(self, db):
+    def __init__(self, db, num_shards: int = None):
         self.db = db
         self.collection = 'event_analytics'
+        self.shards_collection = 'shards'
+        self.unique_visitors_collection = 'unique_visitors'
+        self.num_shards = num_shards or analytics_config['pageview_shards']
+    
+    def _shard_ref(self, event_id, shard_id):
+        return self.db.collection(self.collection).document(event_id)\
+                      .collection(self.shards_collection).document(str(shard_id))
     
-    def increment_page_view(self, event_id):
+    def increment_page_view(self, event_id, count=1, writer=None):
         """
         Incrementa o contador de visualizações para um evento específico.
         
+        O contador é distribuído em N shards: cada incremento escolhe um shard
+        aleatório e usa Increment no servidor, sem leitura nem transação, o que
+        evita a contenção de escrita de um único documento por evento.
+        
+        Args:
+            event_id (str): ID do evento
+            count (int): Quantidade de visualizações a somar
+            writer: Batch opcional; se informado, a escrita é apenas registrada nele
+        """
+        shard_ref = self._shard_ref(event_id, random.randrange(self.num_shards))
+        shard_data = {
+            'visualizacoes': firestore.Increment(count),
+            'updated_at': datetime.now()
+        }
+        if writer is not None:
+            writer.set(shard_ref, shard_data, merge=True)
+        else:
+            shard_ref.set(shard_data, merge=True)
+    
+    def get_page_views(self, event_id):
+        """
+        Obtém o número total de visualizações para um evento.
+        
+        Soma todos os shards e o contador legado do documento principal
+        (visualizações registradas antes da distribuição em shards).
+        O resultado fica em cache por alguns segundos.
+        
         Args:
             event_id (str): ID do evento
             
         Returns:
-            int: Número total de visualizações após o incremento
+            int: Número total de visualizações
         """
+        cached = _page_views_cache.get(event_id)
+        if cached is not None:
+            return cached
+        
         analytics_ref = self.db.collection(self.collection).document(event_id)
+        legacy_doc = analytics_ref.get()
+        total_views = legacy_doc.to_dict().get('visualizacoes', 0) if legacy_doc.exists else 0
+        
+        for shard in analytics_ref.collection(self.shards_collection).stream():
+            total_views += shard.to_dict().get('visualizacoes', 0)
+        
+        _page_views_cache[event_id] = total_views
+        return total_views
+    
+    def _visitors_ref(self, event_id):
+        return self.db.collection(self.collection).document(event_id)\
+                      .collection(self.unique_visitors_collection)
+    
+    def merge_unique_visitors(self, event_id, sketches_by_day):
+        """
+        Une sketches HyperLogLog de visitantes aos sketches do evento.
         
-        # Tentar obter o documento atual
-        analytics_doc = analytics_ref.get()
+        Como as visualizações, os sketches são distribuídos em N shards: cada
+        escrita escolhe um shard aleatório e une os sketches ao sketch diário
+        ({dia}__{shard}) e ao acumulado (total__{shard}) daquele shard, numa
+        transação que só toca esses documentos. A contagem une os shards na
+        leitura. Sketches que não alteram nenhum registrador não são gravados.
+        
+        Args:
+            event_id (str): ID do evento
+            sketches_by_day (dict): {'YYYY-MM-DD': HyperLogLog}
+        """
+        shard = random.randrange(self.num_shards)
+        visitors_ref = self._visitors_ref(event_id)
+        total_ref = visitors_ref.document(f"total__{shard}")
+        day_refs = {day: visitors_ref.document(f"{day}__{shard}") for day in sketches_by_day}
         
-        # Utilizar transação para garantir consistência
         transaction = self.db.transaction()
         
         @firestore.transactional
-        def update_in_transaction(transaction, doc_ref, doc_snapshot):
-            # Se o documento não existir, criar com visualizações = 1
-            if not doc_snapshot.exists:
-                transaction.set(doc_ref, {
-                    'event_id': event_id,
-                    'visualizacoes': 1,
-                    'created_at': datetime.now(),
-                    'updated_at': datetime.now()
-                })
-                return 1
-            
-            # Caso contrário, incrementar o contador
-            current_data = doc_snapshot.to_dict()
-            new_count = current_data.get('visualizacoes', 0) + 1
-            
-            transaction.update(doc_ref, {
-                'visualizacoes': new_count,
-                'updated_at': datetime.now()
-            })
+        def merge_in_transaction(transaction):
+            snapshots = {day: ref.get(transaction=transaction) for day, ref in day_refs.items()}
+            total_snapshot = total_ref.get(transaction=transaction)
             
-            return new_count
+            total_sketch = self._load_sketch(total_snapshot)
+            total_changed = False
+            for day, sketch in sketches_by_day.items():
+                day_sketch = self._load_sketch(snapshots[day])
+                # Grava também quando há registradores avulsos a consolidar no hll
+                if day_sketch.merge(sketch) or (snapshots[day].to_dict() or {}).get('registers'):
+                    transaction.set(day_refs[day], self._sketch_data(event_id, day_sketch, day, shard))
+                total_changed = total_sketch.merge(sketch) or total_changed
+            if total_changed or (total_snapshot.to_dict() or {}).get('registers'):
+                transaction.set(total_ref, self._sketch_data(event_id, total_sketch, shard=shard))
         
-        # Executar a transação
-        total_views = update_in_transaction(transaction, analytics_ref, analytics_doc)
-        return total_views
+        merge_in_transaction(transaction)
+        _unique_visitors_cache.pop(event_id, None)
     
-    def get_page_views(self, event_id):
+    def record_unique_visitor(self, event_id, visitor_id, writer=None):
         """
-        Obtém o número total de visualizações para um evento.
+        Registra um único visitante (usado quando o buffer de visualizações está desativado).
+        
+        Um visitante altera no máximo um registrador do sketch, então a escrita
+        é cega: Maximum no servidor sobre o registrador dos documentos diário e
+        acumulado de um shard aleatório, sem leitura nem transação. Os
+        registradores avulsos são unidos ao sketch na leitura.
+        
+        Args:
+            event_id (str): ID do evento
+            visitor_id (str): Identificador do visitante
+            writer: Batch opcional; se informado, as escritas são apenas registradas nele
+        """
+        shard = random.randrange(self.num_shards)
+        day = datetime.now().strftime('%Y-%m-%d')
+        index, rank = HyperLogLog().position(visitor_id)
+        visitors_ref = self._visitors_ref(event_id)
+        
+        batch = writer if writer is not None else self.db.batch()
+        for ref, extra in (
+            (visitors_ref.document(f"{day}__{shard}"), {'day': day}),
+            (visitors_ref.document(f"total__{shard}"), {}),
+        ):
+            batch.set(ref, {
+                'event_id': event_id,
+                'shard': shard,
+                'registers': {str(index): firestore.Maximum(rank)},
+                'updated_at': datetime.now(),
+                **extra
+            }, merge=True)
+        if writer is None:
+            batch.commit()
+    
+    def get_unique_visitors(self, event_id):
+        """
+        Obtém a estimativa de visitantes únicos do evento, unindo os sketches
+        acumulados dos shards (e o sketch único anterior aos shards) com um
+        único get_all. O resultado fica em cache por alguns segundos.
         
         Args:
             event_id (str): ID do evento
             
         Returns:
-            int: Número total de visualizações
+            int: Número aproximado de visitantes únicos
         """
-        analytics_ref = self.db.collection(self.collection).document(event_id)
-        analytics_doc = analytics_ref.get()
+        cached = _unique_visitors_cache.get(event_id)
+        if cached is not None:
+            return cached
         
-        if not analytics_doc.exists:
-            return 0
+        visitors_ref = self._visitors_ref(event_id)
+        refs = [visitors_ref.document('total')] + [
+            visitors_ref.document(f"total__{shard}") for shard in range(self.num_shards)
+        ]
+        total_sketch = HyperLogLog()
+        for snapshot in self.db.get_all(refs):
+            total_sketch.merge(self._load_sketch(snapshot))
+        unique_visitors = total_sketch.count()
         
-        return analytics_doc.to_dict().get('visualizacoes', 0)
+        _unique_visitors_cache[event_id] = unique_visitors
+        return unique_visitors
+    
+    @staticmethod
+    def _load_sketch(snapshot):
+        """Sketch do documento: bytes do hll unidos aos registradores avulsos (escritas cegas)."""
+        if not snapshot.exists:
+            return HyperLogLog()
+        data = snapshot.to_dict()
+        if data.get('hll'):
+            sketch = HyperLogLog.from_bytes(data['hll'], precision=data.get('precision', 12))
+        else:
+            sketch = HyperLogLog()
+        for index, rank in (data.get('registers') or {}).items():
+            sketch.update_register(int(index), rank)
+        return sketch
+    
+    @staticmethod
+    def _sketch_data(event_id, sketch, day=None, shard=None):
+        data = {
+            'event_id': event_id,
+            'shard': shard,
+            'hll': sketch.to_bytes(),
+            'precision': sketch.precision,
+            'visitantes_unicos': sketch.count(),
+            'updated_at': datetime.now()
+        }
+        if day:
+            data['day'] = day
+        return data
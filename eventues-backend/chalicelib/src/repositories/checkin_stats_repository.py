@@ -0,0 +1,148 @@
+import random
+from firebase_admin import firestore
+from datetime import datetime
+from chalicelib.src.config.environment import env_config
+
+stats_config = env_config.get_stats_config()
+
+CONFIRMED_STATUSES = ['CONFIRMADO', 'CONFIRMED', 'RECEIVED']
+
+CHECKIN_FIELDS = ['checkin', 'checkin_timestamp', 'checkin_by', 'checkin_updated_at', 'checkin_synced_at']
+
+
+def ticket_checkin_state(order_data: dict, ticket_index: int) -> dict:
+    """
+    Estado de check-in de um ingresso. A entrada checkins.{índice} do pedido
+    prevalece sobre os campos legados gravados dentro do próprio ticket.
+    """
+    tickets = order_data.get('tickets') or []
+    ticket = tickets[ticket_index] if 0 <= ticket_index < len(tickets) and isinstance(tickets[ticket_index], dict) else {}
+    state = {
+        'checkin': ticket.get('checkin', False),
+        'checkin_timestamp': ticket.get('checkin_timestamp'),
+        'checkin_by': ticket.get('checkin_by'),
+        'checkin_updated_at': ticket.get('checkin_updated_at'),
+        'checkin_synced_at': ticket.get('checkin_updated_at')
+    }
+    entry = (order_data.get('checkins') or {}).get(str(ticket_index))
+    if isinstance(entry, dict):
+        state.update({field: entry.get(field) for field in CHECKIN_FIELDS if field in entry})
+    state['checkin'] = bool(state['checkin'])
+    return state
+
+
+class CheckinStatsRepository:
+    """
+    Contadores de check-in do evento: total e por tipo de ingresso
+    (ticket_id). O documento checkin_stats/{event_id} guarda a última
+    reconstrução; as variações dos check-ins vão para um shard aleatório
+    em checkin_stats/{event_id}/shards/{n}, na mesma escrita do check-in,
+    e a leitura soma a base e os shards.
+    """
+
+    def __init__(self, db, num_shards: int = None):
+        self.db = db
+        self.collection = 'checkin_stats'
+        self.num_shards = num_shards or stats_config['checkin_shards']
+
+    def _stats_ref(self, event_id):
+        return self.db.collection(self.collection).document(event_id)
+
+    def _shard_ref(self, event_id, shard: int):
+        return self._stats_ref(event_id).collection('shards').document(str(shard))
+
+    def apply(self, writer, event_id: str, ticket_id: str, was_checked_in: bool, is_checked_in: bool):
+        """
+        Registra no writer (batch ou transação) a variação dos contadores
+        quando o estado de check-in de um ingresso muda.
+        """
+        if bool(was_checked_in) != bool(is_checked_in):
+            self.apply_counts(writer, event_id, {ticket_id: 1 if is_checked_in else -1})
+
+    def apply_counts(self, writer, event_id: str, deltas: dict):
+        """
+        Registra no writer variações já agregadas por ticket_id, em um shard
+        aleatório (escrita cega com Increment, sem leitura).
+        """
+        deltas = {ticket_id or 'sem_ingresso': delta for ticket_id, delta in deltas.items() if delta}
+        if not event_id or not deltas:
+            return
+        writer.set(self._shard_ref(event_id, random.randrange(self.num_shards)), {
+            'total': firestore.Increment(sum(deltas.values())),
+            'por_ingresso': {ticket_id: firestore.Increment(delta) for ticket_id, delta in deltas.items()},
+            'updated_at': datetime.now()
+        }, merge=True)
+
+    @staticmethod
+    def merge_counts(stats: dict, shard_data: dict) -> dict:
+        """Soma os contadores de um shard aos contadores da base."""
+        stats['total'] = stats.get('total', 0) + shard_data.get('total', 0)
+        por_ingresso = dict(stats.get('por_ingresso') or {})
+        for ticket_id, count in (shard_data.get('por_ingresso') or {}).items():
+            por_ingresso[ticket_id] = por_ingresso.get(ticket_id, 0) + count
+        stats['por_ingresso'] = por_ingresso
+        return stats
+
+    def rebuild(self, event_id: str) -> dict:
+        """
+        Recalcula os contadores a partir dos pedidos confirmados do evento e
+        zera os shards. A leitura dos pedidos e dos shards e as gravações
+        acontecem na mesma transação, então check-ins concorrentes fazem a
+        transação ser repetida em vez de serem perdidos ou contados duas vezes.
+
+        Args:
+            event_id (str): ID do evento
+
+        Returns:
+            dict: Contadores recalculados
+        """
+        orders_query = self.db.collection('orders')\
+                           .where('event_id', '==', event_id)\
+                           .where('status', 'in', CONFIRMED_STATUSES)\
+                           .select(['tickets', 'checkins'])
+        shard_refs = [self._shard_ref(event_id, shard) for shard in range(self.num_shards)]
+        transaction = self.db.transaction()
+
+        @firestore.transactional
+        def rebuild_in_transaction(transaction):
+            stats = {'event_id': event_id, 'total': 0, 'por_ingresso': {}}
+            for order in transaction.get(orders_query):
+                order_data = order.to_dict()
+                tickets = order_data.get('tickets', [])
+                if not isinstance(tickets, list):
+                    continue
+                for ticket_idx, ticket in enumerate(tickets):
+                    if ticket_checkin_state(order_data, ticket_idx)['checkin']:
+                        ticket_id = ticket.get('ticket_id') or 'sem_ingresso'
+                        stats['total'] += 1
+                        stats['por_ingresso'][ticket_id] = stats['por_ingresso'].get(ticket_id, 0) + 1
+            shard_docs = list(transaction.get_all(shard_refs))
+
+            stats['initialized'] = True
+            stats['rebuilt_at'] = datetime.now()
+            stats['updated_at'] = datetime.now()
+            transaction.set(self._stats_ref(event_id), stats)
+            for shard_doc in shard_docs:
+                if shard_doc.exists:
+                    transaction.delete(shard_doc.reference)
+            return stats
+
+        return rebuild_in_transaction(transaction)
+
+    def get(self, event_id: str) -> dict:
+        """
+        Lê a base e os shards com um único get_all e soma os contadores,
+        reconstruindo-os caso ainda não tenham sido inicializados.
+        """
+        stats_ref = self._stats_ref(event_id)
+        refs = [stats_ref] + [self._shard_ref(event_id, shard) for shard in range(self.num_shards)]
+        docs = {doc.reference.path: doc for doc in self.db.get_all(refs)}
+        base_doc = docs.pop(stats_ref.path, None)
+        if base_doc is None or not base_doc.exists or not base_doc.to_dict().get('initialized'):
+            return self.rebuild(event_id)
+
+        stats = base_doc.to_dict()
+        for shard_doc in docs.values():
+            if shard_doc.exists:
+                self.merge_counts(stats, shard_doc.to_dict())
+        return stats
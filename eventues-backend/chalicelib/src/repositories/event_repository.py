@@ -24,15 +24,15 @@ class EventRepository:
         ticket_id = str(uuid.uuid4())
         new_ticket = ticket.to_dict()
         new_ticket['id'] = ticket_id
-        # Remove a lista de lotes do documento principal
-        lotes = new_ticket.pop('lotes', [])
+        # Os lotes ficam também no documento principal, na ordem de venda,
+        # para a resolução do lote atual no checkout
+        lotes = new_ticket.get('lotes') or []
         event_ref.collection('tickets').document(ticket_id).set(new_ticket)
         
-        if lotes is not None:
-            for lote in lotes:
-                lote_id = str(uuid.uuid4())
-                lote['ticket_id'] = ticket_id  # Associação explícita
-                event_ref.collection('tickets').document(ticket_id).collection('lotes').document(lote_id).set(lote)
+        for lote in lotes:
+            lote_id = str(uuid.uuid4())
+            lote = {**lote, 'ticket_id': ticket_id}  # Associação explícita
+            event_ref.collection('tickets').document(ticket_id).collection('lotes').document(lote_id).set(lote)
         
         return ticket
 
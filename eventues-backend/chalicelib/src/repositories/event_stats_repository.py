@@ -0,0 +1,516 @@
+import random
+import time
+from firebase_admin import firestore
+from datetime import datetime
+from google.api_core.exceptions import FailedPrecondition
+from chalicelib.src.config.environment import env_config
+
+stats_config = env_config.get_stats_config()
+
+CONFIRMED_STATUSES = ['CONFIRMADO', 'CONFIRMED', 'RECEIVED']
+PENDING_STATUSES = ['PAGAMENTO PENDENTE', 'PENDING']
+CANCELED_STATUSES = ['CANCELADO', 'REFUNDED', 'DELETED', 'CHARGEBACK_REQUESTED']
+EXPIRED_STATUSES = ['EXPIRADO', 'EXPIRED']
+PENDING_TRANSFER_STATUSES = ['PENDING', 'APPROVED', 'PROCESSING']
+
+# Versão do formato do agregado. Pedidos e repasses já contabilizados levam
+# stats_version; ao mudar a versão, todos voltam a ser contados pelo backfill
+STATS_VERSION = 3
+
+# Tentativas de gravar uma página do backfill quando algum documento mudou
+BACKFILL_PAGE_ATTEMPTS = 5
+
+BACKFILL_COLLECTIONS = ['orders', 'transfer_requests']
+
+PAYMENT_METHOD_KEYS = {
+    'CREDIT_CARD': 'cartaoCredito',
+    'PIX': 'pix',
+    'BOLETO': 'boleto'
+}
+
+
+def order_contribution(order_data: dict) -> dict:
+    """
+    Calcula a contribuição de um pedido para o agregado financeiro do evento.
+
+    Segue exatamente a classificação usada no dashboard do organizador, de modo
+    que a soma das contribuições de todos os pedidos reproduz as estatísticas
+    que antes eram recalculadas a cada carregamento.
+
+    Args:
+        order_data (dict): Dados do pedido
+
+    Returns:
+        dict: Contadores planos (metodosPagamento.* em notação de ponto)
+    """
+    if not order_data:
+        return {}
+
+    order_total = order_data.get('total_amount', 0) or 0
+    order_status = order_data.get('status', '') or ''
+    valor_liquido = order_data.get('subtotal_amount', order_data.get('valor', 0)) or 0
+
+    payment_details = order_data.get('payment_details', {}) or {}
+    billing_type = payment_details.get('billingType', '')
+    asaas_status = payment_details.get('status', '')
+    is_transferred = payment_details.get('transferred_to_organizer', False)
+
+    contribution = {
+        'totalPedidos': 1,
+        f"metodosPagamento.{PAYMENT_METHOD_KEYS.get(billing_type, 'outros')}": 1
+    }
+
+    if order_status in CONFIRMED_STATUSES or asaas_status in ['CONFIRMED', 'RECEIVED']:
+        contribution['receitaTotal'] = order_total
+        contribution['valorConfirmado'] = order_total
+        contribution['pedidosConfirmados'] = 1
+        if is_transferred:
+            contribution['valorRepassado'] = order_total
+        else:
+            contribution['valorAReceberBruto'] = valor_liquido
+    elif order_status in PENDING_STATUSES or asaas_status in ['PENDING', 'AWAITING_PAYMENT']:
+        contribution['receitaTotal'] = order_total
+        contribution['valorPendente'] = order_total
+        contribution['valorPendenteLiquido'] = valor_liquido
+    elif order_status in CANCELED_STATUSES or asaas_status in ['REFUNDED', 'CHARGEBACK_REQUESTED', 'CHARGEBACK_DISPUTE', 'AWAITING_CHARGEBACK_REVERSAL']:
+        contribution['valorCancelado'] = order_total
+    elif order_status in EXPIRED_STATUSES or asaas_status in ['OVERDUE']:
+        contribution['valorCancelado'] = order_total
+
+    # Saldo de repasse: a validação de repasses considera apenas o status do
+    # pedido (não o do Asaas), então é contabilizado à parte do dashboard
+    if order_status in CONFIRMED_STATUSES:
+        if not is_transferred:
+            contribution['saldoRepasse'] = valor_liquido
+    elif order_status in PENDING_STATUSES:
+        contribution['saldoRepassePendente'] = valor_liquido
+
+    return contribution
+
+
+def transfer_contribution(transfer_data: dict) -> dict:
+    """Contribuição de uma solicitação de repasse: o valor, enquanto pendente."""
+    if not transfer_data or transfer_data.get('status') not in PENDING_TRANSFER_STATUSES:
+        return {}
+    return {'repassesPendentes': transfer_data.get('amount', 0) or 0}
+
+
+def empty_stats(event_id: str) -> dict:
+    """Agregado zerado, com todos os contadores exibidos no dashboard."""
+    return {
+        'event_id': event_id,
+        'receitaTotal': 0,
+        'valorConfirmado': 0,
+        'valorPendente': 0,
+        'valorPendenteLiquido': 0,
+        'valorRepassado': 0,
+        'valorCancelado': 0,
+        'valorAReceberBruto': 0,
+        'saldoRepasse': 0,
+        'saldoRepassePendente': 0,
+        'repassesPendentes': 0,
+        'totalPedidos': 0,
+        'pedidosConfirmados': 0,
+        'metodosPagamento': {
+            'cartaoCredito': 0,
+            'pix': 0,
+            'boleto': 0,
+            'outros': 0
+        }
+    }
+
+
+def merge_order_update(order_data: dict, update_data: dict) -> dict:
+    """
+    Aplica um update do Firestore (inclusive campos em notação de ponto)
+    sobre uma cópia dos dados do pedido.
+    """
+    merged = dict(order_data or {})
+    for key, value in update_data.items():
+        parts = key.split('.')
+        target = merged
+        for part in parts[:-1]:
+            nested = target.get(part)
+            nested = dict(nested) if isinstance(nested, dict) else {}
+            target[part] = nested
+            target = nested
+        target[parts[-1]] = value
+    return merged
+
+
+def merge_stats(stats: dict, shard_data: dict) -> dict:
+    """Soma os contadores de um shard (inclusive metodosPagamento) ao agregado."""
+    for key, value in shard_data.items():
+        if key == 'metodosPagamento' and isinstance(value, dict):
+            metodos = dict(stats.get('metodosPagamento') or {})
+            for metodo, count in value.items():
+                metodos[metodo] = metodos.get(metodo, 0) + count
+            stats['metodosPagamento'] = metodos
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            stats[key] = stats.get(key, 0) + value
+    return stats
+
+
+class EventStatsRepository:
+    """
+    Mantém o agregado financeiro do evento atualizado de forma incremental,
+    na mesma escrita atômica que altera o pedido. As variações vão para um
+    shard aleatório em event_stats/{event_id}/shards/v{versão}_{n}, de modo
+    que pedidos concorrentes do mesmo evento não disputam um único
+    documento; a leitura soma os shards.
+
+    Só pedidos e repasses marcados com stats_version (criados já com o
+    agregado ou contados pelo backfill) geram variações. Os demais são
+    contados uma única vez pelo backfill, em páginas, sem transação longa.
+    O documento event_stats/{event_id} guarda a versão, o número de shards
+    já usado e o progresso do backfill.
+    """
+
+    def __init__(self, db, num_shards: int = None):
+        self.db = db
+        self.collection = 'event_stats'
+        self.num_shards = num_shards or stats_config['event_shards']
+        self.page_size = stats_config['event_backfill_page_size']
+
+    def _stats_ref(self, event_id):
+        return self.db.collection(self.collection).document(event_id)
+
+    def _shard_ref(self, event_id, shard: int):
+        return self._stats_ref(event_id).collection('shards').document(f"v{STATS_VERSION}_{shard}")
+
+    def _random_shard_ref(self, event_id):
+        return self._shard_ref(event_id, random.randrange(self.num_shards))
+
+    @staticmethod
+    def _increments(delta: dict) -> dict:
+        """Converte contadores planos em Increments (metodosPagamento como mapa)."""
+        stats_update = {'updated_at': datetime.now()}
+        for key, value in delta.items():
+            if key.startswith('metodosPagamento.'):
+                stats_update.setdefault('metodosPagamento', {})[key.split('.', 1)[1]] = firestore.Increment(value)
+            else:
+                stats_update[key] = firestore.Increment(value)
+        return stats_update
+
+    def _apply_delta(self, writer, event_id, before: dict, after: dict):
+        """
+        Registra no writer (batch ou transação) a diferença entre as
+        contribuições antiga e nova de um pedido, via Increment no servidor.
+        """
+        if not event_id:
+            return
+
+        old = order_contribution(before)
+        new = order_contribution(after)
+
+        delta = {}
+        for key in set(old) | set(new):
+            value = new.get(key, 0) - old.get(key, 0)
+            if value:
+                delta[key] = value
+
+        if not delta:
+            return
+
+        writer.set(self._random_shard_ref(event_id), self._increments(delta), merge=True)
+
+    def create_order(self, order_ref, order_data: dict, on_create=None, writer=None):
+        """
+        Cria o pedido e contabiliza sua contribuição no mesmo batch.
+
+        Args:
+            on_create: Callback opcional (batch, order_id, order_data) para
+                registrar escritas adicionais no mesmo batch
+            writer: Transação opcional; se informada, as escritas são apenas
+                registradas nela e confirmadas pelo chamador
+        """
+        batch = writer if writer is not None else self.db.batch()
+        batch.set(order_ref, {**order_data, 'stats_version': STATS_VERSION})
+        self._apply_delta(batch, order_data.get('event_id'), {}, order_data)
+        if on_create:
+            on_create(batch, order_ref.id, order_data)
+        if writer is None:
+            batch.commit()
+
+    def update_order(self, order_ref, update_data: dict, on_update=None, prepare=None):
+        """
+        Atualiza o pedido dentro de uma transação, aplicando ao agregado a
+        diferença entre o estado anterior e o novo.
+
+        Args:
+            order_ref: Referência do pedido
+            update_data (dict | callable): Campos a atualizar, ou função que
+                recebe o estado atual do pedido e devolve os campos (ou None
+                para não alterar nada)
+            on_update: Callback opcional (transaction, order_id, before, after)
+                para registrar escritas adicionais na mesma transação
+            prepare: Função opcional (transaction, before, update) que pode
+                fazer leituras na transação e devolve o update final, antes
+                de qualquer escrita
+
+        Returns:
+            dict: Dados do pedido após o update, ou None se o pedido não existir
+        """
+        transaction = self.db.transaction()
+
+        @firestore.transactional
+        def update_in_transaction(transaction, doc_ref):
+            snapshot = doc_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return None
+
+            before = snapshot.to_dict()
+            update = update_data(before) if callable(update_data) else update_data
+            if not update:
+                return before
+            if prepare:
+                update = prepare(transaction, before, update)
+            return self.write_order_update(transaction, doc_ref, before, update, on_update)
+
+        return update_in_transaction(transaction, order_ref)
+
+    def write_order_update(self, transaction, order_ref, before: dict, update: dict, on_update=None) -> dict:
+        """
+        Registra numa transação já em andamento o update de um pedido lido
+        nela, com a variação do agregado e o callback on_update. Permite que
+        o chamador faça outras leituras na transação antes das escritas.
+        Pedidos ainda não contados pelo backfill não geram variação: o
+        backfill conta o estado em que estiverem.
+
+        Returns:
+            dict: Dados do pedido após o update
+        """
+        after = merge_order_update(before, update)
+        transaction.update(order_ref, update)
+        if before.get('stats_version') == STATS_VERSION:
+            self._apply_delta(transaction, after.get('event_id'), before, after)
+        if on_update:
+            on_update(transaction, order_ref.id, before, after)
+        return after
+
+    def add_pending_transfer(self, writer, event_id: str, amount: float):
+        """
+        Registra no writer a variação do total de repasses pendentes.
+        """
+        if not amount:
+            return
+        writer.set(self._random_shard_ref(event_id), {
+            'repassesPendentes': firestore.Increment(amount),
+            'updated_at': datetime.now()
+        }, merge=True)
+
+    def create_transfer(self, writer, transfer_ref, transfer_data: dict):
+        """
+        Registra no writer a criação da solicitação de repasse e a sua
+        contribuição para os repasses pendentes do evento.
+        """
+        writer.set(transfer_ref, {**transfer_data, 'stats_version': STATS_VERSION})
+        self.add_pending_transfer(
+            writer, transfer_data['event_id'], transfer_contribution(transfer_data).get('repassesPendentes', 0)
+        )
+
+    def update_transfer(self, transfer_ref, event_id: str, update_data: dict):
+        """
+        Atualiza uma solicitação de repasse e ajusta o total de repasses
+        pendentes caso ela entre ou saia dos status pendentes.
+        """
+        transaction = self.db.transaction()
+
+        @firestore.transactional
+        def update_in_transaction(transaction, doc_ref):
+            snapshot = doc_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return None
+
+            transfer_data = snapshot.to_dict()
+            amount = transfer_data.get('amount', 0)
+            was_pending = transfer_data.get('status') in PENDING_TRANSFER_STATUSES
+            is_pending = update_data.get('status', transfer_data.get('status')) in PENDING_TRANSFER_STATUSES
+
+            transaction.update(doc_ref, update_data)
+            if was_pending != is_pending and transfer_data.get('stats_version') == STATS_VERSION:
+                self.add_pending_transfer(transaction, event_id, amount if is_pending else -amount)
+            return True
+
+        return update_in_transaction(transaction, transfer_ref)
+
+    def _count_page(self, event_id: str, collection: str, docs: list) -> int:
+        """
+        Conta no agregado os documentos da página ainda não contados e os
+        marca com stats_version, num único batch. Cada marcação exige que o
+        documento não tenha mudado desde a leitura (update_time); se algum
+        mudou, a página é relida e gravada de novo.
+
+        Returns:
+            int: Documentos contados
+        """
+        contribution_of = order_contribution if collection == 'orders' else transfer_contribution
+        for attempt in range(BACKFILL_PAGE_ATTEMPTS):
+            batch = self.db.batch()
+            delta = {}
+            counted = 0
+            for doc in docs:
+                if not doc.exists or doc.to_dict().get('stats_version') == STATS_VERSION:
+                    continue
+                for key, value in contribution_of(doc.to_dict()).items():
+                    delta[key] = delta.get(key, 0) + value
+                batch.update(
+                    doc.reference, {'stats_version': STATS_VERSION},
+                    option=self.db.write_option(last_update_time=doc.update_time)
+                )
+                counted += 1
+            if not counted:
+                return 0
+            delta = {key: value for key, value in delta.items() if value}
+            if delta:
+                batch.set(self._random_shard_ref(event_id), self._increments(delta), merge=True)
+            try:
+                batch.commit()
+                return counted
+            except FailedPrecondition:
+                # Algum documento foi alterado durante o backfill: relê a página
+                docs = list(self.db.get_all([doc.reference for doc in docs]))
+        raise RuntimeError(f"Backfill do agregado do evento {event_id}: página de {collection} alterada em todas as tentativas")
+
+    def request_backfill(self, event_id: str):
+        """Agenda o backfill do agregado do evento (processado por backfill_pending)."""
+        self._stats_ref(event_id).set({
+            'event_id': event_id,
+            'version': STATS_VERSION,
+            'backfill': {'status': 'pending', 'requested_at': datetime.now()}
+        }, merge=['event_id', 'version', 'backfill'])
+
+    def backfill(self, event_id: str, time_budget: float = None) -> dict:
+        """
+        Conta no agregado, em páginas de page_size, os pedidos e repasses do
+        evento ainda não contados, sem transação: cada página é um batch com
+        precondição por documento (ver _count_page). O progresso (coleção e
+        cursor) fica no documento do agregado, então uma execução
+        interrompida ou sem orçamento de tempo continua de onde parou.
+        Executar de novo é seguro: documentos já marcados são ignorados.
+
+        Args:
+            event_id (str): ID do evento
+            time_budget (float): Segundos disponíveis; sem ele, vai até o fim
+
+        Returns:
+            dict: Progresso do backfill ({'status': 'running' | 'done', ...})
+        """
+        deadline = time.time() + time_budget if time_budget is not None else None
+        stats_ref = self._stats_ref(event_id)
+        stats_doc = stats_ref.get()
+        meta = stats_doc.to_dict() if stats_doc.exists else {}
+        progress = dict(meta.get('backfill') or {}) if meta.get('version') == STATS_VERSION else {}
+        if progress.get('status') == 'done':
+            return progress
+
+        collection = progress.get('collection') or BACKFILL_COLLECTIONS[0]
+        cursor = progress.get('cursor')
+        counted = progress.get('counted', 0)
+        last_doc = self.db.collection(collection).document(cursor).get() if cursor else None
+        while True:
+            query = self.db.collection(collection).where('event_id', '==', event_id).order_by('__name__')
+            if last_doc is not None:
+                query = query.start_after(last_doc)
+            page = list(query.limit(self.page_size).stream())
+            counted += self._count_page(event_id, collection, page)
+
+            if len(page) < self.page_size:
+                next_index = BACKFILL_COLLECTIONS.index(collection) + 1
+                if next_index == len(BACKFILL_COLLECTIONS):
+                    progress = {'status': 'done', 'counted': counted, 'finished_at': datetime.now()}
+                    break
+                collection, last_doc = BACKFILL_COLLECTIONS[next_index], None
+            else:
+                last_doc = page[-1]
+            progress = {
+                'status': 'running',
+                'collection': collection,
+                'cursor': last_doc.id if last_doc is not None else None,
+                'counted': counted,
+                'updated_at': datetime.now()
+            }
+            if deadline is not None and time.time() >= deadline:
+                break
+
+        stats_ref.set({
+            'event_id': event_id,
+            'version': STATS_VERSION,
+            'num_shards': max(meta.get('num_shards', 0) if meta.get('version') == STATS_VERSION else 0, self.num_shards),
+            'backfill': progress
+        }, merge=['event_id', 'version', 'num_shards', 'backfill'])
+        print(f"[DEBUG] Backfill do agregado do evento {event_id}: {progress['status']}, {counted} documento(s) contado(s)")
+        return progress
+
+    def backfill_pending(self, time_budget: float, limit: int = 10) -> int:
+        """
+        Continua os backfills agendados ou interrompidos, dentro do orçamento
+        de tempo.
+
+        Returns:
+            int: Backfills concluídos
+        """
+        deadline = time.time() + time_budget
+        pending = self.db.collection(self.collection)\
+                      .where('backfill.status', 'in', ['pending', 'running'])\
+                      .limit(limit)\
+                      .stream()
+        finished = 0
+        for stats_doc in pending:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            if self.backfill(stats_doc.id, remaining).get('status') == 'done':
+                finished += 1
+        return finished
+
+    def _record_num_shards(self, event_id: str):
+        """
+        Registra no documento do agregado o maior número de shards já usado,
+        para que reduzir EVENT_STATS_SHARDS não deixe de somar shards antigos.
+        """
+        stats_ref = self._stats_ref(event_id)
+        transaction = self.db.transaction()
+
+        @firestore.transactional
+        def record_in_transaction(transaction):
+            stats_doc = stats_ref.get(transaction=transaction)
+            meta = stats_doc.to_dict() if stats_doc.exists else {}
+            if meta.get('version') == STATS_VERSION and meta.get('num_shards', 0) >= self.num_shards:
+                return
+            transaction.set(stats_ref, {'num_shards': self.num_shards}, merge=True)
+
+        record_in_transaction(transaction)
+
+    def get_stats(self, event_id: str) -> dict:
+        """
+        Obtém o agregado do evento somando os shards, lidos com um único
+        get_all junto com o documento do agregado (e um segundo get_all só se
+        já houve mais shards do que os configurados). Nunca reconstrói na
+        leitura: enquanto o backfill não termina, o agregado vem incompleto,
+        com initialized False, e o backfill é agendado.
+        """
+        stats_ref = self._stats_ref(event_id)
+        refs = [stats_ref] + [self._shard_ref(event_id, shard) for shard in range(self.num_shards)]
+        docs = {doc.reference.path: doc for doc in self.db.get_all(refs)}
+        stats_doc = docs.pop(stats_ref.path, None)
+        meta = stats_doc.to_dict() if stats_doc is not None and stats_doc.exists else {}
+        current = meta.get('version') == STATS_VERSION
+
+        stored_shards = meta.get('num_shards', 0) if current else 0
+        if stored_shards > self.num_shards:
+            extra_refs = [self._shard_ref(event_id, shard) for shard in range(self.num_shards, stored_shards)]
+            docs.update({doc.reference.path: doc for doc in self.db.get_all(extra_refs)})
+
+        stats = empty_stats(event_id)
+        for shard_doc in docs.values():
+            if shard_doc.exists:
+                merge_stats(stats, shard_doc.to_dict())
+
+        backfill = (meta.get('backfill') or {}) if current else {}
+        stats['initialized'] = backfill.get('status') == 'done'
+        if not backfill:
+            self.request_backfill(event_id)
+        if stored_shards < self.num_shards:
+            self._record_num_shards(event_id)
+        return stats
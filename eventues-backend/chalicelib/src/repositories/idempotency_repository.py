@@ -0,0 +1,147 @@
+import hashlib
+import json
+from datetime import datetime, timedelta
+from firebase_admin import firestore
+from chalicelib.src.config.environment import env_config
+from chalicelib.src.utils.json_encoder import firestore_json_dumps
+
+idempotency_config = env_config.get_idempotency_config()
+
+IN_PROGRESS = 'in_progress'
+COMPLETED = 'completed'
+
+# Campos da resposta que indicam um efeito já gravado: o pedido criado
+# (create-order) ou a cobrança criada no Asaas (create_payment_session)
+SIDE_EFFECT_KEYS = ('order_id', 'payment_id', 'id')
+
+
+def request_fingerprint(data) -> str:
+    """Hash do corpo da requisição, para detectar a mesma chave com outro payload."""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def has_side_effect(result) -> bool:
+    """A resposta informa um pedido ou cobrança criados (ver SIDE_EFFECT_KEYS)."""
+    return isinstance(result, dict) and any(result.get(key) for key in SIDE_EFFECT_KEYS)
+
+
+class IdempotencyRepository:
+    """
+    Chaves de idempotência em idempotency_keys/{sha256(escopo:chave)} com a
+    resposta da primeira execução. O campo expires_at permite configurar a
+    política de TTL do Firestore para limpar registros antigos.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.collection = 'idempotency_keys'
+
+    def _key_ref(self, scope: str, key: str):
+        doc_id = hashlib.sha256(f"{scope}:{key}".encode('utf-8')).hexdigest()
+        return self.db.collection(self.collection).document(doc_id)
+
+    @staticmethod
+    def _is_live(record: dict) -> bool:
+        """Registro ainda válido: concluído e não expirado, ou em andamento dentro do lock."""
+        now = datetime.now()
+        if record.get('status') == COMPLETED:
+            expires_at = record.get('expires_at')
+            return expires_at is None or expires_at.replace(tzinfo=None) > now
+        locked_until = record.get('locked_until')
+        return locked_until is not None and locked_until.replace(tzinfo=None) > now
+
+    def get(self, scope: str, key: str):
+        """
+        Registro vigente da chave, com uma única leitura.
+
+        Returns:
+            dict: Registro ou None se a chave está livre
+        """
+        key_doc = self._key_ref(scope, key).get()
+        if not key_doc.exists:
+            return None
+        record = key_doc.to_dict()
+        return record if self._is_live(record) else None
+
+    def claim(self, scope: str, key: str, fingerprint: str):
+        """
+        Cria a chave como em andamento se ainda não existir (ou se o registro
+        anterior expirou), numa transação: entre requisições concorrentes com
+        a mesma chave, apenas uma executa.
+
+        Returns:
+            dict: None se a chave foi obtida, senão o registro existente
+        """
+        key_ref = self._key_ref(scope, key)
+        transaction = self.db.transaction()
+
+        @firestore.transactional
+        def claim_in_transaction(transaction):
+            key_doc = key_ref.get(transaction=transaction)
+            if key_doc.exists and self._is_live(key_doc.to_dict()):
+                return key_doc.to_dict()
+            now = datetime.now()
+            transaction.set(key_ref, {
+                'scope': scope,
+                'status': IN_PROGRESS,
+                'fingerprint': fingerprint,
+                'created_at': now,
+                'locked_until': now + timedelta(seconds=idempotency_config['lock_seconds']),
+                'expires_at': now + timedelta(hours=idempotency_config['ttl_hours'])
+            })
+            return None
+
+        return claim_in_transaction(transaction)
+
+    def complete(self, scope: str, key: str, result, status_code: int):
+        """Grava a resposta da execução para os replays."""
+        self._key_ref(scope, key).set({
+            'status': COMPLETED,
+            'response': firestore_json_dumps(result),
+            'status_code': status_code,
+            'completed_at': datetime.now()
+        }, merge=True)
+
+    def release(self, scope: str, key: str):
+        """Libera a chave após uma falha transitória, permitindo nova tentativa."""
+        self._key_ref(scope, key).delete()
+
+    def run(self, scope: str, key: str, data, handler) -> tuple:
+        """
+        Executa handler() uma única vez por chave. Replays recebem a resposta
+        gravada após uma leitura; duplicatas concorrentes recebem 409 enquanto
+        a primeira execução não termina.
+
+        A resposta só é gravada quando informa um pedido ou cobrança criados
+        (has_side_effect), qualquer que seja o status. Sem efeito gravado
+        (validação, estoque esgotado, fila, circuito aberto, erros 5xx), a
+        chave é liberada e o cliente pode repetir a requisição.
+
+        Args:
+            scope (str): Endpoint da chave (a mesma chave pode ser usada em endpoints diferentes)
+            data: Corpo da requisição
+            handler: Função sem argumentos que retorna (resultado, status)
+
+        Returns:
+            tuple: (resultado, status, replayed)
+        """
+        fingerprint = request_fingerprint(data)
+        record = self.get(scope, key) or self.claim(scope, key, fingerprint)
+        if record:
+            if record.get('fingerprint') != fingerprint:
+                return {'error': 'Idempotency-Key already used with a different request'}, 422, False
+            if record.get('status') == COMPLETED:
+                print(f"[DEBUG] Idempotency-Key {scope}: replay da resposta gravada")
+                return json.loads(record['response']), record['status_code'], True
+            return {'error': 'A request with this Idempotency-Key is still being processed', 'retry_after': 1}, 409, False
+
+        try:
+            result, status_code = handler()
+        except Exception:
+            self.release(scope, key)
+            raise
+        if has_side_effect(result):
+            self.complete(scope, key, result, status_code)
+        else:
+            self.release(scope, key)
+        return result, status_code, False
@@ -0,0 +1,439 @@
+import random
+from datetime import datetime, timedelta
+from firebase_admin import firestore
+from chalicelib.src.config.environment import env_config
+from chalicelib.src.repositories.event_stats_repository import (
+    CONFIRMED_STATUSES, CANCELED_STATUSES, EXPIRED_STATUSES, merge_order_update
+)
+from chalicelib.src.repositories.lot_repository import lot_capacity, parse_positive_int, ticket_lots
+
+inventory_config = env_config.get_inventory_config()
+debug_logging = env_config.get_debug_logging()
+
+# Status de pedidos que ainda seguram a reserva (antes da confirmação do pagamento)
+HOLDING_STATUSES = ['AGUARDANDO INFORMAÇÕES', 'PAGAMENTO PENDENTE', 'PAGAMENTO EM ANÁLISE']
+
+STOCK_FIELDS = ['available', 'reserved', 'sold']
+
+
+class InsufficientStockError(Exception):
+    """Não há unidades disponíveis suficientes para a reserva."""
+
+    def __init__(self, stock_id: str, requested: int, available: int):
+        super().__init__(f"Insufficient stock for {stock_id}: requested {requested}, available {available}")
+        self.stock_id = stock_id
+        self.requested = requested
+        self.available = available
+
+
+def stock_id_for(ticket_id: str, lot_index: int = None) -> str:
+    """ID do estoque do ingresso ou de um lote específico do ingresso."""
+    return ticket_id if lot_index is None else f"{ticket_id}__lote_{lot_index}"
+
+
+def parse_stock_id(stock_id: str) -> tuple:
+    """Inverso de stock_id_for: (ticket_id, lot_index)."""
+    ticket_id, separator, lot_index = stock_id.rpartition('__lote_')
+    if separator and lot_index.isdigit():
+        return ticket_id, int(lot_index)
+    return stock_id, None
+
+
+def order_stock_state(order_data: dict):
+    """
+    Estado do estoque seguro por um pedido: 'reserved' enquanto aguarda o
+    pagamento, 'sold' quando confirmado e 'released' quando cancelado ou
+    expirado. Pedidos sem reserva não afetam o estoque (None).
+    """
+    order_data = order_data or {}
+    if not (order_data.get('reservation') or {}).get('items'):
+        return None
+    status = order_data.get('status')
+    if status in CONFIRMED_STATUSES:
+        return 'sold'
+    if status in CANCELED_STATUSES or status in EXPIRED_STATUSES:
+        return 'released'
+    return 'reserved'
+
+
+def stock_contribution(order_data: dict) -> dict:
+    """
+    Contribuição de um pedido para os shards de estoque:
+    {(stock_id, shard): {'available': -q, 'reserved'|'sold': +q}}.
+    """
+    state = order_stock_state(order_data)
+    if state not in ('reserved', 'sold'):
+        return {}
+    contribution = {}
+    for item in order_data['reservation']['items']:
+        key = (item['stock_id'], item['shard'])
+        counters = contribution.setdefault(key, {})
+        counters['available'] = counters.get('available', 0) - item['quantity']
+        counters[state] = counters.get(state, 0) + item['quantity']
+    return contribution
+
+
+class InventoryRepository:
+    """
+    Estoque de ingressos e lotes em inventory/{event_id}/stocks/{stock_id},
+    distribuído em shards (available, reserved, sold). Cada reserva escolhe
+    um shard aleatório, de modo que compras concorrentes raramente disputam
+    o mesmo documento. A checagem de disponibilidade é feita na transação do
+    pedido; as variações dos contadores são derivadas do estado anterior e
+    novo do pedido (sync_order), como no agregado financeiro do evento.
+    """
+
+    def __init__(self, db, num_shards: int = None):
+        self.db = db
+        self.collection = 'inventory'
+        self.num_shards = num_shards or inventory_config['shards']
+
+    def _stock_ref(self, event_id: str, stock_id: str):
+        return self.db.collection(self.collection).document(event_id).collection('stocks').document(stock_id)
+
+    def _shard_ref(self, event_id: str, stock_id: str, shard: int):
+        return self._stock_ref(event_id, stock_id).collection('shards').document(str(shard))
+
+    def stock_demand(self, ticket_id: str, ticket_data: dict, quantity: int, lot_index: int = None) -> dict:
+        """
+        Estoques afetados pela compra de quantity unidades de um ingresso:
+        o estoque do ingresso (totalIngressos) e, se informado, o do lote
+        (até a virada por quantidade).
+
+        Returns:
+            dict: {stock_id: {'quantity', 'capacity', 'ticket_id', 'lot_index'}}
+        """
+        demand = {}
+        # totalIngressos = 0 (ou vazio) significa ingresso sem limite
+        capacity = parse_positive_int(ticket_data.get('totalIngressos'))
+        if capacity is not None:
+            demand[stock_id_for(ticket_id)] = {
+                'quantity': quantity, 'capacity': capacity, 'ticket_id': ticket_id, 'lot_index': None
+            }
+        lotes = ticket_lots(ticket_data)
+        if lot_index is not None and 0 <= lot_index < len(lotes):
+            capacity = lot_capacity(lotes[lot_index])
+            if capacity is not None:
+                demand[stock_id_for(ticket_id, lot_index)] = {
+                    'quantity': quantity, 'capacity': capacity, 'ticket_id': ticket_id, 'lot_index': lot_index
+                }
+        return demand
+
+    @staticmethod
+    def merge_demand(total: dict, demand: dict) -> dict:
+        for stock_id, entry in demand.items():
+            if stock_id in total:
+                total[stock_id]['quantity'] += entry['quantity']
+            else:
+                total[stock_id] = dict(entry)
+        return total
+
+    def _sold_before_inventory(self, event_id: str, ticket_id: str) -> int:
+        """Unidades do ingresso vendidas antes do controle de estoque existir."""
+        orders = self.db.collection('orders')\
+                     .where('event_id', '==', event_id)\
+                     .where('status', 'in', CONFIRMED_STATUSES)\
+                     .select(['tickets', 'reservation'])\
+                     .stream()
+        sold = 0
+        for order in orders:
+            order_data = order.to_dict()
+            if order_stock_state(order_data):
+                continue
+            for ticket in order_data.get('tickets') or []:
+                if isinstance(ticket, dict) and ticket.get('ticket_id') == ticket_id:
+                    sold += int(ticket.get('quantity', 1) or 1)
+        return sold
+
+    def ensure_stocks(self, event_id: str, demand: dict):
+        """
+        Cria os estoques ainda inexistentes, distribuindo a capacidade entre
+        os shards. O estoque do ingresso desconta as vendas anteriores ao
+        controle de estoque. Criações concorrentes são inofensivas: apenas a
+        primeira é gravada.
+        """
+        stock_refs = {stock_id: self._stock_ref(event_id, stock_id) for stock_id in demand}
+        existing = {doc.reference.path for doc in self.db.get_all(list(stock_refs.values())) if doc.exists}
+
+        for stock_id, entry in demand.items():
+            stock_ref = stock_refs[stock_id]
+            if stock_ref.path in existing:
+                continue
+            sold = self._sold_before_inventory(event_id, entry['ticket_id']) if entry['lot_index'] is None else 0
+            available = max(entry['capacity'] - sold, 0)
+
+            batch = self.db.batch()
+            batch.create(stock_ref, {
+                'event_id': event_id,
+                'ticket_id': entry['ticket_id'],
+                'lot_index': entry['lot_index'],
+                'capacity': entry['capacity'],
+                'num_shards': self.num_shards,
+                'created_at': datetime.now()
+            })
+            for shard in range(self.num_shards):
+                batch.set(self._shard_ref(event_id, stock_id, shard), {
+                    'available': available // self.num_shards + (1 if shard < available % self.num_shards else 0),
+                    'reserved': 0,
+                    'sold': sold if shard == 0 else 0
+                })
+            try:
+                batch.commit()
+            except Exception as e:
+                # Outro pedido criou o estoque primeiro
+                print(f"[DEBUG] Estoque {stock_id} do evento {event_id} já inicializado: {str(e)}")
+
+    def resync_capacity(self, event_id: str, ticket_id: str, ticket_data: dict) -> int:
+        """
+        Ajusta os estoques já criados do ingresso e dos seus lotes à
+        capacidade atual (totalIngressos e quantidade de cada lote), após a
+        edição do ingresso. Estoques ainda não criados são inicializados com a
+        nova capacidade na primeira reserva (ensure_stocks).
+
+        Returns:
+            int: Quantidade de estoques ajustados
+        """
+        targets = {stock_id_for(ticket_id): parse_positive_int(ticket_data.get('totalIngressos'))}
+        for lot_index, lote in enumerate(ticket_lots(ticket_data)):
+            targets[stock_id_for(ticket_id, lot_index)] = lot_capacity(lote)
+
+        stock_refs = {stock_id: self._stock_ref(event_id, stock_id) for stock_id in targets}
+        stock_docs = {doc.reference.path: doc for doc in self.db.get_all(list(stock_refs.values()))}
+
+        resynced = 0
+        for stock_id, capacity in targets.items():
+            stock_doc = stock_docs.get(stock_refs[stock_id].path)
+            if stock_doc is None or not stock_doc.exists or stock_doc.to_dict().get('capacity') == capacity:
+                continue
+            self._set_capacity(event_id, stock_id, capacity)
+            resynced += 1
+        return resynced
+
+    def _set_capacity(self, event_id: str, stock_id: str, capacity):
+        """
+        Altera a capacidade de um estoque, distribuindo a diferença de saldo
+        entre os shards numa transação: o saldo disponível passa a ser
+        capacidade - vendidos - reservados (nunca negativo). Aumentos são
+        divididos igualmente; reduções saem dos shards com mais saldo.
+        capacity None (ingresso sem limite) apenas registra a nova capacidade.
+        """
+        stock_ref = self._stock_ref(event_id, stock_id)
+        transaction = self.db.transaction()
+
+        @firestore.transactional
+        def set_in_transaction(transaction):
+            stock_doc = stock_ref.get(transaction=transaction)
+            if not stock_doc.exists:
+                return None
+            num_shards = stock_doc.to_dict().get('num_shards', self.num_shards)
+            shard_refs = [self._shard_ref(event_id, stock_id, shard) for shard in range(num_shards)]
+            shard_docs = {doc.reference.path: doc for doc in transaction.get_all(shard_refs)}
+            shards = []
+            for shard_ref in shard_refs:
+                shard_doc = shard_docs.get(shard_ref.path)
+                shards.append(shard_doc.to_dict() if shard_doc is not None and shard_doc.exists else {})
+
+            deltas = [0] * num_shards
+            if capacity is not None:
+                totals = {field: sum(shard.get(field, 0) for shard in shards) for field in STOCK_FIELDS}
+                target = max(capacity - totals['sold'] - totals['reserved'], 0)
+                delta = target - totals['available']
+                if delta > 0:
+                    for shard in range(num_shards):
+                        deltas[shard] = delta // num_shards + (1 if shard < delta % num_shards else 0)
+                else:
+                    remaining = -delta
+                    for shard in sorted(range(num_shards), key=lambda n: shards[n].get('available', 0), reverse=True):
+                        taken = min(max(shards[shard].get('available', 0), 0), remaining)
+                        deltas[shard] = -taken
+                        remaining -= taken
+                        if not remaining:
+                            break
+
+            transaction.update(stock_ref, {'capacity': capacity, 'updated_at': datetime.now()})
+            for shard, value in enumerate(deltas):
+                if value:
+                    transaction.set(shard_refs[shard], {
+                        'available': firestore.Increment(value),
+                        'updated_at': datetime.now()
+                    }, merge=True)
+            return deltas
+
+        deltas = set_in_transaction(transaction)
+        if debug_logging:
+            print(f"[DEBUG] Capacidade do estoque {stock_id} do evento {event_id} ajustada para {capacity}: {deltas}")
+        return deltas
+
+    def allocate(self, transaction, event_id: str, demand: dict, released_items: list = None) -> list:
+        """
+        Escolhe os shards que atendem à demanda, lendo-os na transação (deve
+        ser chamado antes de qualquer escrita nela). Começa por um shard
+        aleatório e segue para os próximos só se faltar saldo.
+
+        Args:
+            released_items: Itens de uma reserva anterior do mesmo pedido,
+                cujo saldo volta a contar como disponível
+
+        Returns:
+            list: Itens da reserva [{'stock_id', 'shard', 'quantity'}]
+
+        Raises:
+            InsufficientStockError: Saldo total insuficiente em algum estoque
+        """
+        credited = {}
+        for item in released_items or []:
+            key = (item['stock_id'], item['shard'])
+            credited[key] = credited.get(key, 0) + item['quantity']
+
+        items = []
+        for stock_id, entry in demand.items():
+            remaining = entry['quantity']
+            if remaining <= 0:
+                continue
+            stock_doc = self._stock_ref(event_id, stock_id).get(transaction=transaction)
+            num_shards = stock_doc.to_dict().get('num_shards', self.num_shards) if stock_doc.exists else self.num_shards
+
+            start = random.randrange(num_shards)
+            seen_available = 0
+            for offset in range(num_shards):
+                shard = (start + offset) % num_shards
+                shard_doc = self._shard_ref(event_id, stock_id, shard).get(transaction=transaction)
+                available = (shard_doc.to_dict().get('available', 0) if shard_doc.exists else 0) + credited.get((stock_id, shard), 0)
+                seen_available += max(available, 0)
+                taken = min(max(available, 0), remaining)
+                if taken:
+                    items.append({'stock_id': stock_id, 'shard': shard, 'quantity': taken})
+                    remaining -= taken
+                if not remaining:
+                    break
+            if remaining:
+                raise InsufficientStockError(stock_id, entry['quantity'], seen_available)
+        return items
+
+    def reclaim(self, transaction, before: dict, update: dict, reject_unavailable: bool = False) -> dict:
+        """
+        Preparo de EventStatsRepository.update_order para pedidos cuja reserva
+        foi liberada (cancelados ou expirados) e que voltam a segurar estoque.
+        As unidades são realocadas na transação (allocate), nunca apenas
+        recontadas.
+
+        - Pagamento confirmado depois da liberação (ex.: OVERDUE seguido de
+          RECEIVED): se o estoque já foi vendido a outros compradores, o
+          pedido é confirmado sem tocar nos contadores e marcado como oversold
+          para tratamento manual.
+        - Volta a aguardar pagamento (ex.: RESTORED, novos dados do pedido):
+          sem estoque, a mudança de status é descartada e o pedido continua
+          liberado; com reject_unavailable, InsufficientStockError é propagada
+          para que a requisição seja recusada.
+
+        Returns:
+            dict: Update do pedido, com os novos itens da reserva ou a marcação
+
+        Raises:
+            InsufficientStockError: Sem estoque para voltar a reservar, com reject_unavailable
+        """
+        if 'reservation' in update:
+            # Nova reserva já alocada por quem montou o update
+            return update
+        after = merge_order_update(before, update)
+        state = order_stock_state(after)
+        if order_stock_state(before) != 'released' or state not in ('reserved', 'sold'):
+            return update
+
+        items = after['reservation']['items']
+        demand = {}
+        for item in items:
+            entry = demand.setdefault(item['stock_id'], {'quantity': 0})
+            entry['quantity'] += item['quantity']
+        try:
+            allocated = self.allocate(transaction, after.get('event_id'), demand)
+        except InsufficientStockError as e:
+            if state == 'reserved':
+                if reject_unavailable:
+                    raise
+                print(f"[ERROR] Pedido liberado não volta a aguardar pagamento sem estoque disponível: {str(e)}")
+                return {key: value for key, value in update.items() if key != 'status'}
+            print(f"[ERROR] Pagamento confirmado após liberação da reserva sem estoque disponível: {str(e)}")
+            return {
+                **update,
+                'reservation.items': [],
+                'reservation.oversold_items': items,
+                'oversold': True,
+                'oversold_at': datetime.now()
+            }
+        if state == 'reserved':
+            # Nova reserva com prazo próprio (o anterior já venceu)
+            update = {
+                'reservation.expires_at': datetime.now() + timedelta(minutes=inventory_config['hold_minutes']),
+                **update
+            }
+        return {**update, 'reservation.items': allocated}
+
+    def reclaim_or_reject(self, transaction, before: dict, update: dict) -> dict:
+        """reclaim que recusa (InsufficientStockError) a volta à reserva sem estoque."""
+        return self.reclaim(transaction, before, update, reject_unavailable=True)
+
+    def sync_order(self, writer, order_id: str, before: dict, after: dict) -> int:
+        """
+        Registra no writer (batch ou transação) a variação dos shards de
+        estoque decorrente da mudança do pedido: reserva, confirmação,
+        liberação ou troca dos itens. Pode ser usado como callback de
+        EventStatsRepository.update_order.
+
+        Returns:
+            int: Quantidade de escritas registradas
+        """
+        event_id = (after or {}).get('event_id') or (before or {}).get('event_id')
+        if not event_id:
+            return 0
+        old = stock_contribution(before)
+        new = stock_contribution(after)
+
+        writes = 0
+        for key in set(old) | set(new):
+            delta = {
+                field: new.get(key, {}).get(field, 0) - old.get(key, {}).get(field, 0)
+                for field in STOCK_FIELDS
+            }
+            delta = {field: value for field, value in delta.items() if value}
+            if not delta:
+                continue
+            stock_id, shard = key
+            writer.set(self._shard_ref(event_id, stock_id, shard), {
+                **{field: firestore.Increment(value) for field, value in delta.items()},
+                'updated_at': datetime.now()
+            }, merge=True)
+            writes += 1
+        return writes
+
+    def get_stock(self, event_id: str, stock_id: str) -> dict:
+        """
+        Soma os shards de um estoque.
+
+        Returns:
+            dict: {'available', 'reserved', 'sold'} ou None se não inicializado
+        """
+        shards = list(self._stock_ref(event_id, stock_id).collection('shards').stream())
+        if not shards:
+            return None
+        totals = {field: 0 for field in STOCK_FIELDS}
+        for shard in shards:
+            shard_data = shard.to_dict()
+            for field in STOCK_FIELDS:
+                totals[field] += shard_data.get(field, 0)
+        return totals
+
+    def get_expired_reservations(self, limit: int = 100) -> list:
+        """
+        Pedidos ainda aguardando pagamento cuja reserva expirou.
+
+        Returns:
+            list: Referências dos pedidos
+        """
+        expired = self.db.collection('orders')\
+                      .where('status', 'in', HOLDING_STATUSES)\
+                      .where('reservation.expires_at', '<', datetime.now())\
+                      .limit(limit)\
+                      .select([])\
+                      .stream()
+        return [order.reference for order in expired]
@@ -0,0 +1,148 @@
+from datetime import datetime
+from firebase_admin import firestore
+from chalicelib.src.config.environment import env_config
+
+debug_logging = env_config.get_debug_logging()
+
+
+def parse_positive_int(value):
+    """Converte quantidades gravadas como str ou int; zero/vazio = sem limite (None)."""
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number > 0 else None
+
+
+def lot_capacity(lote: dict):
+    """
+    Unidades vendidas no lote antes da virada: viradaProximoLote.quantidade
+    quando definida, senão a quantidade do lote. None = sem limite.
+    """
+    lote = lote or {}
+    virada = lote.get('viradaProximoLote') or {}
+    return parse_positive_int(virada.get('quantidade')) or parse_positive_int(lote.get('quantidade'))
+
+
+def lot_deadline(lote: dict):
+    """Data da virada do lote (viradaProximoLote.data), ou None."""
+    virada = (lote or {}).get('viradaProximoLote') or {}
+    value = virada.get('data')
+    if not value:
+        return None
+    if hasattr(value, 'replace') and not isinstance(value, str):
+        return value.replace(tzinfo=None)
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def ticket_lots(ticket_data: dict) -> list:
+    """Lotes do ingresso, se for do tipo Lotes."""
+    ticket_data = ticket_data or {}
+    lotes = ticket_data.get('lotes')
+    if ticket_data.get('tipo') != 'Lotes' or not isinstance(lotes, list):
+        return []
+    return lotes
+
+
+def current_lot_index(ticket_data: dict, now: datetime = None):
+    """
+    Lote à venda agora. Parte do ponteiro em cache no ingresso (lote_atual)
+    e só avança se a data de virada do lote apontado já passou, então o
+    custo no checkout é constante no caso comum.
+
+    Returns:
+        int: Índice do lote, ou None se o ingresso não tem lotes ou todos encerraram
+    """
+    lotes = ticket_lots(ticket_data)
+    if not lotes:
+        return None
+    now = now or datetime.now()
+    index = int((ticket_data.get('lote_atual') or {}).get('index', 0) or 0)
+    while index < len(lotes):
+        deadline = lot_deadline(lotes[index])
+        if deadline is None or deadline > now:
+            return index
+        index += 1
+    return None
+
+
+def lot_price(ticket_data: dict, lot_index: int = None) -> float:
+    """Preço do ingresso no lote informado (ou o valor do ingresso sem lotes)."""
+    lotes = ticket_lots(ticket_data)
+    if lot_index is not None and 0 <= lot_index < len(lotes):
+        return float(lotes[lot_index].get('valor', ticket_data.get('valor', 0)))
+    return float(ticket_data.get('valor', 0))
+
+
+def lot_summary(ticket_data: dict, lot_index: int):
+    """Resumo do lote atual exposto na listagem pública de ingressos."""
+    lotes = ticket_lots(ticket_data)
+    if lot_index is None or not 0 <= lot_index < len(lotes):
+        return None
+    deadline = lot_deadline(lotes[lot_index])
+    return {
+        'index': lot_index,
+        'valor': lot_price(ticket_data, lot_index),
+        'capacidade': lot_capacity(lotes[lot_index]),
+        'ate': deadline.isoformat() if deadline else None,
+        'ultimo': lot_index == len(lotes) - 1
+    }
+
+
+class LotRepository:
+    """
+    Ponteiro do lote atual guardado no próprio ingresso
+    (events/{event_id}/tickets/{ticket_id}.lote_atual). O ponteiro só
+    avança: pela data de virada ou quando o estoque do lote esgota.
+
+    O esgotamento conta as reservas ainda não pagas, então o lote vira assim
+    que todas as unidades estão reservadas. Se depois essas reservas
+    expirarem, as unidades voltam ao estoque do lote anterior, mas o ponteiro
+    não retrocede: elas continuam à venda pelo estoque do ingresso
+    (totalIngressos), já no preço do lote seguinte. É intencional, para que o
+    preço exibido nunca volte a cair.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def _ticket_ref(self, event_id: str, ticket_id: str):
+        return self.db.collection('events').document(event_id).collection('tickets').document(ticket_id)
+
+    def advance(self, event_id: str, ticket_id: str, lot_index: int) -> int:
+        """
+        Move o ponteiro para lot_index se ele ainda estiver atrás (compare-and-set
+        numa transação; chamadas concorrentes não fazem o ponteiro voltar).
+
+        Returns:
+            int: Índice gravado após a operação
+        """
+        ticket_ref = self._ticket_ref(event_id, ticket_id)
+        transaction = self.db.transaction()
+
+        @firestore.transactional
+        def advance_in_transaction(transaction):
+            snapshot = ticket_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return None
+            current = int((snapshot.to_dict().get('lote_atual') or {}).get('index', 0) or 0)
+            if lot_index <= current:
+                return current
+            transaction.update(ticket_ref, {
+                'lote_atual': {'index': lot_index, 'updated_at': datetime.now()}
+            })
+            if debug_logging:
+                print(f"[DEBUG] Ingresso {ticket_id}: lote atual {current} -> {lot_index}")
+            return lot_index
+
+        return advance_in_transaction(transaction)
+
+    def sync_pointer(self, event_id: str, ticket_id: str, ticket_data: dict, lot_index: int):
+        """Persiste o ponteiro quando o lote resolvido está à frente do gravado."""
+        stored = int((ticket_data.get('lote_atual') or {}).get('index', 0) or 0)
+        if lot_index is not None and lot_index > stored:
+            self.advance(event_id, ticket_id, lot_index)
+            ticket_data['lote_atual'] = {'index': lot_index}
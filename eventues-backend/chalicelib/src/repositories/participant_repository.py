@@ -0,0 +1,209 @@
+import base64
+import json
+from datetime import datetime
+from chalicelib.src.repositories.checkin_stats_repository import CONFIRMED_STATUSES, ticket_checkin_state
+
+# Limite de escritas por batch do Firestore
+MAX_BATCH_WRITES = 500
+
+STANDARD_PARTICIPANT_FIELDS = ['fullName', 'gender', 'birthDate', 'termsAccepted']
+
+
+def flatten_participant(order_id: str, order_data: dict, ticket_idx: int, ticket: dict) -> dict:
+    """
+    Achata o primeiro participante de um ingresso no formato exibido nas
+    telas de participantes e check-in.
+    """
+    participant_info = {}
+    if 'participants' in ticket and isinstance(ticket['participants'], list) and len(ticket['participants']) > 0:
+        first_participant = ticket['participants'][0]
+        participant_info['fullName'] = first_participant.get('fullName', 'Nome não informado')
+        participant_info['gender'] = first_participant.get('gender', '')
+        participant_info['birthDate'] = first_participant.get('birthDate', '')
+        categories = {}
+        for key, value in first_participant.items():
+            if key not in STANDARD_PARTICIPANT_FIELDS:
+                categories[key] = value
+        participant_info['categories'] = categories
+    checkin_state = ticket_checkin_state(order_data, ticket_idx)
+    return {
+        'order_id': order_id,
+        'participant_index': ticket_idx,
+        'fullName': participant_info.get('fullName', 'Nome não informado'),
+        'gender': participant_info.get('gender', ''),
+        'birthDate': participant_info.get('birthDate', ''),
+        'categories': participant_info.get('categories', {}),
+        'ticket_name': ticket.get('ticket_name', ''),
+        'ticket_id': ticket.get('ticket_id', ''),
+        'qr_code_uuid': ticket.get('qr_code_uuid', ''),
+        'order_status': order_data.get('status', ''),
+        'created_at': order_data.get('created_at').isoformat() if 'created_at' in order_data and hasattr(order_data['created_at'], 'isoformat') else None,
+        'user_id': order_data.get('user_id', ''),
+        'checkin': checkin_state['checkin'],
+        'checkin_timestamp': checkin_state['checkin_timestamp'],
+        'checkin_by': checkin_state['checkin_by']
+    }
+
+
+def encode_participant_cursor(participant_doc):
+    """Codifica a posição (name_lower, id) do último participante da página"""
+    if not participant_doc:
+        return None
+    cursor_data = {'id': participant_doc.id, 'name_lower': participant_doc.get('name_lower')}
+    return base64.urlsafe_b64encode(json.dumps(cursor_data).encode()).decode()
+
+
+def decode_participant_cursor(cursor_str):
+    """Decodifica o cursor de paginação de participantes"""
+    if not cursor_str:
+        return None
+    try:
+        cursor_data = json.loads(base64.urlsafe_b64decode(cursor_str))
+        return {'name_lower': cursor_data.get('name_lower'), '__name__': cursor_data['id']}
+    except Exception:
+        return None
+
+
+class ParticipantRepository:
+    """
+    Projeção participants/{order_id}_{índice}: um documento por ingresso de
+    pedido confirmado, com campos indexáveis para busca por prefixo do nome,
+    tipo de ingresso, estado de check-in e categoria.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.collection = 'participants'
+
+    def _participant_ref(self, order_id: str, ticket_idx: int):
+        return self.db.collection(self.collection).document(f"{order_id}_{ticket_idx}")
+
+    @staticmethod
+    def _projection(event_id: str, order_id: str, order_data: dict, ticket_idx: int, ticket: dict) -> dict:
+        participant = flatten_participant(order_id, order_data, ticket_idx, ticket)
+        participant['event_id'] = event_id
+        participant['name_lower'] = (participant['fullName'] or '').strip().lower()
+        participant['category_values'] = sorted(
+            f"{key}:{value}" for key, value in participant['categories'].items()
+            if isinstance(value, (str, int, float, bool))
+        )
+        return participant
+
+    def _projections(self, order_id: str, order_data: dict) -> dict:
+        """Projeções de um pedido por índice do ingresso (vazio se não confirmado)."""
+        order_data = order_data or {}
+        event_id = order_data.get('event_id')
+        tickets = order_data.get('tickets')
+        if not event_id or order_data.get('status') not in CONFIRMED_STATUSES or not isinstance(tickets, list):
+            return {}
+        return {
+            ticket_idx: self._projection(event_id, order_id, order_data, ticket_idx, ticket)
+            for ticket_idx, ticket in enumerate(tickets) if isinstance(ticket, dict)
+        }
+
+    def sync_order(self, writer, order_id: str, before: dict, after: dict) -> int:
+        """
+        Registra no writer (batch ou transação) as alterações da projeção
+        decorrentes de uma mudança no pedido: grava apenas os participantes
+        que mudaram e remove os que deixaram de existir ou de estar confirmados.
+        Pode ser usado como callback de EventStatsRepository.update_order.
+
+        Returns:
+            int: Quantidade de escritas registradas
+        """
+        old = self._projections(order_id, before)
+        new = self._projections(order_id, after)
+
+        writes = 0
+        for ticket_idx, participant in new.items():
+            if old.get(ticket_idx) != participant:
+                writer.set(self._participant_ref(order_id, ticket_idx), {**participant, 'updated_at': datetime.now()})
+                writes += 1
+        for ticket_idx in set(old) - set(new):
+            writer.delete(self._participant_ref(order_id, ticket_idx))
+            writes += 1
+        return writes
+
+    def list_event_participants(self, event_id: str, limit: int = 50, cursor: str = None, search: str = None,
+             ticket_id: str = None, checkin: bool = None, category: str = None) -> dict:
+        """
+        Lista participantes do evento em ordem alfabética, com paginação por
+        cursor, busca por prefixo do nome e filtros opcionais.
+
+        Args:
+            category (str): Filtro no formato "campo:valor"
+
+        Returns:
+            dict: {'participants': [...], 'next_cursor': str | None}
+        """
+        query = self.db.collection(self.collection).where('event_id', '==', event_id)
+        if ticket_id:
+            query = query.where('ticket_id', '==', ticket_id)
+        if checkin is not None:
+            query = query.where('checkin', '==', checkin)
+        if category:
+            query = query.where('category_values', 'array_contains', category)
+        if search:
+            prefix = search.strip().lower()
+            query = query.where('name_lower', '>=', prefix).where('name_lower', '<', prefix + '\uf8ff')
+
+        query = query.order_by('name_lower').order_by('__name__')
+        decoded_cursor = decode_participant_cursor(cursor)
+        if decoded_cursor:
+            query = query.start_after(decoded_cursor)
+
+        docs = list(query.limit(limit + 1).stream())
+        page = docs[:limit]
+
+        participants = []
+        for doc in page:
+            participant = doc.to_dict()
+            for internal_field in ['event_id', 'name_lower', 'category_values', 'updated_at']:
+                participant.pop(internal_field, None)
+            participants.append(participant)
+
+        return {
+            'participants': participants,
+            'next_cursor': encode_participant_cursor(page[-1]) if len(docs) > limit else None
+        }
+
+    def rebuild(self, event_id: str) -> int:
+        """
+        Reconstrói a projeção do evento a partir dos pedidos confirmados,
+        removendo participantes que não existem mais.
+
+        Returns:
+            int: Quantidade de participantes projetados
+        """
+        batch = self.db.batch()
+        pending_writes = 0
+        projected_ids = set()
+
+        orders = self.db.collection('orders')\
+                     .where('event_id', '==', event_id)\
+                     .where('status', 'in', CONFIRMED_STATUSES)\
+                     .stream()
+        for order in orders:
+            for ticket_idx, participant in self._projections(order.id, order.to_dict()).items():
+                batch.set(self._participant_ref(order.id, ticket_idx), {**participant, 'updated_at': datetime.now()})
+                projected_ids.add(f"{order.id}_{ticket_idx}")
+                pending_writes += 1
+                if pending_writes >= MAX_BATCH_WRITES:
+                    batch.commit()
+                    batch = self.db.batch()
+                    pending_writes = 0
+
+        stale = self.db.collection(self.collection).where('event_id', '==', event_id).select([]).stream()
+        for participant_doc in stale:
+            if participant_doc.id in projected_ids:
+                continue
+            batch.delete(participant_doc.reference)
+            pending_writes += 1
+            if pending_writes >= MAX_BATCH_WRITES:
+                batch.commit()
+                batch = self.db.batch()
+                pending_writes = 0
+
+        if pending_writes:
+            batch.commit()
+        return len(projected_ids)
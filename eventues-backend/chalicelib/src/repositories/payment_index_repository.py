@@ -0,0 +1,103 @@
+from datetime import datetime
+
+# Limite de escritas por batch do Firestore
+MAX_BATCH_WRITES = 500
+
+
+class PaymentIndexRepository:
+    """
+    Índice payments_index/{payment_id} -> order_id, que localiza o pedido de
+    uma cobrança do Asaas com uma única leitura, sem consultas.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.collection = 'payments_index'
+
+    def _index_ref(self, payment_id: str):
+        return self.db.collection(self.collection).document(payment_id)
+
+    def index_payment(self, writer, payment_id: str, order_id: str, event_id: str = None):
+        """Registra no writer (batch ou transação) o ponteiro da cobrança."""
+        if not payment_id or '/' in payment_id:
+            return
+        writer.set(self._index_ref(payment_id), {
+            'order_id': order_id,
+            'event_id': event_id,
+            'updated_at': datetime.now()
+        })
+
+    def sync_order(self, writer, order_id: str, before: dict, after: dict) -> int:
+        """
+        Acompanha a troca de cobrança do pedido: indexa a nova e remove o
+        ponteiro da anterior, para que webhooks da cobrança substituída não
+        alterem o pedido. Pode ser usado como callback de
+        EventStatsRepository.update_order.
+
+        Returns:
+            int: Quantidade de escritas registradas
+        """
+        old_payment_id = (before or {}).get('payment_id')
+        new_payment_id = (after or {}).get('payment_id')
+        if old_payment_id == new_payment_id:
+            return 0
+        writes = 0
+        if old_payment_id and '/' not in old_payment_id:
+            writer.delete(self._index_ref(old_payment_id))
+            writes += 1
+        if new_payment_id and '/' not in new_payment_id:
+            self.index_payment(writer, new_payment_id, order_id, after.get('event_id'))
+            writes += 1
+        return writes
+
+    def get_order_id(self, payment_id: str):
+        """
+        Busca o pedido da cobrança pelo índice. Cobranças ainda não indexadas
+        caem na consulta por payment_id e são indexadas para as próximas leituras.
+
+        Returns:
+            str: ID do pedido ou None
+        """
+        if not payment_id or '/' in payment_id:
+            return None
+        index_doc = self._index_ref(payment_id).get()
+        if index_doc.exists:
+            return index_doc.to_dict().get('order_id')
+
+        orders = self.db.collection('orders').where('payment_id', '==', payment_id).limit(1).get()
+        if not orders:
+            return None
+        order = orders[0]
+        batch = self.db.batch()
+        self.index_payment(batch, payment_id, order.id, order.to_dict().get('event_id'))
+        batch.commit()
+        return order.id
+
+    def backfill(self) -> int:
+        """
+        Indexa as cobranças de todos os pedidos existentes.
+
+        Returns:
+            int: Quantidade de cobranças indexadas
+        """
+        orders = self.db.collection('orders')\
+                     .where('payment_id', '>', '')\
+                     .select(['payment_id', 'event_id'])\
+                     .stream()
+
+        batch = self.db.batch()
+        pending_writes = 0
+        indexed = 0
+        for order in orders:
+            order_data = order.to_dict()
+            self.index_payment(batch, order_data.get('payment_id'), order.id, order_data.get('event_id'))
+            pending_writes += 1
+            indexed += 1
+            if pending_writes >= MAX_BATCH_WRITES:
+                batch.commit()
+                batch = self.db.batch()
+                pending_writes = 0
+
+        if pending_writes:
+            batch.commit()
+        return indexed
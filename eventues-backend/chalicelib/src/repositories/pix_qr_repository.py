@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+
+# Validade usada quando o Asaas não informa expirationDate
+DEFAULT_PIX_QR_TTL = timedelta(days=1)
+
+
+def pix_qr_expiration(pix_data: dict) -> datetime:
+    """Expiração do QR code (expirationDate do Asaas, "AAAA-MM-DD HH:MM:SS")."""
+    value = (pix_data or {}).get('expirationDate')
+    if value:
+        try:
+            return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            pass
+    return datetime.now() + DEFAULT_PIX_QR_TTL
+
+
+class PixQrCodeRepository:
+    """
+    QR codes PIX em pix_qr_codes/{payment_id}, gravados quando o checkout os
+    obtém. GET /pix-qrcode lê daqui em qualquer container, sem depender do
+    container que criou a cobrança. O campo expires_at permite configurar a
+    política de TTL do Firestore.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.collection = 'pix_qr_codes'
+
+    def _qr_ref(self, payment_id: str):
+        return self.db.collection(self.collection).document(payment_id)
+
+    def get(self, payment_id: str):
+        """
+        QR code gravado e ainda válido.
+
+        Returns:
+            dict: {'encodedImage', 'payload', 'expirationDate'} ou None
+        """
+        if not payment_id or '/' in payment_id:
+            return None
+        qr_doc = self._qr_ref(payment_id).get()
+        if not qr_doc.exists:
+            return None
+        qr_data = qr_doc.to_dict()
+        expires_at = qr_data.get('expires_at')
+        if expires_at is not None and expires_at.replace(tzinfo=None) <= datetime.now():
+            return None
+        return {key: qr_data.get(key) for key in ('encodedImage', 'payload', 'expirationDate')}
+
+    def save(self, payment_id: str, pix_data: dict):
+        """Grava o QR code retornado pelo Asaas."""
+        if not payment_id or '/' in payment_id or not pix_data:
+            return
+        self._qr_ref(payment_id).set({
+            'encodedImage': pix_data.get('encodedImage'),
+            'payload': pix_data.get('payload'),
+            'expirationDate': pix_data.get('expirationDate'),
+            'expires_at': pix_qr_expiration(pix_data),
+            'created_at': datetime.now()
+        })
@@ -0,0 +1,117 @@
+from datetime import datetime
+
+# Limite de escritas por batch do Firestore
+MAX_BATCH_WRITES = 500
+
+
+class QrIndexRepository:
+    """
+    Índice qr_index/{qr_code_uuid} -> (event_id, order_id, ticket_index),
+    que permite localizar o ingresso de um QR code com uma única leitura.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.collection = 'qr_index'
+
+    def _index_ref(self, qr_code_uuid: str):
+        return self.db.collection(self.collection).document(qr_code_uuid)
+
+    def index_tickets(self, writer, event_id: str, order_id: str, tickets: list):
+        """
+        Registra no writer (batch ou transação) a entrada de índice de cada
+        ingresso do pedido que possui qr_code_uuid.
+
+        Returns:
+            int: Quantidade de entradas escritas
+        """
+        indexed = 0
+        for ticket_index, ticket in enumerate(tickets or []):
+            qr_code_uuid = ticket.get('qr_code_uuid') if isinstance(ticket, dict) else None
+            if not qr_code_uuid:
+                continue
+            writer.set(self._index_ref(qr_code_uuid), {
+                'event_id': event_id,
+                'order_id': order_id,
+                'ticket_index': ticket_index,
+                'updated_at': datetime.now()
+            })
+            indexed += 1
+        return indexed
+
+    def index_order_update(self, writer, order_id: str, before: dict, after: dict):
+        """
+        Reindexa os ingressos de um pedido quando seus QR codes ou posições
+        mudaram e remove as entradas dos QR codes que deixaram o pedido
+        (ingresso removido ou token reemitido). Pode ser usado como callback
+        de EventStatsRepository.update_order.
+
+        Returns:
+            int: Quantidade de escritas registradas
+        """
+        before_codes = [t.get('qr_code_uuid') for t in (before or {}).get('tickets', []) or [] if isinstance(t, dict)]
+        after_codes = [t.get('qr_code_uuid') for t in (after or {}).get('tickets', []) or [] if isinstance(t, dict)]
+        if before_codes == after_codes:
+            return 0
+        removed = set(filter(None, before_codes)) - set(after_codes)
+        for qr_code_uuid in removed:
+            if '/' not in qr_code_uuid:
+                writer.delete(self._index_ref(qr_code_uuid))
+        indexed = self.index_tickets(writer, (after or {}).get('event_id'), order_id, (after or {}).get('tickets', []))
+        return indexed + len(removed)
+
+    def get(self, qr_code_uuid: str):
+        """
+        Busca a entrada de índice de um QR code.
+
+        Returns:
+            dict: {'event_id', 'order_id', 'ticket_index'} ou None
+        """
+        if not qr_code_uuid or '/' in qr_code_uuid:
+            return None
+        index_doc = self._index_ref(qr_code_uuid).get()
+        if not index_doc.exists:
+            return None
+        return index_doc.to_dict()
+
+    def get_many(self, qr_code_uuids: list) -> dict:
+        """
+        Busca várias entradas de índice numa única chamada get_all.
+
+        Returns:
+            dict: {qr_code_uuid: entrada}
+        """
+        refs = [self._index_ref(qr_code_uuid) for qr_code_uuid in set(qr_code_uuids)
+                if qr_code_uuid and '/' not in qr_code_uuid]
+        if not refs:
+            return {}
+        return {doc.id: doc.to_dict() for doc in self.db.get_all(refs) if doc.exists}
+
+    def backfill(self, event_id: str = None) -> int:
+        """
+        Indexa os QR codes de pedidos existentes (de um evento ou de todos).
+
+        Returns:
+            int: Quantidade de entradas escritas
+        """
+        query = self.db.collection('orders')
+        if event_id:
+            query = query.where('event_id', '==', event_id)
+
+        batch = self.db.batch()
+        pending_writes = 0
+        indexed = 0
+        for order in query.stream():
+            order_data = order.to_dict()
+            tickets = order_data.get('tickets', [])
+            if len(tickets or []) + pending_writes > MAX_BATCH_WRITES:
+                batch.commit()
+                batch = self.db.batch()
+                pending_writes = 0
+            written = self.index_tickets(batch, order_data.get('event_id'), order.id, tickets)
+            pending_writes += written
+            indexed += written
+
+        if pending_writes:
+            batch.commit()
+        return indexed
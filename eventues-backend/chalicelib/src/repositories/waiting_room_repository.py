@@ -0,0 +1,177 @@
+import random
+import time
+from datetime import datetime
+from cachetools import TTLCache
+from firebase_admin import firestore
+from google.api_core.exceptions import Aborted
+from chalicelib.src.config.environment import env_config
+
+waiting_room_config = env_config.get_waiting_room_config()
+
+# Configuração da fila por evento, em cache no container (lida em todo checkout)
+_settings_cache = TTLCache(maxsize=1024, ttl=waiting_room_config['settings_cache_ttl'])
+
+
+class QueueTokenUsedError(Exception):
+    """O token da fila já foi usado por outro pedido."""
+
+    def __init__(self, event_id: str, order_id: str):
+        super().__init__(f"Queue token for event {event_id} already used by order {order_id}")
+        self.event_id = event_id
+        self.order_id = order_id
+
+
+class WaitingRoomRepository:
+    """
+    Fila virtual do evento em waiting_rooms/{event_id}: configuração
+    (enabled, admission_rate, opened_at) e o contador de posições,
+    distribuído em shards. O shard n entrega as posições n, n + S, n + 2S...
+    e agenda a admissão de cada uma, então as posições são únicas e
+    crescentes sem que todas as entradas disputem o mesmo documento.
+    As admissões usadas ficam em waiting_rooms/{event_id}/admissions,
+    vinculadas ao pedido, para que cada token valha para um único pedido.
+    """
+
+    def __init__(self, db, num_shards: int = None):
+        self.db = db
+        self.collection = 'waiting_rooms'
+        self.num_shards = num_shards or waiting_room_config['shards']
+
+    def _room_ref(self, event_id: str):
+        return self.db.collection(self.collection).document(event_id)
+
+    def _shard_ref(self, event_id: str, shard: int):
+        return self._room_ref(event_id).collection('shards').document(str(shard))
+
+    def get_settings(self, event_id: str) -> dict:
+        """
+        Configuração da fila do evento (com cache).
+
+        Returns:
+            dict: {'enabled', 'admission_rate', 'opened_at', 'num_shards'}
+        """
+        cached = _settings_cache.get(event_id)
+        if cached is not None:
+            return cached
+
+        room_doc = self._room_ref(event_id).get()
+        room_data = room_doc.to_dict() if room_doc.exists else {}
+        settings = {
+            'enabled': bool(room_data.get('enabled', False)),
+            'admission_rate': float(room_data.get('admission_rate') or waiting_room_config['admission_rate']),
+            'opened_at': int(room_data.get('opened_at', 0)),
+            'num_shards': int(room_data.get('num_shards', self.num_shards))
+        }
+        _settings_cache[event_id] = settings
+        return settings
+
+    def save_settings(self, event_id: str, enabled: bool, admission_rate: float = None) -> dict:
+        """
+        Ativa/desativa a fila e ajusta a taxa de admissão. Ao ativar, a fila
+        é reaberta: as posições recomeçam e os tokens anteriores deixam de valer.
+        """
+        current = self.get_settings(event_id)
+        settings = {
+            'enabled': enabled,
+            'admission_rate': float(admission_rate or current['admission_rate']),
+            'opened_at': int(time.time()) if enabled and not current['enabled'] else current['opened_at'],
+            'num_shards': current['num_shards'] if current['opened_at'] else self.num_shards
+        }
+        self._room_ref(event_id).set({**settings, 'updated_at': datetime.now()}, merge=True)
+        _settings_cache.pop(event_id, None)
+        return settings
+
+    def _admission_ref(self, event_id: str, claims: dict):
+        admission_id = f"{claims['opened_at']}_{claims['position']}"
+        return self._room_ref(event_id).collection('admissions').document(admission_id)
+
+    def take_slot(self, event_id: str, settings: dict, now: float = None) -> dict:
+        """
+        Reserva a próxima posição e o horário de admissão em um shard
+        aleatório. Cada shard libera no máximo admission_rate / S entradas
+        por segundo (balde furado), então o total admitido respeita a taxa
+        do evento mesmo em rajadas. Shards ainda da abertura anterior da
+        fila recomeçam do zero, sem reset em lote.
+
+        Em vez de repetir a transação no mesmo shard quando outra entrada o
+        alterou, tenta uma única vez cada shard (em ordem aleatória); só o
+        último shard usa as tentativas padrão da transação.
+
+        Returns:
+            dict: {'position': posição a partir de 0, 'admit_at': epoch da admissão}
+        """
+        num_shards = settings['num_shards']
+        shards = random.sample(range(num_shards), min(num_shards, waiting_room_config['join_attempts']))
+        for attempt, shard in enumerate(shards):
+            last_attempt = attempt + 1 == len(shards)
+            try:
+                return self._take_slot_in_shard(event_id, settings, shard, now, single_attempt=not last_attempt)
+            except ValueError as e:
+                if last_attempt or not isinstance(e.__cause__, Aborted):
+                    raise
+                print(f"[DEBUG] Fila {event_id}: shard {shard} em disputa, tentando outro")
+
+    def _take_slot_in_shard(self, event_id: str, settings: dict, shard: int, now: float = None,
+                            single_attempt: bool = False) -> dict:
+        now = now if now is not None else time.time()
+        num_shards = settings['num_shards']
+        interval = num_shards / settings['admission_rate']
+        shard_ref = self._shard_ref(event_id, shard)
+        transaction = self.db.transaction(max_attempts=1) if single_attempt else self.db.transaction()
+
+        @firestore.transactional
+        def take_in_transaction(transaction):
+            shard_doc = shard_ref.get(transaction=transaction)
+            shard_data = shard_doc.to_dict() if shard_doc.exists else {}
+            if shard_data.get('opened_at') != settings['opened_at']:
+                shard_data = {}
+            issued = shard_data.get('issued', 0)
+            admit_at = max(now, shard_data.get('next_slot', 0))
+            transaction.set(shard_ref, {
+                'issued': issued + 1,
+                'next_slot': admit_at + interval,
+                'opened_at': settings['opened_at']
+            })
+            return {'position': issued * num_shards + shard, 'admit_at': admit_at}
+
+        return take_in_transaction(transaction)
+
+    def claim_admission(self, transaction, event_id: str, claims: dict, order_id: str):
+        """
+        Vincula a admissão do token ao pedido, na transação do chamador
+        (leitura antes de qualquer escrita). O mesmo pedido pode repetir a
+        chamada; outro pedido com o mesmo token é recusado.
+
+        Raises:
+            QueueTokenUsedError: Token já vinculado a outro pedido
+        """
+        admission_ref = self._admission_ref(event_id, claims)
+        admission_doc = admission_ref.get(transaction=transaction)
+        if admission_doc.exists:
+            claimed_by = admission_doc.to_dict().get('order_id')
+            if claimed_by != order_id:
+                raise QueueTokenUsedError(event_id, claimed_by)
+            return
+        transaction.set(admission_ref, {
+            'order_id': order_id,
+            'opened_at': claims['opened_at'],
+            'position': claims['position'],
+            # Permite configurar a política de TTL do Firestore
+            'expires_at': datetime.fromtimestamp(claims['expires_at']),
+            'claimed_at': datetime.now()
+        })
+
+    def bind_admission(self, event_id: str, claims: dict, order_id: str):
+        """
+        claim_admission em uma transação própria.
+
+        Raises:
+            QueueTokenUsedError: Token já vinculado a outro pedido
+        """
+        transaction = self.db.transaction()
+
+        @firestore.transactional
+        def bind_in_transaction(transaction):
+            self.claim_admission(transaction, event_id, claims, order_id)
+
+        bind_in_transaction(transaction)
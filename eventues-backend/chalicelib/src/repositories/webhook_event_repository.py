@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+
+class WebhookEventRepository:
+    """
+    Registro de eventos de webhook já processados, webhook_events/{event_id}.
+    O campo expires_at permite configurar a política de TTL do Firestore para
+    limpar registros antigos automaticamente.
+    """
+
+    def __init__(self, db, ttl_days: int = 7):
+        self.db = db
+        self.collection = 'webhook_events'
+        self.ttl_days = ttl_days
+
+    def _event_ref(self, event_id: str):
+        return self.db.collection(self.collection).document(event_id.replace('/', '_'))
+
+    def is_processed(self, event_id: str) -> bool:
+        """Verifica com uma única leitura se o evento já foi processado."""
+        if not event_id:
+            return False
+        return self._event_ref(event_id).get().exists
+
+    def mark_processed(self, event_id: str, data: dict, writer=None):
+        """
+        Registra o evento como processado (no writer, se informado).
+        """
+        if not event_id:
+            return
+        record = {
+            **data,
+            'processed_at': datetime.now(),
+            'expires_at': datetime.now() + timedelta(days=self.ttl_days)
+        }
+        if writer is not None:
+            writer.set(self._event_ref(event_id), record)
+        else:
+            self._event_ref(event_id).set(record)
@@ -0,0 +1,68 @@
+import uuid
+from datetime import datetime
+from google.api_core.exceptions import AlreadyExists
+
+
+class WebhookQueueRepository:
+    """
+    Fila webhook_queue/{event_id} com os payloads brutos recebidos do Asaas,
+    gravados com uma única escrita antes de responder ao webhook.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.collection = 'webhook_queue'
+
+    def enqueue(self, event: dict) -> tuple:
+        """
+        Persiste o payload do webhook.
+
+        Returns:
+            tuple: (queue_id, created) - created é False para reentregas de
+                um evento que ainda está na fila
+        """
+        queue_id = (event.get('id') or str(uuid.uuid4())).replace('/', '_')
+        payment = event.get('payment') or {}
+        try:
+            self.db.collection(self.collection).document(queue_id).create({
+                'payload': event,
+                'payment_id': payment.get('id') if isinstance(payment, dict) else None,
+                'status': 'PENDING',
+                'attempts': 0,
+                'received_at': datetime.now()
+            })
+            return queue_id, True
+        except AlreadyExists:
+            return queue_id, False
+
+    def get_pending(self, limit: int, payment_id: str = None, after=None) -> list:
+        """
+        Itens pendentes em ordem de chegada, a partir do último item da
+        página anterior (after) quando informado.
+        """
+        query = self.db.collection(self.collection).where('status', '==', 'PENDING')
+        if payment_id:
+            query = query.where('payment_id', '==', payment_id)
+        query = query.order_by('received_at').order_by('__name__')
+        if after is not None:
+            query = query.start_after(after)
+        return list(query.limit(limit).stream())
+
+    def complete(self, writer, queue_docs: list):
+        """Remove da fila os itens processados."""
+        for queue_doc in queue_docs:
+            writer.delete(queue_doc.reference)
+
+    def retry_or_fail(self, writer, queue_docs: list, error: str, max_attempts: int, permanent: bool = False):
+        """
+        Devolve os itens à fila para nova tentativa, ou marca como FAILED
+        quando o erro é permanente ou as tentativas se esgotaram.
+        """
+        for queue_doc in queue_docs:
+            attempts = queue_doc.to_dict().get('attempts', 0) + 1
+            writer.update(queue_doc.reference, {
+                'status': 'FAILED' if permanent or attempts >= max_attempts else 'PENDING',
+                'attempts': attempts,
+                'last_error': error,
+                'updated_at': datetime.now()
+            })
@@ -0,0 +1,328 @@
+import csv
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from firebase_admin import firestore
+from chalicelib.src.config.environment import env_config
+from chalicelib.src.repositories.checkin_stats_repository import CONFIRMED_STATUSES
+from chalicelib.src.repositories.form_repository import FormRepository
+from chalicelib.src.repositories.participant_repository import flatten_participant
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # XLSX é opcional; CSV não depende de bibliotecas externas
+    Workbook = None
+
+EXPORT_TYPES = ['participants', 'orders']
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+}
+
+PARTICIPANT_COLUMNS = [
+    ('order_id', 'Pedido'),
+    ('participant_index', 'Índice'),
+    ('fullName', 'Nome'),
+    ('gender', 'Gênero'),
+    ('birthDate', 'Data de nascimento'),
+    ('ticket_name', 'Ingresso'),
+    ('ticket_id', 'ID do ingresso'),
+    ('order_status', 'Status'),
+    ('created_at', 'Data da compra'),
+    ('checkin', 'Check-in'),
+    ('checkin_timestamp', 'Horário do check-in')
+]
+
+ORDER_COLUMNS = [
+    ('order_id', 'Pedido'),
+    ('payment_id', 'ID do pagamento'),
+    ('status', 'Status'),
+    ('billing_type', 'Método de pagamento'),
+    ('tickets', 'Ingressos'),
+    ('subtotal_amount', 'Subtotal'),
+    ('fee_amount', 'Taxa'),
+    ('discount_amount', 'Desconto'),
+    ('total_amount', 'Total'),
+    ('coupon_code', 'Cupom'),
+    ('user_id', 'Usuário'),
+    ('created_at', 'Data da compra')
+]
+
+
+class CsvRowWriter:
+    """Escreve linhas CSV diretamente no arquivo temporário."""
+
+    def __init__(self, path: str):
+        # utf-8-sig para que o Excel reconheça a acentuação
+        self.file = open(path, 'w', newline='', encoding='utf-8-sig')
+        self.writer = csv.writer(self.file)
+
+    def write(self, row: list):
+        self.writer.writerow(row)
+
+    def close(self):
+        self.file.close()
+
+
+class XlsxRowWriter:
+    """Escreve linhas XLSX em modo write-only (linhas não ficam em memória)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet('Export')
+
+    def write(self, row: list):
+        self.sheet.append(row)
+
+    def close(self):
+        self.workbook.save(self.path)
+
+
+def format_cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'Sim' if value else 'Não'
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, (list, dict)):
+        return str(value)
+    return value
+
+
+class ExportTask:
+    """
+    Jobs de exportação exports/{job_id}: percorre os pedidos do evento página
+    por página e grava as linhas incrementalmente num arquivo temporário, que
+    é enviado ao Storage ao final. A memória fica limitada a uma página de
+    pedidos, independente do tamanho do evento.
+    """
+
+    def __init__(self, db, bucket):
+        self.db = db
+        self.bucket = bucket
+        self.collection = 'exports'
+        self.config = env_config.get_export_config()
+
+    def _job_ref(self, job_id: str):
+        return self.db.collection(self.collection).document(job_id)
+
+    def create_job(self, event_id: str, export_type: str, export_format: str, requested_by: str = None) -> tuple:
+        """
+        Registra um job de exportação. No modo inline (desenvolvimento e
+        testes) o job é executado imediatamente; no modo scheduled ele é
+        processado pelo worker agendado.
+
+        Returns:
+            tuple: (job, status_code)
+        """
+        if export_type not in EXPORT_TYPES:
+            return {'error': f'Invalid export type. Must be one of {EXPORT_TYPES}'}, 400
+        if export_format not in EXPORT_FORMATS:
+            return {'error': f'Invalid export format. Must be one of {list(EXPORT_FORMATS)}'}, 400
+        if export_format == 'xlsx' and Workbook is None:
+            return {'error': 'XLSX export requires openpyxl'}, 400
+
+        job_id = str(uuid.uuid4())
+        job = {
+            'job_id': job_id,
+            'event_id': event_id,
+            'type': export_type,
+            'format': export_format,
+            'requested_by': requested_by,
+            'status': 'PENDING',
+            'rows': 0,
+            'created_at': datetime.now(),
+            'updated_at': datetime.now()
+        }
+        self._job_ref(job_id).set(job)
+
+        if self.config['worker_mode'] == 'inline':
+            self.run_job(job_id)
+            return self.get_job(job_id)
+        return job, 202
+
+    def get_job(self, job_id: str) -> tuple:
+        """
+        Consulta o job; quando concluído, inclui uma URL assinada de download.
+        """
+        job_doc = self._job_ref(job_id).get()
+        if not job_doc.exists:
+            return {'error': 'Export job not found'}, 404
+
+        job = job_doc.to_dict()
+        if job.get('status') == 'DONE' and job.get('blob_path'):
+            blob = self.bucket.blob(job['blob_path'])
+            job['download_url'] = blob.generate_signed_url(
+                expiration=timedelta(minutes=self.config['url_expiration_minutes']),
+                version='v4'
+            )
+        return job, 200
+
+    def _claim(self, job_id: str):
+        """
+        Marca o job como RUNNING numa transação, evitando que dois workers o
+        processem. Jobs RUNNING além do timeout podem ser retomados.
+        """
+        job_ref = self._job_ref(job_id)
+        transaction = self.db.transaction()
+
+        @firestore.transactional
+        def claim_in_transaction(transaction):
+            snapshot = job_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return None
+            job = snapshot.to_dict()
+            started_at = job.get('started_at')
+            timed_out = (
+                job.get('status') == 'RUNNING' and started_at is not None and
+                started_at.replace(tzinfo=None) < datetime.now() - timedelta(minutes=self.config['job_timeout_minutes'])
+            )
+            if job.get('status') != 'PENDING' and not timed_out:
+                return None
+            transaction.update(job_ref, {
+                'status': 'RUNNING',
+                'started_at': datetime.now(),
+                'updated_at': datetime.now()
+            })
+            return job
+
+        return claim_in_transaction(transaction)
+
+    def _stream_orders(self, event_id: str, confirmed_only: bool):
+        """Percorre os pedidos do evento em páginas ordenadas por ID."""
+        query = self.db.collection('orders').where('event_id', '==', event_id)
+        if confirmed_only:
+            query = query.where('status', 'in', CONFIRMED_STATUSES)
+        query = query.order_by('__name__')
+
+        last_doc = None
+        while True:
+            page_query = query.start_after(last_doc) if last_doc else query
+            page = list(page_query.limit(self.config['page_size']).stream())
+            for order in page:
+                yield order
+            if len(page) < self.config['page_size']:
+                return
+            last_doc = page[-1]
+
+    def _participant_rows(self, event_id: str):
+        event_form = FormRepository().get_event_form(event_id)
+        standard_ids = {key for key, _ in PARTICIPANT_COLUMNS}
+        form_fields = [field for field in (event_form.fields if event_form else []) if field.id not in standard_ids]
+
+        yield [label for _, label in PARTICIPANT_COLUMNS] + [field.label or field.id for field in form_fields]
+        for order in self._stream_orders(event_id, confirmed_only=True):
+            order_data = order.to_dict()
+            tickets = order_data.get('tickets', [])
+            if not isinstance(tickets, list):
+                continue
+            for ticket_idx, ticket in enumerate(tickets):
+                participant = flatten_participant(order.id, order_data, ticket_idx, ticket)
+                yield [format_cell(participant.get(key)) for key, _ in PARTICIPANT_COLUMNS] + \
+                      [format_cell(participant['categories'].get(field.id)) for field in form_fields]
+
+    def _order_rows(self, event_id: str):
+        yield [label for _, label in ORDER_COLUMNS]
+        for order in self._stream_orders(event_id, confirmed_only=False):
+            order_data = order.to_dict()
+            tickets = order_data.get('tickets', [])
+            row = {
+                'order_id': order.id,
+                'payment_id': order_data.get('payment_id'),
+                'status': order_data.get('status'),
+                'billing_type': (order_data.get('payment_details') or {}).get('billingType'),
+                'tickets': len(tickets) if isinstance(tickets, list) else 0,
+                'subtotal_amount': order_data.get('subtotal_amount'),
+                'fee_amount': order_data.get('fee_amount'),
+                'discount_amount': order_data.get('discount_amount'),
+                'total_amount': order_data.get('total_amount'),
+                'coupon_code': (order_data.get('coupon_info') or {}).get('code'),
+                'user_id': order_data.get('user_id'),
+                'created_at': order_data.get('created_at')
+            }
+            yield [format_cell(row[key]) for key, _ in ORDER_COLUMNS]
+
+    def run_job(self, job_id: str) -> bool:
+        """
+        Executa um job pendente.
+
+        Returns:
+            bool: True se o job foi processado por esta chamada
+        """
+        job = self._claim(job_id)
+        if job is None:
+            return False
+
+        export_format = job['format']
+        file_descriptor, temp_path = tempfile.mkstemp(suffix=f'.{export_format}')
+        os.close(file_descriptor)
+        start_time = time.time()
+        rows = 0
+        try:
+            writer = XlsxRowWriter(temp_path) if export_format == 'xlsx' else CsvRowWriter(temp_path)
+            try:
+                row_source = self._participant_rows if job['type'] == 'participants' else self._order_rows
+                for row in row_source(job['event_id']):
+                    writer.write(row)
+                    rows += 1
+            finally:
+                writer.close()
+
+            blob_path = f"exports/{job['event_id']}/{job_id}.{export_format}"
+            self.bucket.blob(blob_path).upload_from_filename(temp_path, content_type=EXPORT_FORMATS[export_format])
+
+            duration = time.time() - start_time
+            data_rows = max(rows - 1, 0)
+            rows_per_second = data_rows / duration if duration > 0 else data_rows
+            print(f"[PERF] Export {job_id} ({job['type']}/{export_format}): {data_rows} linhas em {duration:.2f}s ({rows_per_second:.0f} linhas/s)")
+
+            self._job_ref(job_id).update({
+                'status': 'DONE',
+                'rows': data_rows,
+                'blob_path': blob_path,
+                'duration_seconds': round(duration, 3),
+                'rows_per_second': round(rows_per_second, 1),
+                'finished_at': datetime.now(),
+                'updated_at': datetime.now()
+            })
+            return True
+        except Exception as e:
+            print(f"[ERROR] Export {job_id} falhou: {str(e)}")
+            self._job_ref(job_id).update({
+                'status': 'FAILED',
+                'error': str(e),
+                'updated_at': datetime.now()
+            })
+            return True
+        finally:
+            os.remove(temp_path)
+
+    def process_pending(self, limit: int = 5) -> int:
+        """
+        Processa jobs pendentes (chamado pelo worker agendado).
+
+        Returns:
+            int: Quantidade de jobs processados
+        """
+        pending = self.db.collection(self.collection)\
+                      .where('status', '==', 'PENDING')\
+                      .order_by('created_at')\
+                      .limit(limit)\
+                      .select([])\
+                      .stream()
+        processed = sum(1 for job in pending if self.run_job(job.id))
+
+        # Retomar jobs interrompidos (ex.: timeout da Lambda durante a execução)
+        cutoff = datetime.now() - timedelta(minutes=self.config['job_timeout_minutes'])
+        stalled = self.db.collection(self.collection)\
+                      .where('status', '==', 'RUNNING')\
+                      .where('started_at', '<', cutoff)\
+                      .limit(limit)\
+                      .select([])\
+                      .stream()
+        processed += sum(1 for job in stalled if self.run_job(job.id))
+        return processed
@@ -0,0 +1,178 @@
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any
+from chalicelib.src.utils.hyperloglog import HyperLogLog
+
+# Limite de escritas por batch do Firestore
+MAX_BATCH_WRITES = 500
+
+
+class PageViewBuffer:
+    """
+    Buffer write-behind de visualizações dentro de um container aquecido.
+
+    Acumula os incrementos por event_id (e um sketch HyperLogLog de
+    visitantes por evento e dia) em memória. No Lambda o container fica
+    congelado entre invocações, então não há timers nem hooks de
+    encerramento confiáveis: o flush acontece ao fim de uma invocação
+    (flush_if_due, chamado pelo middleware HTTP) quando há flush_max_hits
+    visualizações pendentes ou a mais antiga tem flush_interval segundos,
+    gravando no máximo flush_max_events eventos num único batch. Como o
+    flush roda no caminho de uma requisição, cada flush une no máximo
+    flush_max_sketch_merges sketches de visitantes (uma transação por
+    evento); os demais ficam no buffer para os próximos flushes.
+
+    Janela de perda: visualizações ainda no buffer se perdem se o container
+    for descartado antes de uma nova invocação nele. São no máximo
+    flush_max_hits - 1 por container (até max_pending após flushes com
+    falha; o excedente é descartado e contabilizado em dropped_hits), sem
+    limite de tempo, já que um container ocioso só volta a gravar quando
+    recebe outra requisição.
+    """
+
+    def __init__(self, db, analytics_repository, flush_interval: float = 5,
+                 flush_max_hits: int = 100, max_pending: int = 1000, flush_max_events: int = 100,
+                 flush_max_sketch_merges: int = 5):
+        self.db = db
+        self.analytics_repository = analytics_repository
+        self.flush_interval = flush_interval
+        self.flush_max_hits = flush_max_hits
+        self.max_pending = max_pending
+        self.flush_max_events = min(flush_max_events, MAX_BATCH_WRITES)
+        self.flush_max_sketch_merges = flush_max_sketch_merges
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+        self._sketches: Dict[str, Dict[str, HyperLogLog]] = {}
+        self._pending = 0
+        self._oldest_pending_at = None
+
+        self.metrics = {
+            'flush_count': 0,
+            'failed_flushes': 0,
+            'failed_sketch_merges': 0,
+            'flushed_hits': 0,
+            'dropped_hits': 0,
+            'last_flush_at': None,
+            'last_flush_latency_ms': None
+        }
+
+    def add(self, event_id: str, count: int = 1, visitor_id: str = None):
+        """Registra visualizações no buffer, sem acessar o banco."""
+        with self._lock:
+            self._counts[event_id] = self._counts.get(event_id, 0) + count
+            if visitor_id:
+                day = datetime.now().strftime('%Y-%m-%d')
+                event_sketches = self._sketches.setdefault(event_id, {})
+                event_sketches.setdefault(day, HyperLogLog()).add(visitor_id)
+            self._pending += count
+            if self._oldest_pending_at is None:
+                self._oldest_pending_at = time.monotonic()
+
+    def is_due(self) -> bool:
+        with self._lock:
+            return bool(self._pending or self._sketches) and (
+                self._pending >= self.flush_max_hits or
+                time.monotonic() - self._oldest_pending_at >= self.flush_interval
+            )
+
+    def flush_if_due(self) -> int:
+        """
+        Flush ao fim da invocação, se o limite de visualizações ou o
+        intervalo tiver sido atingido.
+
+        Returns:
+            int: Número de visualizações gravadas
+        """
+        return self.flush() if self.is_due() else 0
+
+    def flush(self) -> int:
+        """
+        Grava em um batch as visualizações de até flush_max_events eventos
+        e une os sketches de até flush_max_sketch_merges eventos; o restante
+        fica para o próximo flush.
+
+        Returns:
+            int: Número de visualizações gravadas
+        """
+        with self._flush_lock:
+            with self._lock:
+                event_ids = list(self._counts)[:self.flush_max_events]
+                counts = {event_id: self._counts.pop(event_id) for event_id in event_ids}
+                sketch_event_ids = list(self._sketches)[:self.flush_max_sketch_merges]
+                sketches = {event_id: self._sketches.pop(event_id) for event_id in sketch_event_ids}
+                pending = sum(counts.values())
+                self._pending -= pending
+                self._oldest_pending_at = time.monotonic() if self._pending or self._sketches else None
+
+            if not counts and not sketches:
+                return 0
+
+            start_time = time.time()
+            try:
+                if counts:
+                    batch = self.db.batch()
+                    for event_id, count in counts.items():
+                        self.analytics_repository.increment_page_view(event_id, count, writer=batch)
+                    batch.commit()
+            except Exception as e:
+                print(f"[ERROR] Falha no flush de visualizações: {str(e)}")
+                self._requeue(counts, pending, sketches)
+                return 0
+
+            for event_id, sketches_by_day in sketches.items():
+                try:
+                    self.analytics_repository.merge_unique_visitors(event_id, sketches_by_day)
+                except Exception as e:
+                    print(f"[ERROR] Falha ao unir visitantes únicos do evento {event_id}: {str(e)}")
+                    self._requeue({}, 0, {event_id: sketches_by_day})
+
+            latency_ms = round((time.time() - start_time) * 1000, 2)
+            with self._lock:
+                self.metrics['flush_count'] += 1
+                self.metrics['flushed_hits'] += pending
+                self.metrics['last_flush_at'] = time.time()
+                self.metrics['last_flush_latency_ms'] = latency_ms
+
+            print(f"[PERF] Flushed {pending} page views for {len(counts)} events and {len(sketches)} visitor sketches in {latency_ms}ms")
+            return pending
+
+    def _requeue(self, counts: Dict[str, int], pending: int, sketches: Dict[str, Dict[str, HyperLogLog]]):
+        """Devolve ao buffer as visualizações de um flush com falha, respeitando max_pending."""
+        with self._lock:
+            for event_id, sketches_by_day in sketches.items():
+                event_sketches = self._sketches.setdefault(event_id, {})
+                for day, sketch in sketches_by_day.items():
+                    event_sketches.setdefault(day, HyperLogLog()).merge(sketch)
+            if sketches and self._oldest_pending_at is None:
+                self._oldest_pending_at = time.monotonic()
+
+            if not pending:
+                self.metrics['failed_sketch_merges'] += 1
+                return
+            self.metrics['failed_flushes'] += 1
+            if self._pending + pending > self.max_pending:
+                self.metrics['dropped_hits'] += pending
+                return
+            for event_id, count in counts.items():
+                self._counts[event_id] = self._counts.get(event_id, 0) + count
+            self._pending += pending
+            if self._oldest_pending_at is None:
+                self._oldest_pending_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        """Retorna as métricas de flush e o estado atual do buffer."""
+        with self._lock:
+            return {
+                **self.metrics,
+                'pending_hits': self._pending,
+                'pending_events': len(self._counts),
+                'pending_sketch_events': len(self._sketches),
+                'flush_interval_seconds': self.flush_interval,
+                'flush_max_hits': self.flush_max_hits,
+                'flush_max_events': self.flush_max_events,
+                'flush_max_sketch_merges': self.flush_max_sketch_merges,
+                'max_pending': self.max_pending
+            }
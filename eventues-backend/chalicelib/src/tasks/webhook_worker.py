@@ -0,0 +1,123 @@
+import time
+from chalicelib.src.config.environment import env_config
+from chalicelib.src.repositories.webhook_queue_repository import WebhookQueueRepository
+from chalicelib.src.usecases.payment_usecase import PaymentUseCase, ASAAS_STATUS_RANK
+
+
+def final_event(queue_docs: list):
+    """
+    Escolhe, entre os eventos de uma mesma cobrança, o que representa o
+    estado final: o mais avançado no ciclo de vida e, no empate, o mais recente.
+    """
+    def sort_key(queue_doc):
+        queue_data = queue_doc.to_dict()
+        status = (queue_data.get('payload', {}).get('payment') or {}).get('status')
+        return ASAAS_STATUS_RANK.get(status, -1), queue_data.get('received_at')
+    return max(queue_docs, key=sort_key)
+
+
+class WebhookWorker:
+    """
+    Drena a fila de webhooks em lotes. Eventos da mesma cobrança são
+    agrupados e apenas o estado final é aplicado ao pedido, numa única
+    escrita; os demais são registrados como processados junto com ele.
+
+    O processamento é idempotente (deduplicação por ID de evento e apenas
+    transições para frente), então execuções concorrentes são seguras.
+    """
+
+    def __init__(self, db, payment_usecase: PaymentUseCase = None):
+        self.db = db
+        self.queue = WebhookQueueRepository(db)
+        self.payment_usecase = payment_usecase or PaymentUseCase()
+        self.config = env_config.get_webhook_config()
+
+    def drain(self, limit: int = None, payment_id: str = None) -> dict:
+        """
+        Processa um lote de itens pendentes.
+
+        Returns:
+            dict: Métricas do lote (eventos lidos, grupos aplicados, falhas)
+        """
+        metrics, _ = self._drain_batch(limit, payment_id)
+        return metrics
+
+    def _drain_batch(self, limit: int = None, payment_id: str = None, after=None) -> tuple:
+        """
+        Processa um lote a partir do último item do lote anterior (after).
+
+        Returns:
+            tuple: (métricas, último item lido ou None)
+        """
+        start_time = time.time()
+        # Um batch do Firestore comporta no máximo 500 escritas
+        queue_docs = self.queue.get_pending(min(limit or self.config['batch_size'], 500), payment_id, after)
+
+        groups = {}
+        for queue_doc in queue_docs:
+            group_key = queue_doc.to_dict().get('payment_id') or queue_doc.id
+            groups.setdefault(group_key, []).append(queue_doc)
+
+        applied = 0
+        failed = 0
+        batch = self.db.batch()
+        for group_docs in groups.values():
+            final_doc = final_event(group_docs)
+            superseded_ids = [queue_doc.to_dict()['payload'].get('id') for queue_doc in group_docs if queue_doc is not final_doc]
+            try:
+                result, status_code = self.payment_usecase.process_webhook(
+                    final_doc.to_dict()['payload'], self.db, [event_id for event_id in superseded_ids if event_id]
+                )
+            except Exception as e:
+                result, status_code = {'error': str(e)}, 500
+
+            if status_code == 200:
+                self.queue.complete(batch, group_docs)
+                applied += 1
+            else:
+                # 4xx de payload inválido não se resolve com nova tentativa;
+                # 404 pode ser o pedido ainda sem payment_id gravado
+                self.queue.retry_or_fail(
+                    batch, group_docs, result.get('error', ''), self.config['max_attempts'],
+                    permanent=status_code == 400
+                )
+                failed += 1
+
+        if queue_docs:
+            batch.commit()
+
+        metrics = {
+            'events': len(queue_docs),
+            'groups': len(groups),
+            'applied': applied,
+            'failed': failed
+        }
+        if queue_docs:
+            print(f"[PERF] Webhook worker: {metrics['events']} eventos em {metrics['groups']} grupos em {time.time() - start_time:.3f}s ({failed} falhas)")
+        return metrics, queue_docs[-1] if queue_docs else None
+
+    def drain_all(self, time_budget: float = None) -> dict:
+        """
+        Drena a fila lote a lote até esvaziá-la ou esgotar o tempo. Cada lote
+        continua após o último item do anterior, então itens devolvidos para
+        nova tentativa só são relidos na próxima execução.
+
+        Args:
+            time_budget (float): Segundos disponíveis (abaixo do timeout do Lambda)
+
+        Returns:
+            dict: Métricas somadas dos lotes
+        """
+        time_budget = time_budget if time_budget is not None else self.config['drain_budget_seconds']
+        deadline = time.time() + time_budget
+        limit = min(self.config['batch_size'], 500)
+        totals = {'events': 0, 'groups': 0, 'applied': 0, 'failed': 0, 'batches': 0}
+        after = None
+        while time.time() < deadline:
+            metrics, after = self._drain_batch(limit, after=after)
+            for key in ('events', 'groups', 'applied', 'failed'):
+                totals[key] += metrics[key]
+            totals['batches'] += 1
+            if metrics['events'] < limit:
+                break
+        return totals
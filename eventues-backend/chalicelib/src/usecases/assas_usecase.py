@@ -1,7 +1,25 @@
 import json
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Any, Dict, Tuple
 import requests
+from cachetools import TTLCache
 from chalicelib.src.config.environment import env_config
+from chalicelib.src.utils.http_client import get_client
+
+checkout_config = env_config.get_checkout_config()
+
+# Executor compartilhado para I/O concorrente no checkout (ex.: QR code PIX)
+io_executor = ThreadPoolExecutor(max_workers=checkout_config['io_workers'])
+
+# Buscas de QR code PIX em andamento neste container (uma por cobrança)
+_pix_qr_inflight = {}
+_pix_qr_lock = threading.Lock()
+
+# Últimas consultas de status ao vivo (no máximo uma por cobrança a cada intervalo)
+_status_cache = TTLCache(maxsize=4096, ttl=checkout_config['status_live_interval'])
+_status_inflight = {}
+_status_lock = threading.Lock()
 
 
 class AsaasUseCase:
@@ -15,13 +33,24 @@ class AsaasUseCase:
             'Content-Type': 'application/json',
             'access_token': self.api_key
         }
+        # Cliente compartilhado (keep-alive) com timeouts e retries em GETs
+        self.client = get_client(
+            self.api_url,
+            headers=self.headers,
+            connect_timeout=asaas_config['connect_timeout'],
+            read_timeout=asaas_config['read_timeout'],
+            max_retries=asaas_config['max_retries'],
+            retry_backoff=asaas_config['retry_backoff'],
+            pool_size=asaas_config['pool_size'],
+            breaker_options=asaas_config['circuit_breaker']
+        )
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Latência, erros e estado do circuit breaker por endpoint do Asaas neste container."""
+        return self.client.get_metrics()
 
     def create_customer(self, customer_data: Dict[str, Any]) -> Dict[str, Any]:
-        response = requests.post(
-            f'{self.api_url}/customers',
-            json=customer_data,
-            headers=self.headers
-        )
+        response = self.client.post('/customers', name='customers.create', json=customer_data)
         return response.json()
 
     def tokenize_card(self, tokenization_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -33,11 +62,7 @@ class AsaasUseCase:
             if 'expirationYear' in card_data:
                 card_data['expiryYear'] = card_data.pop('expirationYear')
 
-        response = requests.post(
-            f'{self.api_url}/creditCard/tokenize',
-            json=tokenization_data,
-            headers=self.headers
-        )
+        response = self.client.post('/creditCard/tokenize', name='credit_card.tokenize', json=tokenization_data)
         print("[DEBUG] Asaas API Response:", response.status_code)
         if not response.ok:
             print("[ERROR] Tokenization failed:", response.text)
@@ -59,11 +84,11 @@ class AsaasUseCase:
             print(f"[DEBUG] Total value: {payment_data.get('value')}")
             print(f"[DEBUG] Installment value: {payment_data.get('installmentValue')}")
             
-        response = requests.post(
-            f'{self.api_url}/payments',
-            json=payment_data,
-            headers=self.headers
-        )
+        try:
+            response = self.client.post('/payments', name='payments.create', json=payment_data)
+        except requests.RequestException as e:
+            print(f"[ERROR] Payment creation failed: {str(e)}")
+            return {'errors': [{'description': 'Payment provider unavailable, please try again'}]}, 504
         
         # Log error if payment creation failed
         if not response.ok:
@@ -71,20 +96,82 @@ class AsaasUseCase:
             
         return response.json(), response.status_code
 
-    def get_pix_qr_code(self, payment_id: str) -> Dict[str, Any]:
-        response = requests.get(
-            f'{self.api_url}/payments/{payment_id}/pixQrCode',
-            headers=self.headers
-        )
+    def _fetch_pix_qr_code(self, payment_id: str) -> Dict[str, Any]:
+        try:
+            response = self.client.get(f'/payments/{payment_id}/pixQrCode', name='payments.pix_qr_code')
+        except requests.RequestException:
+            return None
         return response.json() if response.ok else None
 
+    def prefetch_pix_qr_code(self, payment_id: str) -> Future:
+        """
+        Inicia a busca do QR code PIX em segundo plano, sem bloquear o chamador.
+        Chamadas repetidas para a mesma cobrança compartilham a mesma busca.
+
+        Returns:
+            Future: Resolve para os dados do QR code ou None
+        """
+        with _pix_qr_lock:
+            future = _pix_qr_inflight.get(payment_id)
+            if future is None:
+                future = io_executor.submit(self._fetch_pix_qr_code, payment_id)
+                _pix_qr_inflight[payment_id] = future
+                future.add_done_callback(lambda _: _pix_qr_inflight.pop(payment_id, None))
+            return future
+
+    def get_pix_qr_code(self, payment_id: str) -> Dict[str, Any]:
+        """
+        Retorna o QR code PIX da cobrança, aguardando uma busca já em
+        andamento neste container antes de consultar o Asaas.
+        """
+        with _pix_qr_lock:
+            future = _pix_qr_inflight.get(payment_id)
+        if future is not None:
+            try:
+                return future.result(timeout=sum(self.client.timeout))
+            except Exception:
+                pass
+        return self._fetch_pix_qr_code(payment_id)
+
     def get_payment_status(self, payment_id: str) -> Dict[str, Any]:
-        response = requests.get(
-            f'{self.api_url}/payments/{payment_id}',
-            headers=self.headers
-        )
+        try:
+            response = self.client.get(f'/payments/{payment_id}', name='payments.get')
+        except requests.RequestException:
+            return None
         return response.json() if response.ok else None
         
+    def get_payment_status_coalesced(self, payment_id: str) -> Dict[str, Any]:
+        """
+        Consulta o status da cobrança no máximo uma vez por intervalo
+        (PAYMENT_STATUS_LIVE_INTERVAL_SECONDS). Chamadas concorrentes para a
+        mesma cobrança aguardam a consulta em andamento em vez de repeti-la.
+        """
+        with _status_lock:
+            if payment_id in _status_cache:
+                return _status_cache[payment_id]
+            future = _status_inflight.get(payment_id)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                _status_inflight[payment_id] = future
+
+        if not is_owner:
+            return future.result(timeout=sum(self.client.timeout) * (self.client.max_retries + 1))
+
+        try:
+            payment = self.get_payment_status(payment_id)
+            with _status_lock:
+                if payment:
+                    _status_cache[payment_id] = payment
+                _status_inflight.pop(payment_id, None)
+            future.set_result(payment)
+            return payment
+        except Exception as e:
+            with _status_lock:
+                _status_inflight.pop(payment_id, None)
+            future.set_exception(e)
+            raise
+        
     def simulate_installments(self, value: float, max_installments: int = 12) -> Tuple[Dict[str, Any], int]:
         """
         Simula as opções de parcelamento disponíveis para um determinado valor.
@@ -0,0 +1,181 @@
+from firebase_admin import firestore
+from chalicelib.src.repositories.inventory_repository import InventoryRepository, InsufficientStockError, parse_stock_id, stock_id_for
+from chalicelib.src.repositories.lot_repository import LotRepository, current_lot_index, lot_price, ticket_lots
+
+
+def calculate_platform_fee(price: float) -> float:
+    """Taxa da plataforma por ingresso: isento se gratuito, R$ 2 abaixo de R$ 20, senão 7,99%."""
+    if price == 0:
+        return 0
+    if price < 20:
+        return 2
+    return round((price * 7.99) / 100, 2)
+
+
+class InvalidQuantityError(ValueError):
+    """Quantidade de ingressos não é um inteiro positivo."""
+
+    def __init__(self, ticket_id: str, quantity):
+        super().__init__(f"Invalid quantity for ticket {ticket_id}: {quantity!r}")
+        self.ticket_id = ticket_id
+        self.quantity = quantity
+
+
+def ticket_quantity(ticket: dict) -> int:
+    """
+    Quantidade de um item do carrinho como inteiro positivo.
+
+    Raises:
+        InvalidQuantityError: Quantidade ausente, não inteira ou menor que 1
+    """
+    quantity = ticket.get('quantity')
+    try:
+        parsed = int(quantity)
+    except (TypeError, ValueError):
+        raise InvalidQuantityError(ticket.get('ticket_id'), quantity)
+    if parsed <= 0 or parsed != float(quantity):
+        raise InvalidQuantityError(ticket.get('ticket_id'), quantity)
+    return parsed
+
+
+class CartPricing:
+    """
+    Precificação do carrinho compartilhada pelo checkout: carrega os
+    ingressos com um único get_all, resolve o lote à venda, calcula
+    subtotal, taxas e demanda de estoque em uma passada e reserva o
+    estoque na mesma transação que grava o pedido.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.inventory = InventoryRepository(db)
+        self.lots = LotRepository(db)
+
+    def ticket_refs(self, event_id: str, tickets: list) -> dict:
+        event_ref = self.db.collection('events').document(event_id)
+        return {
+            ticket['ticket_id']: event_ref.collection('tickets').document(ticket['ticket_id'])
+            for ticket in tickets
+        }
+
+    def load_tickets(self, event_id: str, tickets: list) -> dict:
+        """
+        Ingressos do carrinho em uma única ida ao Firestore.
+
+        Returns:
+            dict: {ticket_id: dados do ingresso}, apenas os existentes
+        """
+        refs = self.ticket_refs(event_id, tickets)
+        ticket_ids = {ref.path: ticket_id for ticket_id, ref in refs.items()}
+        return {
+            ticket_ids[doc.reference.path]: doc.to_dict()
+            for doc in self.db.get_all(list(refs.values())) if doc.exists
+        }
+
+    def price(self, tickets: list, ticket_datas: dict, lot_indexes: dict = None, unit_prices: dict = None) -> dict:
+        """
+        Precifica o carrinho em uma passada.
+
+        Args:
+            lot_indexes: {ticket_id: lote à venda}, para o preço e o estoque do lote
+            unit_prices: {ticket_id: preço já acordado}, prioritário (ex.: lote gravado no pedido)
+
+        Returns:
+            dict: {'subtotal', 'fees', 'total', 'demand', 'lots'}
+
+        Raises:
+            InvalidQuantityError: Quantidade de algum ingresso inválida
+        """
+        lot_indexes = lot_indexes or {}
+        unit_prices = unit_prices or {}
+        subtotal = 0
+        fees = 0
+        demand = {}
+        prices = {}
+        for ticket in tickets:
+            ticket_id = ticket['ticket_id']
+            ticket_data = ticket_datas[ticket_id]
+            lot_index = lot_indexes.get(ticket_id)
+            quantity = ticket_quantity(ticket)
+            ticket_price = float(unit_prices[ticket_id]) if ticket_id in unit_prices else lot_price(ticket_data, lot_index)
+            prices[ticket_id] = ticket_price
+            subtotal += ticket_price * quantity
+            fees += calculate_platform_fee(ticket_price) * quantity
+            self.inventory.merge_demand(demand, self.inventory.stock_demand(ticket_id, ticket_data, quantity, lot_index))
+
+        return {
+            'subtotal': subtotal,
+            'fees': fees,
+            'total': subtotal + fees,
+            'demand': demand,
+            'lots': {
+                ticket_id: {'index': lot_index, 'valor': prices[ticket_id]}
+                for ticket_id, lot_index in lot_indexes.items() if lot_index is not None and ticket_id in prices
+            }
+        }
+
+    def resolve_lots(self, event_id: str, ticket_datas: dict) -> dict:
+        """
+        Lote à venda de cada ingresso, a partir do ponteiro em cache. Avanços
+        por data de virada são persistidos no ingresso.
+
+        Returns:
+            dict: {ticket_id: índice do lote ou None para ingressos sem lotes}
+
+        Raises:
+            InsufficientStockError: Todos os lotes de um ingresso encerraram
+        """
+        lot_indexes = {}
+        for ticket_id, ticket_data in ticket_datas.items():
+            lot_index = current_lot_index(ticket_data)
+            lotes = ticket_lots(ticket_data)
+            if lotes and lot_index is None:
+                raise InsufficientStockError(stock_id_for(ticket_id, len(lotes) - 1), 1, 0)
+            self.lots.sync_pointer(event_id, ticket_id, ticket_data, lot_index)
+            lot_indexes[ticket_id] = lot_index
+        return lot_indexes
+
+    def _advance_sold_out_lot(self, event_id: str, error: InsufficientStockError, ticket_datas: dict) -> bool:
+        """
+        Vira o lote cujo estoque esgotou na transação do pedido.
+
+        Returns:
+            bool: False se o estoque esgotado não é de um lote ou não há próximo lote
+        """
+        ticket_id, lot_index = parse_stock_id(error.stock_id)
+        ticket_data = ticket_datas.get(ticket_id)
+        if lot_index is None or ticket_data is None or lot_index + 1 >= len(ticket_lots(ticket_data)):
+            return False
+        self.lots.sync_pointer(event_id, ticket_id, ticket_data, lot_index + 1)
+        return True
+
+    def reserve(self, event_id: str, tickets: list, ticket_datas: dict, write) -> dict:
+        """
+        Precifica o carrinho e executa write(transaction, priced) em uma
+        transação, onde write reserva o estoque (inventory.allocate) e grava
+        o pedido. Se o lote esgotar durante a reserva, vira para o próximo,
+        reprecifica e tenta de novo.
+
+        Returns:
+            dict: Carrinho precificado (ver price)
+
+        Raises:
+            InsufficientStockError: Estoque esgotado sem próximo lote
+        """
+        max_attempts = 1 + sum(len(ticket_lots(ticket_data)) for ticket_data in ticket_datas.values())
+        for attempt in range(max_attempts):
+            priced = self.price(tickets, ticket_datas, self.resolve_lots(event_id, ticket_datas))
+            self.inventory.ensure_stocks(event_id, priced['demand'])
+            transaction = self.db.transaction()
+
+            @firestore.transactional
+            def write_in_transaction(transaction):
+                write(transaction, priced)
+
+            try:
+                write_in_transaction(transaction)
+            except InsufficientStockError as e:
+                if attempt + 1 >= max_attempts or not self._advance_sold_out_lot(event_id, e, ticket_datas):
+                    raise
+                continue
+            return priced
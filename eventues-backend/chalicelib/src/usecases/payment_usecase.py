@@ -1,11 +1,165 @@
 
-from datetime import datetime, timedelta
-from chalicelib.src.usecases.assas_usecase import AsaasUseCase
+import gzip
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from chalicelib.src.usecases.assas_usecase import AsaasUseCase, checkout_config
+from chalicelib.src.repositories.event_stats_repository import EventStatsRepository, merge_order_update, EXPIRED_STATUSES
+from chalicelib.src.repositories.qr_index_repository import QrIndexRepository, MAX_BATCH_WRITES
+from chalicelib.src.repositories.checkin_stats_repository import CheckinStatsRepository, ticket_checkin_state
+from chalicelib.src.repositories.participant_repository import ParticipantRepository, flatten_participant
+from chalicelib.src.repositories.webhook_event_repository import WebhookEventRepository
+from chalicelib.src.repositories.payment_index_repository import PaymentIndexRepository
+from chalicelib.src.repositories.pix_qr_repository import PixQrCodeRepository
+from chalicelib.src.repositories.inventory_repository import (
+    InventoryRepository, InsufficientStockError, inventory_config, order_stock_state
+)
+from chalicelib.src.repositories.lot_repository import current_lot_index
+from chalicelib.src.usecases.cart_pricing import CartPricing, InvalidQuantityError, ticket_quantity
+from chalicelib.src.usecases.waiting_room_usecase import WaitingRoomUseCase, queue_token_used_response
+from chalicelib.src.repositories.waiting_room_repository import WaitingRoomRepository, QueueTokenUsedError
+from chalicelib.src.config.environment import env_config
+from chalicelib.src.utils import qr_token
+from chalicelib.src.utils.circuit_breaker import CircuitOpenError
+from firebase_admin import firestore
+from google.api_core.exceptions import FailedPrecondition
 from chalice import UnauthorizedError, NotFoundError
 
+debug_logging = env_config.get_debug_logging()
+
+
+def parse_checkin_timestamp(value) -> datetime:
+    """
+    Converte o timestamp de um check-in (ISO, com ou sem fuso) para datetime
+    UTC sem fuso, comparável com os valores gravados via datetime.now().
+    Valores inválidos são tratados como o início dos tempos.
+    """
+    if hasattr(value, 'isoformat'):
+        parsed = value
+    else:
+        try:
+            parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except (ValueError, TypeError):
+            return datetime.min
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+ASAAS_STATUS_MAP = {
+    'PENDING': 'PAGAMENTO PENDENTE',
+    'RECEIVED': 'CONFIRMADO',
+    'CONFIRMED': 'CONFIRMADO',
+    'OVERDUE': 'CANCELADO',
+    'REFUNDED': 'CANCELADO',
+    'PARTIALLY_REFUNDED': 'CANCELADO',
+    'CHARGEBACK_REQUESTED': 'CANCELADO',
+    'CHARGEBACK_DISPUTE': 'CANCELADO',
+    'DELETED': 'CANCELADO',
+    'RESTORED': 'CANCELADO',
+    'ANTICIPATED': 'CONFIRMADO',
+    'RECEIVED_IN_CASH_UNDONE': 'CANCELADO'
+}
+
+# Ordem do ciclo de vida de uma cobrança no Asaas. Webhooks podem chegar fora
+# de ordem; uma transição só é aplicada se não retroceder nesta ordem.
+ASAAS_STATUS_RANK = {
+    'PENDING': 0,
+    'AWAITING_RISK_ANALYSIS': 0,
+    'OVERDUE': 1,
+    'DELETED': 1,
+    'RESTORED': 1,
+    'CONFIRMED': 2,
+    'RECEIVED': 3,
+    'RECEIVED_IN_CASH': 3,
+    'ANTICIPATED': 3,
+    'REFUND_REQUESTED': 4,
+    'REFUND_IN_PROGRESS': 4,
+    'CHARGEBACK_REQUESTED': 4,
+    'CHARGEBACK_DISPUTE': 4,
+    'AWAITING_CHARGEBACK_REVERSAL': 4,
+    'RECEIVED_IN_CASH_UNDONE': 4,
+    'PARTIALLY_REFUNDED': 5,
+    'REFUNDED': 5
+}
+
+
+def is_forward_transition(current_status: str, new_status: str) -> bool:
+    """
+    Indica se a mudança de status do Asaas avança no ciclo de vida (ou mantém
+    o nível com outro status). Status desconhecidos são sempre aplicados.
+    """
+    if not current_status or current_status not in ASAAS_STATUS_RANK or new_status not in ASAAS_STATUS_RANK:
+        return True
+    if current_status == new_status:
+        return False
+    return ASAAS_STATUS_RANK[new_status] >= ASAAS_STATUS_RANK[current_status]
+
+
+# Janela de sobreposição do feed incremental de check-ins
+CHECKIN_FEED_OVERLAP_SECONDS = 5
+
+# Releituras de um pedido alterado durante a sincronização de check-ins offline
+BULK_CHECKIN_ATTEMPTS = 3
+
+
+def checkin_item_time(item: dict, now: datetime) -> datetime:
+    """
+    Momento de um check-in offline: o timestamp do dispositivo, limitado ao
+    horário do servidor (relógio adiantado não vence alterações futuras).
+    Sem timestamp ou com valor inválido, vale o horário do servidor.
+    """
+    item_timestamp = parse_checkin_timestamp(item.get('timestamp')) if item.get('timestamp') else datetime.min
+    if item_timestamp == datetime.min:
+        return now
+    return min(item_timestamp, now)
+
+
 class PaymentUseCase:
 
-    def create_order(self, data: dict, db) -> tuple:
+    def _with_signed_tickets(self, order_id: str, update_data: dict, db):
+        """
+        Monta o update de um pedido emitindo os tokens de QR assinados quando
+        ele passa a CONFIRMADO. Executado dentro da transação de update_order,
+        sobre o estado atual do pedido.
+        """
+        def build(order_data: dict) -> dict:
+            event_id = order_data.get('event_id')
+            if update_data.get('status') != 'CONFIRMADO' or not event_id:
+                return update_data
+            tickets = [dict(ticket) for ticket in update_data.get('tickets', order_data.get('tickets', []))]
+            key_version = qr_token.get_key_versions(event_id, db)['current']
+            if not qr_token.sign_tickets(event_id, order_id, tickets, key_version):
+                return update_data
+            return {**update_data, 'tickets': tickets}
+        return build
+
+    def _on_order_update(self, db):
+        """
+        Callback de EventStatsRepository.update_order: reindexa os QR codes e
+        a cobrança, sincroniza a projeção de participantes e os shards de
+        estoque na mesma transação do pedido.
+        """
+        qr_index = QrIndexRepository(db)
+        participants = ParticipantRepository(db)
+        payments = PaymentIndexRepository(db)
+        inventory = InventoryRepository(db)
+
+        def on_update(writer, order_id: str, before: dict, after: dict):
+            qr_index.index_order_update(writer, order_id, before, after)
+            participants.sync_order(writer, order_id, before, after)
+            payments.sync_order(writer, order_id, before, after)
+            inventory.sync_order(writer, order_id, before, after)
+        return on_update
+
+    def create_order(self, data: dict, db, queue_token: str = None) -> tuple:
+        """
+        Cria o pedido reservando o estoque. Com a fila virtual ativa, o token
+        de fila é vinculado ao pedido na mesma transação.
+
+        Returns:
+            tuple: ({'order_id'}, status)
+        """
         try:
             if not data:
                 return {'error': 'No data provided'}, 400
@@ -15,47 +169,59 @@ class PaymentUseCase:
             if missing_fields:
                 return {'error': f'Missing required fields: {missing_fields}'}, 400
 
-            def calculate_platform_fee(price):
-                if price == 0:
-                    return 0
-                if price < 20:
-                    return 2
-                return round((price * 7.99) / 100, 2)
-
-            subtotal = 0
-            total_fees = 0
+            start_time = time.time()
             tickets = data['tickets']
-
             for ticket in tickets:
-                ticket_ref = db.collection('events').document(data['event_id']).collection('tickets').document(ticket['ticket_id'])
-                ticket_doc = ticket_ref.get()
-                if not ticket_doc.exists:
-                    return {'error': 'Ticket not found'}, 404
-
-                ticket_data = ticket_doc.to_dict()
-                ticket_price = ticket_data['valor']
-                ticket_quantity = ticket['quantity']
-                ticket_subtotal = ticket_price * ticket_quantity
-                ticket_fee = calculate_platform_fee(ticket_price) * ticket_quantity
-                subtotal += ticket_subtotal
-                total_fees += ticket_fee
-
-            total_amount = subtotal + total_fees
+                ticket_quantity(ticket)
+            cart = CartPricing(db)
+            ticket_datas = cart.load_tickets(data['event_id'], tickets)
+            if any(ticket['ticket_id'] not in ticket_datas for ticket in tickets):
+                return {'error': 'Ticket not found'}, 404
+            read_ms = (time.time() - start_time) * 1000
 
             order_ref = db.collection('orders').document()
-            order_data = {
-                'user_id': data['user_id'],
-                'event_id': data['event_id'],
-                'status': 'AGUARDANDO INFORMAÇÕES',
-                'tickets': tickets,
-                'subtotal_amount': subtotal,
-                'fee_amount': total_fees,
-                'total_amount': total_amount,
-                'created_at': datetime.now(),
-                'updated_at': datetime.now(),
-            }
-            order_ref.set(order_data)
+            qr_index = QrIndexRepository(db)
+            admission = WaitingRoomUseCase().admission(data['event_id'], queue_token, db)
+
+            def on_create(writer, order_id, order):
+                qr_index.index_tickets(writer, order['event_id'], order_id, order['tickets'])
+                cart.inventory.sync_order(writer, order_id, {}, order)
+
+            # Reserva o estoque e cria o pedido na mesma transação
+            def write(transaction, priced):
+                items = cart.inventory.allocate(transaction, data['event_id'], priced['demand'])
+                if admission:
+                    WaitingRoomRepository(db).claim_admission(transaction, data['event_id'], admission, order_ref.id)
+                order_data = {
+                    'user_id': data['user_id'],
+                    'event_id': data['event_id'],
+                    'status': 'AGUARDANDO INFORMAÇÕES',
+                    'tickets': tickets,
+                    'subtotal_amount': priced['subtotal'],
+                    'fee_amount': priced['fees'],
+                    'total_amount': priced['total'],
+                    'created_at': datetime.now(),
+                    'updated_at': datetime.now(),
+                }
+                if priced['lots']:
+                    order_data['lots'] = priced['lots']
+                if items:
+                    order_data['reservation'] = {
+                        'items': items,
+                        'expires_at': datetime.now() + timedelta(minutes=inventory_config['hold_minutes'])
+                    }
+                EventStatsRepository(db).create_order(order_ref, order_data, on_create=on_create, writer=transaction)
+
+            cart.reserve(data['event_id'], tickets, ticket_datas, write)
+            if debug_logging:
+                print(f"[PERF] create_order: leitura de {len(tickets)} ingressos em {read_ms:.1f}ms (1 get_all), total {(time.time() - start_time) * 1000:.1f}ms")
             return {'order_id': order_ref.id}, 200
+        except InsufficientStockError as e:
+            return {'error': 'Ingressos esgotados', 'stock_id': e.stock_id, 'available': e.available}, 409
+        except InvalidQuantityError as e:
+            return {'error': str(e)}, 400
+        except QueueTokenUsedError:
+            return queue_token_used_response()
         except Exception as e:
             return {'error': str(e)}, 500
 
@@ -79,6 +245,8 @@ class PaymentUseCase:
 
         try:
             customer = asaas_usecase.create_customer(customer_data)
+        except CircuitOpenError as exc:
+            return exc.to_response()
         except Exception as exc:
             return {'error': f'Asaas integration error: {str(exc)}'}, 500
 
@@ -112,6 +280,8 @@ class PaymentUseCase:
         }
         try:
             token = asaas_usecase.tokenize_card(tokenization_data)
+        except CircuitOpenError as exc:
+            return exc.to_response()
         except Exception as exc:
             return {'error': f'Asaas integration error: {str(exc)}'}, 500
 
@@ -124,7 +294,7 @@ class PaymentUseCase:
 
         return token, 200
 
-    def create_payment_session(self, data: dict, asaas_usecase: AsaasUseCase, db) -> tuple:
+    def create_payment_session(self, data: dict, asaas_usecase: AsaasUseCase, db, queue_token: str = None) -> tuple:
         if not data:
             return {'error': 'No data provided'}, 400
 
@@ -140,11 +310,36 @@ class PaymentUseCase:
         for ticket in tickets:
             if not ticket.get('ticket_id') or not ticket.get('quantity'):
                 return {'error': 'Each ticket must have ticket_id and quantity'}, 400
-
-        # 2. Get event and validate tickets
+            try:
+                ticket_quantity(ticket)
+            except InvalidQuantityError as e:
+                return {'error': str(e)}, 400
+
+        # Com fila ativa, o token vale só para este pedido (ou cliente, sem pedido)
+        binding = data.get('order_id') or f"customer:{data['customer']}"
+        rejection = WaitingRoomUseCase().bind(data['event_id'], queue_token, binding, db)
+        if rejection:
+            return rejection
+
+        # 2. Get event, tickets and coupon in a single get_all round trip
+        start_time = time.time()
         event_ref = db.collection('events').document(data['event_id'])
-        event_doc = event_ref.get()
-        if not event_doc.exists:
+        cart = CartPricing(db)
+        ticket_refs = cart.ticket_refs(data['event_id'], tickets)
+        coupon_data = data.get('coupon') or {}
+        coupon_ref = None
+        if coupon_data.get('coupon_id') and coupon_data.get('discount_amount'):
+            coupon_ref = event_ref.collection('coupons').document(coupon_data['coupon_id'])
+
+        # O pedido traz o lote (e o preço) reservado para cada ingresso
+        order_ref = db.collection('orders').document(data['order_id']) if data.get('order_id') else None
+
+        refs = [event_ref] + list(ticket_refs.values()) + [ref for ref in (coupon_ref, order_ref) if ref]
+        snapshots = {doc.reference.path: doc for doc in db.get_all(refs)}
+        read_ms = (time.time() - start_time) * 1000
+
+        event_doc = snapshots.get(event_ref.path)
+        if not event_doc or not event_doc.exists:
             return {'error': 'Event not found'}, 404
 
         event_data = event_doc.to_dict()
@@ -152,84 +347,68 @@ class PaymentUseCase:
         if not event_slug:
             return {'error': 'Invalid event data'}, 400
 
-        # 3. Get ticket details and calculate subtotal
-        subtotal_amount = 0
-        for ticket in tickets:
-            ticket_ref = event_ref.collection('tickets').document(ticket['ticket_id'])
-            ticket_doc = ticket_ref.get()
-            if not ticket_doc.exists:
+        # 3. Calculate subtotal and platform fee in a single pass
+        order_doc = snapshots.get(order_ref.path) if order_ref else None
+        if order_doc and order_doc.exists and order_stock_state(order_doc.to_dict()) == 'released':
+            # Reserva expirada: realoca o estoque antes de criar a cobrança
+            try:
+                EventStatsRepository(db).update_order(
+                    order_ref, {'status': 'AGUARDANDO INFORMAÇÕES', 'updated_at': datetime.now()},
+                    on_update=self._on_order_update(db), prepare=InventoryRepository(db).reclaim_or_reject
+                )
+            except InsufficientStockError as e:
+                return {'error': 'Ingressos esgotados', 'stock_id': e.stock_id, 'available': e.available}, 409
+        order_lots = (order_doc.to_dict().get('lots') or {}) if order_doc and order_doc.exists else {}
+
+        ticket_datas = {}
+        for ticket_id, ticket_ref in ticket_refs.items():
+            ticket_doc = snapshots.get(ticket_ref.path)
+            if not ticket_doc or not ticket_doc.exists:
                 return {'error': 'Ticket not found'}, 404
-            ticket_data = ticket_doc.to_dict()
-            quantity = int(ticket['quantity'])
-            subtotal_amount += float(ticket_data['valor']) * quantity
-
-        # 4. Calculate platform fee
-        def calculate_platform_fee(price):
-            if price == 0:
-                return 0
-            if price < 20:
-                return 2
-            return round((price * 7.99) / 100, 2)
-
-        fee_amount = 0
-        for ticket in tickets:
-            ticket_ref = event_ref.collection('tickets').document(ticket['ticket_id'])
-            ticket_doc = ticket_ref.get()
-            ticket_data = ticket_doc.to_dict()
-            quantity = int(ticket['quantity'])
-            ticket_price = float(ticket_data['valor'])
-            fee_amount += calculate_platform_fee(ticket_price) * quantity
-        total_amount = subtotal_amount + fee_amount
+            ticket_datas[ticket_id] = ticket_doc.to_dict()
+        priced = cart.price(
+            tickets, ticket_datas,
+            lot_indexes={ticket_id: current_lot_index(ticket_data) for ticket_id, ticket_data in ticket_datas.items()},
+            unit_prices={ticket_id: lot['valor'] for ticket_id, lot in order_lots.items()}
+        )
+        subtotal_amount = priced['subtotal']
+        fee_amount = priced['fees']
+        total_amount = priced['total']
         
-        # 4.5 Aplicar desconto do cupom se fornecido
+        # 4. Aplicar desconto do cupom se fornecido
         discount_amount = 0
         coupon_info = None
+        coupon_doc = None
         
-        if data.get('coupon'):
-            coupon_data = data['coupon']
-            if coupon_data.get('coupon_id') and coupon_data.get('discount_amount'):
-                discount_amount = float(coupon_data['discount_amount'])
-                coupon_info = {
-                    'coupon_id': coupon_data['coupon_id'],
-                    'code': coupon_data.get('code', ''),
-                    'discount_amount': discount_amount,
-                    'original_amount': total_amount
-                }
-                
-                # Verificar se o desconto é válido (não maior que o valor total)
-                if discount_amount > total_amount:
-                    discount_amount = total_amount
-                    coupon_info['discount_amount'] = discount_amount
-                
-                # Aplicar desconto
-                total_amount = total_amount - discount_amount
-                
-                # Valor mínimo para pagamento
-                if total_amount < 0.5:
-                    total_amount = 0.5
-                    
-                # Incrementar o contador de usos do cupom
-                try:
-                    # Obter referência para o documento do cupom
-                    coupon_ref = db.collection('events').document(data['event_id']).collection('coupons').document(coupon_data['coupon_id'])
-                    coupon_doc = coupon_ref.get()
-                    
-                    if coupon_doc.exists:
-                        # Atualizar o contador de usos
-                        current_uses = coupon_doc.to_dict().get('uses_count', 0)
-                        coupon_ref.update({
-                            'uses_count': current_uses + 1,
-                            'updated_at': datetime.now()
-                        })
-                        
-                        # Atualizar informações no coupon_info para retornar ao frontend
-                        coupon_info['uses_count'] = current_uses + 1
-                        
-                        print(f"Cupom {coupon_data['code']} utilizado. Total de usos: {current_uses + 1}")
-                    else:
-                        print(f"Cupom {coupon_data['coupon_id']} não encontrado ao tentar atualizar contador.")
-                except Exception as e:
-                    print(f"Erro ao atualizar contador de usos do cupom: {str(e)}")
+        if coupon_ref:
+            discount_amount = float(coupon_data['discount_amount'])
+            coupon_info = {
+                'coupon_id': coupon_data['coupon_id'],
+                'code': coupon_data.get('code', ''),
+                'discount_amount': discount_amount,
+                'original_amount': total_amount
+            }
+            
+            # Verificar se o desconto é válido (não maior que o valor total)
+            if discount_amount > total_amount:
+                discount_amount = total_amount
+                coupon_info['discount_amount'] = discount_amount
+            
+            # Aplicar desconto
+            total_amount = total_amount - discount_amount
+            
+            # Valor mínimo para pagamento
+            if total_amount < 0.5:
+                total_amount = 0.5
+
+            # O contador de usos é incrementado junto com o pedido, após a cobrança ser criada
+            coupon_doc = snapshots.get(coupon_ref.path)
+            if coupon_doc and coupon_doc.exists:
+                coupon_info['uses_count'] = coupon_doc.to_dict().get('uses_count', 0) + 1
+            else:
+                print(f"Cupom {coupon_data['coupon_id']} não encontrado ao tentar atualizar contador.")
+        if debug_logging:
+            print(f"[PERF] create_payment_session: leitura de evento/ingressos/cupom em {read_ms:.1f}ms ({len(refs)} documentos, 1 get_all)")
         
         # 5. Create payment
         payment_method = data['payment'].get('billingType', '').lower()
@@ -285,43 +464,100 @@ class PaymentUseCase:
                 'creditCardExpiryYear': card_data.get('expiryYear'),
                 'creditCardCcv': card_data.get('ccv')
             })
-        payment_result, status_code = asaas_usecase.create_payment(payment_data)
+        try:
+            payment_result, status_code = asaas_usecase.create_payment(payment_data)
+        except CircuitOpenError as exc:
+            return exc.to_response()
         if status_code != 200:
             error_msg = payment_result.get('errors', [{}])[0].get('description', 'Payment failed')
             return {'error': error_msg}, status_code
 
-        # 6. Get PIX QR code if applicable
+        # 6. Start the PIX QR code fetch; it overlaps with the Firestore transaction below
+        pix_future = None
         if payment_method == 'pix' and payment_result.get('id'):
-            pix_data = asaas_usecase.get_pix_qr_code(payment_result['id'])
-            if pix_data:
-                payment_result['pixQrCode'] = pix_data
+            pix_future = asaas_usecase.prefetch_pix_qr_code(payment_result['id'])
 
-        # 7. Save order to database
+        # 7. Save order to database (order, coupon usage and indexes in a single transaction)
         order_status = None
         if payment_result.get('status') == 'PENDING':
             order_status = 'PAGAMENTO PENDENTE'
         if payment_result.get('status') == 'CONFIRMED':
             order_status = 'CONFIRMADO'
-        order_ref = db.collection('orders').document(data["order_id"])
-        order_ref.update({
+        order_update = {
             'payment_id': payment_result['id'],
             'payment_url': payment_result.get('invoiceUrl'),
             'status': order_status or payment_result['status'],
             'payment_details': payment_result,
             'updated_at': datetime.now()
-        })
-        
+        }
+
         # If this was an installment payment, add that information to the order
         if payment_method == 'credit_card' and data['payment'].get('installments', 1) > 1:
-            installment_info = {
+            order_update['installment_info'] = {
                 'installments': data['payment'].get('installments'),
                 'installmentValue': data['payment'].get('installmentValue'),
                 'totalWithInterest': data['payment'].get('installmentTotal'),
                 'interestAmount': data['payment'].get('interestAmount')
             }
-            order_ref.update({
-                'installment_info': installment_info
+
+        # Adicionar informações do cupom na ordem
+        if coupon_info:
+            order_update.update({
+                'coupon_info': coupon_info,
+                'discount_amount': discount_amount,
+                'original_amount': coupon_info['original_amount']
             })
+
+        # A reserva de estoque passa a valer até o vencimento da cobrança
+        build_order_update = self._with_signed_tickets(data["order_id"], order_update, db)
+        reservation_expires_at = datetime.strptime(due_date, '%Y-%m-%d') + timedelta(days=inventory_config['payment_grace_days'])
+
+        def build_update(before: dict) -> dict:
+            update = build_order_update(before)
+            if (before.get('reservation') or {}).get('items'):
+                update = {**update, 'reservation.expires_at': reservation_expires_at}
+            return update
+
+        order_ref = db.collection('orders').document(data["order_id"])
+        order_hooks = self._on_order_update(db)
+
+        def on_update(transaction, order_id, before, after):
+            # O ponteiro da cobrança é gravado pelo hook (payment_id do pedido)
+            order_hooks(transaction, order_id, before, after)
+            if coupon_doc and coupon_doc.exists:
+                transaction.update(coupon_ref, {
+                    'uses_count': firestore.Increment(1),
+                    'updated_at': datetime.now()
+                })
+
+        try:
+            EventStatsRepository(db).update_order(order_ref, build_update, on_update=on_update, prepare=InventoryRepository(db).reclaim)
+        except Exception as e:
+            # A cobrança já existe no Asaas: a resposta leva o payment_id para
+            # que o replay da Idempotency-Key não crie uma segunda cobrança
+            print(f"[ERROR] Cobrança {payment_result['id']} criada, mas o pedido {data['order_id']} não foi atualizado: {str(e)}")
+            return {'error': 'Erro ao registrar o pagamento', 'payment_id': payment_result['id']}, 500
+        if coupon_info and 'uses_count' in coupon_info:
+            print(f"Cupom {coupon_info['code']} utilizado. Total de usos: {coupon_info['uses_count']}")
+
+        # O QR code é aguardado ainda nesta requisição (threads não rodam com o
+        # Lambda congelado) e gravado para o /pix-qrcode de qualquer container
+        if pix_future:
+            wait_start = time.time()
+            try:
+                pix_data = pix_future.result(timeout=sum(asaas_usecase.client.timeout))
+            except Exception as e:
+                print(f"[ERROR] Falha ao obter QR code PIX {payment_result['id']}: {str(e)}")
+                pix_data = None
+            if pix_data:
+                payment_result['pixQrCode'] = pix_data
+                try:
+                    PixQrCodeRepository(db).save(payment_result['id'], pix_data)
+                except Exception as e:
+                    print(f"[ERROR] Falha ao gravar QR code PIX {payment_result['id']}: {str(e)}")
+            if debug_logging:
+                print(f"[PERF] create_payment_session: espera pelo QR code PIX após a transação {(time.time() - wait_start) * 1000:.1f}ms")
+
         payment_result['subtotal_amount'] = subtotal_amount
         payment_result['fee_amount'] = fee_amount
         payment_result['total_amount'] = total_amount
@@ -331,33 +567,58 @@ class PaymentUseCase:
             payment_result['coupon'] = coupon_info
             payment_result['discount_amount'] = discount_amount
             payment_result['original_amount'] = coupon_info['original_amount']
-            
-            # Atualizar informações do cupom na ordem
-            order_ref.update({
-                'coupon_info': coupon_info,
-                'discount_amount': discount_amount,
-                'original_amount': coupon_info['original_amount']
-            })
-            
+
+        if debug_logging:
+            print(f"[PERF] create_payment_session: total {(time.time() - start_time) * 1000:.1f}ms")
         return payment_result, 200
 
-    def get_pix_qrcode(self, payment_id: str, asaas_usecase: AsaasUseCase) -> tuple:
+    def get_pix_qrcode(self, payment_id: str, asaas_usecase: AsaasUseCase, db) -> tuple:
+        """
+        QR code PIX da cobrança: gravado no checkout (uma leitura) ou, se
+        ainda não existir, buscado no Asaas e gravado para as próximas consultas.
+        """
         try:
+            pix_qr_codes = PixQrCodeRepository(db)
+            pix_data = pix_qr_codes.get(payment_id)
+            if pix_data:
+                return pix_data, 200
             pix_data = asaas_usecase.get_pix_qr_code(payment_id)
             if not pix_data:
                 return {'error': 'Failed to get PIX QR code'}, 400
+            pix_qr_codes.save(payment_id, pix_data)
             return pix_data, 200
+        except CircuitOpenError as e:
+            return e.to_response()
         except Exception as e:
             return {'error': str(e)}, 500
 
-    def process_webhook(self, event: dict, db) -> tuple:
+    def process_webhook(self, event: dict, db, superseded_event_ids: list = None) -> tuple:
+        """
+        Aplica um evento de webhook do Asaas ao pedido.
+
+        Args:
+            event (dict): Payload do webhook
+            superseded_event_ids (list): IDs de eventos anteriores da mesma
+                cobrança, substituídos por este no processamento em lote;
+                são registrados como processados junto com ele
+        """
         try:
             # 1. Validate event type
             event_type = event.get('event')
             if not event_type:
                 return {'error': 'Invalid webhook data: missing event type'}, 400
 
-            # 2. Get payment details
+            # 2. Short-circuit duplicate deliveries (one point read)
+            webhook_event_id = event.get('id')
+            webhook_events = WebhookEventRepository(db, env_config.get_webhook_config()['dedupe_ttl_days'])
+            if webhook_events.is_processed(webhook_event_id):
+                return {
+                    'status': 'duplicate',
+                    'message': 'Webhook event already processed',
+                    'event_id': webhook_event_id
+                }, 200
+
+            # 3. Get payment details
             payment = event.get('payment')
             if not payment:
                 return {'error': 'Invalid webhook data: missing payment'}, 400
@@ -365,65 +626,108 @@ class PaymentUseCase:
             if not payment_id:
                 return {'error': 'Invalid webhook data: missing payment ID'}, 400
 
-            # 3. Get order by payment_id
-            orders = db.collection('orders').where('payment_id', '==', payment_id).limit(1).get()
-            if not orders or len(orders) == 0:
+            # 4. Get order by payment_id (index point read; the order itself is read in the transaction)
+            order_id = PaymentIndexRepository(db).get_order_id(payment_id)
+            if not order_id:
                 return {'error': f'Order not found for payment_id {payment_id}'}, 404
-            order = orders[0]
-            order_data = order.to_dict()
+            order_ref = db.collection('orders').document(order_id)
 
-            # 4. Map Asaas status to Eventues status
+            # 5. Map Asaas status to Eventues status
             asaas_status = payment.get('status')
             if not asaas_status:
                 return {'error': 'Invalid webhook data: missing payment status'}, 400
-            status_map = {
-                'PENDING': 'PAGAMENTO PENDENTE',
-                'RECEIVED': 'CONFIRMADO',
-                'CONFIRMED': 'CONFIRMADO',
-                'OVERDUE': 'CANCELADO',
-                'REFUNDED': 'CANCELADO',
-                'PARTIALLY_REFUNDED': 'CANCELADO',
-                'CHARGEBACK_REQUESTED': 'CANCELADO',
-                'CHARGEBACK_DISPUTE': 'CANCELADO',
-                'DELETED': 'CANCELADO',
-                'RESTORED': 'CANCELADO',
-                'ANTICIPATED': 'CONFIRMADO',
-                'RECEIVED_IN_CASH_UNDONE': 'CANCELADO'
-            }
-            eventues_status = status_map.get(asaas_status, 'PAGAMENTO EM ANÁLISE')
+            eventues_status = ASAAS_STATUS_MAP.get(asaas_status, 'PAGAMENTO EM ANÁLISE')
 
-            # 5. Check if status has actually changed
-            current_status = order_data.get('status')
-            if current_status != eventues_status:
-                update_data = {
-                    'status': eventues_status,
-                    'updated_at': datetime.now(),
-                    'payment_details': {
-                        'status': asaas_status,
-                        'last_event': event_type,
-                        'last_update': datetime.now().isoformat()
-                    }
-                }
-                if 'value' in payment:
-                    update_data['payment_details']['value'] = float(payment['value'])
-                if 'netValue' in payment:
-                    update_data['payment_details']['netValue'] = float(payment['netValue'])
-                if 'billingType' in payment:
-                    update_data['payment_details']['billingType'] = payment['billingType']
-                if 'paymentDate' in payment:
-                    update_data['payment_details']['paymentDate'] = payment['paymentDate']
-                order.reference.update(update_data)
-
-            # 6. Return success response
+            update_data = {
+                'status': eventues_status,
+                'updated_at': datetime.now(),
+                'payment_details.status': asaas_status,
+                'payment_details.last_event': event_type,
+                'payment_details.last_update': datetime.now().isoformat()
+            }
+            if 'value' in payment:
+                update_data['payment_details.value'] = float(payment['value'])
+            if 'netValue' in payment:
+                update_data['payment_details.netValue'] = float(payment['netValue'])
+            if 'billingType' in payment:
+                update_data['payment_details.billingType'] = payment['billingType']
+            if 'paymentDate' in payment:
+                update_data['payment_details.paymentDate'] = payment['paymentDate']
+            build_signed_update = self._with_signed_tickets(order_id, update_data, db)
+
+            # 6. Apply only forward transitions, checked against the current order in the transaction
+            applied = {}
+
+            def build_update(order_data: dict):
+                current_asaas_status = (order_data.get('payment_details') or {}).get('status')
+                applied['value'] = is_forward_transition(current_asaas_status, asaas_status)
+                return build_signed_update(order_data) if applied['value'] else None
+
+            order_hooks = self._on_order_update(db)
+            webhook_record = {'event': event_type, 'payment_id': payment_id, 'status': asaas_status}
+
+            processed_event_ids = [webhook_event_id] + list(superseded_event_ids or [])
+
+            def on_update(transaction, order_id, before, after):
+                order_hooks(transaction, order_id, before, after)
+                for processed_event_id in processed_event_ids:
+                    webhook_events.mark_processed(processed_event_id, {**webhook_record, 'applied': True}, transaction)
+
+            if EventStatsRepository(db).update_order(order_ref, build_update, on_update=on_update, prepare=InventoryRepository(db).reclaim) is None:
+                return {'error': f'Order not found for payment_id {payment_id}'}, 404
+            if not applied.get('value'):
+                batch = db.batch()
+                for processed_event_id in processed_event_ids:
+                    webhook_events.mark_processed(processed_event_id, {**webhook_record, 'applied': False}, batch)
+                batch.commit()
+                return {
+                    'status': 'ignored',
+                    'message': 'Stale status transition ignored',
+                    'order_id': order_id,
+                    'new_status': asaas_status
+                }, 200
+
+            # 7. Return success response
             return {
                 'status': 'success',
                 'message': 'Webhook processed successfully',
-                'order_id': order.id,
+                'order_id': order_id,
                 'new_status': eventues_status
             }, 200
         except Exception as e:
             return {'error': f'Error processing webhook: {str(e)}'}, 500
 
+    @staticmethod
+    def _is_status_fresh(order_data: dict) -> bool:
+        """
+        Indica se o pedido pode responder à consulta de status sem chamar o
+        Asaas: a cobrança já saiu de pendente (webhooks aplicam as transições
+        seguintes) ou o pedido foi atualizado/consultado há pouco tempo.
+        """
+        asaas_status = (order_data.get('payment_details') or {}).get('status')
+        if not asaas_status:
+            return False
+        if ASAAS_STATUS_RANK.get(asaas_status, 0) > 0:
+            return True
+        checked_at = [
+            timestamp.replace(tzinfo=None) for timestamp in
+            [order_data.get('updated_at'), order_data.get('status_checked_at')] if hasattr(timestamp, 'replace')
+        ]
+        if not checked_at:
+            return False
+        return max(checked_at) > datetime.now() - timedelta(seconds=checkout_config['status_fresh_seconds'])
+
+    @staticmethod
+    def _payment_status_response(payment: dict, source: str) -> dict:
+        return {
+            'status': payment.get('status'),
+            'value': float(payment['value']) if payment.get('value') is not None else None,
+            'billingType': payment.get('billingType'),
+            'invoiceUrl': payment.get('invoiceUrl'),
+            'paymentDate': payment.get('paymentDate'),
+            'source': source
+        }
+
     def check_payment_status(self, payment_id: str, headers: dict,
                              asaas_usecase: AsaasUseCase, db, verify_token) -> tuple:
         try:
@@ -435,55 +739,94 @@ class PaymentUseCase:
             user_id = verify_token(id_token)
 
             # Buscar o pagamento no banco de dados
-            orders = db.collection('orders').where('payment_id', '==', payment_id).limit(1).get()
-            if not orders:
+            order_id = PaymentIndexRepository(db).get_order_id(payment_id)
+            order = db.collection('orders').document(order_id).get() if order_id else None
+            if not order or not order.exists:
                 raise NotFoundError('Pagamento não encontrado')
-            order = orders[0]
-            if order.to_dict()['user_id'] != user_id:
+            order_data = order.to_dict()
+            if order_data['user_id'] != user_id:
                 raise UnauthorizedError('Usuário não autorizado a ver este pagamento')
 
-            # Consultar status na Asaas
-            asaas_payment = asaas_usecase.get_payment_status(payment_id)
-            status_map = {
-                'PENDING': 'PAGAMENTO PENDENTE',
-                'RECEIVED': 'CONFIRMADO',
-                'CONFIRMED': 'CONFIRMADO',
-                'OVERDUE': 'CANCELADO',
-                'REFUNDED': 'CANCELADO',
-                'PARTIALLY_REFUNDED': 'CANCELADO',
-                'CHARGEBACK_REQUESTED': 'CANCELADO',
-                'CHARGEBACK_DISPUTE': 'CANCELADO',
-                'DELETED': 'CANCELADO',
-                'RESTORED': 'CANCELADO',
-                'ANTICIPATED': 'CONFIRMADO',
-                'RECEIVED_IN_CASH_UNDONE': 'CANCELADO'
-            }
-            order_status = status_map.get(asaas_payment['status'], 'PAGAMENTO EM ANÁLISE')
+            # Responder pelo pedido quando ele já reflete o status (webhook recente ou status além de pendente)
+            payment_details = order_data.get('payment_details') or {}
+            if self._is_status_fresh(order_data):
+                return self._payment_status_response(payment_details, source='order'), 200
+
+            # Consultar status na Asaas (uma consulta compartilhada por cobrança)
+            try:
+                asaas_payment = asaas_usecase.get_payment_status_coalesced(payment_id)
+            except CircuitOpenError:
+                if payment_details.get('status'):
+                    return self._payment_status_response(payment_details, source='order'), 200
+                raise
+            if not asaas_payment:
+                raise Exception('Asaas payment lookup failed')
+
+            asaas_status = asaas_payment['status']
+
+            def build_status_update(current):
+                update_data = {'status_checked_at': datetime.now()}
+                current_asaas_status = (current.get('payment_details') or {}).get('status')
+                if is_forward_transition(current_asaas_status, asaas_status):
+                    update_data.update({
+                        'status': ASAAS_STATUS_MAP.get(asaas_status, 'PAGAMENTO EM ANÁLISE'),
+                        'payment_details.status': asaas_status,
+                        'payment_details.last_update': datetime.now().isoformat(),
+                        'updated_at': datetime.now()
+                    })
+                    return self._with_signed_tickets(order.id, update_data, db)(current)
+                return update_data
 
-            if order.to_dict()['status'] != asaas_payment['status']:
-                order.reference.update({
-                    'status': order_status,
-                    'updated_at': datetime.now()
-                })
+            EventStatsRepository(db).update_order(
+                order.reference, build_status_update,
+                on_update=self._on_order_update(db), prepare=InventoryRepository(db).reclaim
+            )
 
-            return {
-                'status': asaas_payment['status'],
-                'value': float(asaas_payment['value']),
-                'billingType': asaas_payment['billingType'],
-                'invoiceUrl': asaas_payment.get('invoiceUrl'),
-                'paymentDate': asaas_payment.get('paymentDate')
-            }, 200
+            return self._payment_status_response(asaas_payment, source='asaas'), 200
         except (UnauthorizedError, NotFoundError) as e:
             return {'error': str(e)}, e.status_code
+        except CircuitOpenError as e:
+            return e.to_response()
         except Exception:
             return {'error': 'Erro ao verificar status do pagamento'}, 500
 
+    def expire_reservations(self, db, limit: int = None) -> int:
+        """
+        Expira os pedidos que ainda aguardam pagamento após o prazo da reserva,
+        devolvendo as unidades ao estoque na mesma transação.
+
+        Returns:
+            int: Quantidade de pedidos expirados
+        """
+        inventory = InventoryRepository(db)
+        on_update = self._on_order_update(db)
+        expired = 0
+        for order_ref in inventory.get_expired_reservations(limit or inventory_config['sweep_batch_size']):
+            def build_expiration(order_data: dict):
+                # Revalida na transação: o pagamento pode ter sido confirmado desde a consulta
+                expires_at = (order_data.get('reservation') or {}).get('expires_at')
+                if order_stock_state(order_data) != 'reserved' or not expires_at or expires_at.replace(tzinfo=None) >= datetime.now():
+                    return None
+                return {
+                    'status': 'EXPIRADO',
+                    'reservation.expired_at': datetime.now(),
+                    'updated_at': datetime.now()
+                }
+
+            after = EventStatsRepository(db).update_order(order_ref, build_expiration, on_update=on_update)
+            if after and after.get('status') == 'EXPIRADO':
+                expired += 1
+        return expired
+
     def update_order_tickets(self, order_id: str, tickets: list, db) -> tuple:
         try:
             if not tickets:
                 return {'error': 'No tickets data provided'}, 400
+            for ticket in tickets:
+                ticket_quantity(ticket)
 
             # Get the order
+            start_time = time.time()
             order_ref = db.collection('orders').document(order_id)
             order_doc = order_ref.get()
             if not order_doc.exists:
@@ -492,45 +835,54 @@ class PaymentUseCase:
             order_data = order_doc.to_dict()
             event_id = order_data.get('event_id')
 
-            def calculate_platform_fee(price):
-                if price == 0:
-                    return 0
-                if price < 20:
-                    return 2
-                return round((price * 7.99) / 100, 2)
-
-            subtotal = 0
-            total_fees = 0
+            cart = CartPricing(db)
+            ticket_datas = cart.load_tickets(event_id, tickets)
             for ticket in tickets:
-                ticket_ref = db.collection('events').document(event_id).collection('tickets').document(ticket['ticket_id'])
-                ticket_doc = ticket_ref.get()
-                if not ticket_doc.exists:
+                if ticket['ticket_id'] not in ticket_datas:
                     return {'error': f'Ticket {ticket["ticket_id"]} not found'}, 404
-                ticket_data = ticket_doc.to_dict()
-                ticket_price = ticket_data['valor']
-                ticket_quantity = ticket['quantity']
-                ticket_subtotal = ticket_price * ticket_quantity
-                ticket_fee = calculate_platform_fee(ticket_price) * ticket_quantity
-                subtotal += ticket_subtotal
-                total_fees += ticket_fee
-
-            total_amount = subtotal + total_fees
+            read_ms = (time.time() - start_time) * 1000
+
+            on_update = self._on_order_update(db)
+
+            # Refaz a reserva com o novo carrinho, na mesma transação do pedido
+            def write(transaction, priced):
+                before = order_ref.get(transaction=transaction).to_dict()
+                reservation = before.get('reservation') or {}
+                previous_items = reservation.get('items', []) if order_stock_state(before) == 'reserved' else []
+                items = cart.inventory.allocate(transaction, event_id, priced['demand'], released_items=previous_items)
+                update = {
+                    'tickets': tickets,
+                    'subtotal_amount': priced['subtotal'],
+                    'fee_amount': priced['fees'],
+                    'total_amount': priced['total'],
+                    'lots': priced['lots'],
+                    'updated_at': datetime.now()
+                }
+                if before.get('status') in EXPIRED_STATUSES:
+                    # Pedido expirado volta a aguardar pagamento com a nova reserva
+                    update['status'] = 'AGUARDANDO INFORMAÇÕES'
+                if items or previous_items:
+                    update['reservation'] = {
+                        'items': items,
+                        'expires_at': datetime.now() + timedelta(minutes=inventory_config['hold_minutes'])
+                    }
+                EventStatsRepository(db).write_order_update(transaction, order_ref, before, update, on_update)
 
-            order_ref.update({
-                'tickets': tickets,
-                'subtotal_amount': subtotal,
-                'fee_amount': total_fees,
-                'total_amount': total_amount,
-                'updated_at': datetime.now()
-            })
+            priced = cart.reserve(event_id, tickets, ticket_datas, write)
+            if debug_logging:
+                print(f"[PERF] update_order_tickets: leitura de pedido e {len(tickets)} ingressos em {read_ms:.1f}ms, total {(time.time() - start_time) * 1000:.1f}ms")
 
             return {
                 'message': 'Order tickets updated successfully',
                 'tickets': tickets,
-                'subtotal_amount': subtotal,
-                'fee_amount': total_fees,
-                'total_amount': total_amount
+                'subtotal_amount': priced['subtotal'],
+                'fee_amount': priced['fees'],
+                'total_amount': priced['total']
             }, 200
+        except InsufficientStockError as e:
+            return {'error': 'Ingressos esgotados', 'stock_id': e.stock_id, 'available': e.available}, 409
+        except InvalidQuantityError as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             return {'error': str(e)}, 500
 
@@ -581,13 +933,16 @@ class PaymentUseCase:
                     restructured_tickets.append(ticket)
                     
             # Atualiza a ordem com a nova estrutura de tickets
-            order_ref.update({
+            # Pedido expirado só volta a aguardar pagamento se houver estoque
+            EventStatsRepository(db).update_order(order_ref, {
                 'tickets': restructured_tickets,
                 'status': 'PAGAMENTO PENDENTE',
                 'updated_at': datetime.now()
-            })
+            }, on_update=self._on_order_update(db), prepare=InventoryRepository(db).reclaim_or_reject)
 
             return {'message': 'Participant information updated successfully, QR codes generated'}, 200
+        except InsufficientStockError as e:
+            return {'error': 'Ingressos esgotados', 'stock_id': e.stock_id, 'available': e.available}, 409
         except Exception as e:
             return {'error': str(e)}, 500
 
@@ -635,71 +990,102 @@ class PaymentUseCase:
                 order_data = order.to_dict()
                 if 'tickets' in order_data and isinstance(order_data['tickets'], list):
                     for ticket_idx, ticket in enumerate(order_data['tickets']):
-                        participant_info = {}
-                        if 'participants' in ticket and isinstance(ticket['participants'], list) and len(ticket['participants']) > 0:
-                            first_participant = ticket['participants'][0]
-                            participant_info['fullName'] = first_participant.get('fullName', 'Nome não informado')
-                            participant_info['gender'] = first_participant.get('gender', '')
-                            participant_info['birthDate'] = first_participant.get('birthDate', '')
-                            standard_fields = ['fullName', 'gender', 'birthDate', 'termsAccepted']
-                            categories = {}
-                            for key, value in first_participant.items():
-                                if key not in standard_fields:
-                                    categories[key] = value
-                            participant_info['categories'] = categories
-                        flat_participant = {
-                            'order_id': order.id,
-                            'participant_index': ticket_idx,
-                            'fullName': participant_info.get('fullName', 'Nome não informado'),
-                            'gender': participant_info.get('gender', ''),
-                            'birthDate': participant_info.get('birthDate', ''),
-                            'categories': participant_info.get('categories', {}),
-                            'ticket_name': ticket.get('ticket_name', ''),
-                            'ticket_id': ticket.get('ticket_id', ''),
-                            'qr_code_uuid': ticket.get('qr_code_uuid', ''),
-                            'order_status': order_data.get('status', ''),
-                            'created_at': order_data.get('created_at').isoformat() if 'created_at' in order_data and hasattr(order_data['created_at'], 'isoformat') else None,
-                            'user_id': order_data.get('user_id', ''),
-                            'checkin': ticket.get('checkin', False),
-                            'checkin_timestamp': ticket.get('checkin_timestamp', None),
-                            'checkin_by': ticket.get('checkin_by', None)
-                        }
-                        participants.append(flat_participant)
+                        participants.append(flatten_participant(order.id, order_data, ticket_idx, ticket))
             return {'participants': participants}, 200
         except Exception as e:
             return {'error': str(e)}, 500
 
+    def list_event_participants(self, event_id: str, params: dict, db) -> tuple:
+        """
+        Lista participantes a partir da projeção participants, com paginação
+        por cursor, busca por prefixo do nome e filtros por ticket_id,
+        check-in e categoria ("campo:valor"), sem varrer os pedidos.
+
+        Returns:
+            tuple: (resultado, status_code)
+        """
+        try:
+            try:
+                limit = max(1, min(int(params.get('limit', 50)), 200))
+            except ValueError:
+                return {'error': 'Invalid limit'}, 400
+            checkin = params.get('checkin')
+            if checkin is not None:
+                if checkin.lower() not in ['true', 'false']:
+                    return {'error': 'checkin must be true or false'}, 400
+                checkin = checkin.lower() == 'true'
+
+            result = ParticipantRepository(db).list_event_participants(
+                event_id,
+                limit=limit,
+                cursor=params.get('cursor'),
+                search=params.get('search'),
+                ticket_id=params.get('ticket_id'),
+                checkin=checkin,
+                category=params.get('category')
+            )
+            return result, 200
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+    def get_checkin_changes(self, event_id: str, since: str, db) -> tuple:
+        """
+        Feed incremental para as telas de check-in: participantes cujo estado
+        de check-in mudou desde `since` e os contadores do evento.
+
+        O cliente deve repassar next_since na próxima consulta; ele recua
+        alguns segundos para cobrir escritas ainda em andamento, então o mesmo
+        participante pode vir repetido e deve ser tratado como upsert.
+
+        Returns:
+            tuple: (resultado, status_code)
+        """
+        try:
+            since_dt = parse_checkin_timestamp(since) if since else None
+            if since and since_dt == datetime.min:
+                return {'error': 'Invalid since timestamp'}, 400
+            query_started_at = datetime.now()
+
+            participants = []
+            if since_dt is not None:
+                orders = db.collection('orders')\
+                           .where('event_id', '==', event_id)\
+                           .where('checkin_updated_at', '>', since_dt)\
+                           .stream()
+                for order in orders:
+                    order_data = order.to_dict()
+                    if order_data.get('status') not in ['CONFIRMADO', 'CONFIRMED', 'RECEIVED']:
+                        continue
+                    tickets = order_data.get('tickets', [])
+                    if not isinstance(tickets, list):
+                        continue
+                    for ticket_idx, ticket in enumerate(tickets):
+                        synced_at = ticket_checkin_state(order_data, ticket_idx)['checkin_synced_at']
+                        if synced_at and parse_checkin_timestamp(synced_at) > since_dt:
+                            participants.append(flatten_participant(order.id, order_data, ticket_idx, ticket))
+
+            stats = CheckinStatsRepository(db).get(event_id)
+            return {
+                'participants': participants,
+                'stats': {
+                    'total': stats.get('total', 0),
+                    'por_ingresso': stats.get('por_ingresso', {})
+                },
+                'next_since': (query_started_at - timedelta(seconds=CHECKIN_FEED_OVERLAP_SECONDS)).isoformat()
+            }, 200
+        except Exception as e:
+            return {'error': str(e)}, 500
+
     def update_participant_checkin(self, event_id: str, order_id: str,
                                    participant_index: int, checkin_status: bool,
                                    user_id: str, db) -> tuple:
-        from datetime import datetime
         try:
             order_ref = db.collection('orders').document(order_id)
-            order_doc = order_ref.get()
-            if not order_doc.exists:
-                return {'error': 'Order not found'}, 404
-            order_data = order_doc.to_dict()
-            if order_data.get('event_id') != event_id:
-                return {'error': 'Order does not belong to this event'}, 400
-            if order_data.get('status') not in ['CONFIRMADO', 'CONFIRMED', 'RECEIVED']:
-                return {'error': 'Cannot check in participants from unconfirmed orders'}, 400
-            if 'tickets' not in order_data or not isinstance(order_data['tickets'], list):
-                return {'error': 'No tickets found in this order'}, 400
-            if participant_index < 0 or participant_index >= len(order_data['tickets']):
-                return {'error': 'Invalid participant index'}, 400
-            # Concorrência otimista: buscar snapshot atual
-            order_snapshot = order_ref.get()
-            current_order_data = order_snapshot.to_dict()
-            if len(current_order_data['tickets']) <= participant_index:
-                return {'error': 'Participant index out of bounds'}, 400
-            current_order_data['tickets'][participant_index]['checkin'] = checkin_status
-            current_order_data['tickets'][participant_index]['checkin_timestamp'] = datetime.now().isoformat() if checkin_status else None
-            current_order_data['tickets'][participant_index]['checkin_by'] = user_id if checkin_status else None
-            order_ref.update({
-                'tickets': current_order_data['tickets'],
-                'updated_at': datetime.now()
-            })
-            updated_participant = current_order_data['tickets'][participant_index]
+            result, status_code = self._checkin_ticket(order_ref, event_id, participant_index, checkin_status, user_id, db)
+            if status_code != 200:
+                return result, status_code
+
+            updated_participant = result['ticket']
             participant_info = {}
             if 'participants' in updated_participant and isinstance(updated_participant['participants'], list) and len(updated_participant['participants']) > 0:
                 first_participant = updated_participant['participants'][0]
@@ -718,46 +1104,108 @@ class PaymentUseCase:
                 'checkin_timestamp': updated_participant.get('checkin_timestamp', None),
                 'checkin_by': updated_participant.get('checkin_by', None)
             }
+            if result['duplicate']:
+                message = 'Participant was already checked in'
+            else:
+                message = f"Participant check-in {'completed' if checkin_status else 'reverted'} successfully"
             return {
-                'message': f"Participant check-in {'completed' if checkin_status else 'reverted'} successfully",
+                'message': message,
+                'duplicate': result['duplicate'],
                 'participant': flat_participant
             }, 200
         except Exception as e:
             return {'error': str(e)}, 500
 
+    def _checkin_ticket(self, order_ref, event_id: str, ticket_index: int, checkin_status: bool,
+                        user_id: str, db, qr_code_uuid: str = None) -> tuple:
+        """
+        Registra o check-in de um único ingresso numa transação que grava
+        apenas o campo checkins.{índice} do pedido, sem reescrever o array de
+        tickets. Leituras repetidas de um ingresso já utilizado não alteram o
+        registro original e são sinalizadas como duplicate.
+
+        Returns:
+            tuple: ({'ticket': ingresso com estado de check-in, 'duplicate': bool}, 200)
+                ou (erro, status_code)
+        """
+        transaction = db.transaction()
+
+        @firestore.transactional
+        def checkin_in_transaction(transaction):
+            order_snapshot = order_ref.get(transaction=transaction)
+            if not order_snapshot.exists:
+                return {'error': 'Order not found'}, 404
+            order_data = order_snapshot.to_dict()
+            if order_data.get('event_id') != event_id:
+                return {'error': 'Order does not belong to this event'}, 400
+            if order_data.get('status') not in ['CONFIRMADO', 'CONFIRMED', 'RECEIVED']:
+                return {'error': 'Cannot check in participants from unconfirmed orders'}, 400
+            tickets = order_data.get('tickets')
+            if not isinstance(tickets, list) or not tickets:
+                return {'error': 'No tickets found in this order'}, 400
+            if ticket_index < 0 or ticket_index >= len(tickets):
+                return {'error': 'Invalid participant index'}, 400
+            if qr_code_uuid is not None and tickets[ticket_index].get('qr_code_uuid') != qr_code_uuid:
+                return {'error': 'QR code não encontrado ou inválido para este evento'}, 404
+
+            state = ticket_checkin_state(order_data, ticket_index)
+            duplicate = bool(checkin_status) and state['checkin']
+            if not duplicate:
+                now = datetime.now()
+                was_checked_in = state['checkin']
+                state = {
+                    'checkin': bool(checkin_status),
+                    'checkin_timestamp': now.isoformat() if checkin_status else None,
+                    'checkin_by': user_id if checkin_status else None,
+                    'checkin_updated_at': now.isoformat(),
+                    'checkin_synced_at': now.isoformat()
+                }
+                transaction.update(order_ref, {
+                    f'checkins.{ticket_index}': state,
+                    'checkin_updated_at': now,
+                    'updated_at': now
+                })
+                CheckinStatsRepository(db).apply(
+                    transaction, event_id, tickets[ticket_index].get('ticket_id'), was_checked_in, state['checkin']
+                )
+                ParticipantRepository(db).sync_order(
+                    transaction, order_ref.id, order_data,
+                    merge_order_update(order_data, {f'checkins.{ticket_index}': state})
+                )
+            return {'ticket': {**tickets[ticket_index], **state}, 'duplicate': duplicate}, 200
+
+        return checkin_in_transaction(transaction)
+
     def qr_code_checkin(self, event_id: str, qr_code_uuid: str, checkin_status: bool, user_id: str, db) -> tuple:
         from datetime import datetime
         try:
-            orders = db.collection('orders').where('event_id', '==', event_id).where('status', 'in', ['CONFIRMADO', 'CONFIRMED', 'RECEIVED']).stream()
-            found_order = None
-            found_ticket_index = -1
-            found_ticket = None
-            for order in orders:
-                order_data = order.to_dict()
-                if 'tickets' in order_data and isinstance(order_data['tickets'], list):
-                    for ticket_idx, ticket in enumerate(order_data['tickets']):
-                        if ticket.get('qr_code_uuid') == qr_code_uuid:
-                            found_order = order
-                            found_ticket_index = ticket_idx
-                            found_ticket = ticket
-                            break
-                if found_order:
-                    break
-            if not found_order or found_ticket_index == -1:
+            if qr_token.is_signed_token(qr_code_uuid):
+                # Token assinado: forjados ou de outro evento são rejeitados sem I/O
+                index_entry = qr_token.verify_token(qr_code_uuid, event_id)
+                if not index_entry:
+                    return {'error': 'QR code inválido para este evento'}, 403
+                if index_entry['key_version'] < qr_token.get_key_versions(event_id, db)['min']:
+                    return {'error': 'QR code assinado com chave revogada'}, 403
+            else:
+                qr_index = QrIndexRepository(db)
+
+                # QR code legado: localizar o ingresso pelo índice (uma leitura)
+                index_entry = qr_index.get(qr_code_uuid)
+                if index_entry is None:
+                    index_entry = self._find_qr_code_in_orders(event_id, qr_code_uuid, qr_index, db)
+                if not index_entry or index_entry.get('event_id') != event_id:
+                    return {'error': 'QR code não encontrado ou inválido para este evento'}, 404
+
+            order_id = index_entry['order_id']
+            ticket_index = index_entry['ticket_index']
+            order_ref = db.collection('orders').document(order_id)
+            result, status_code = self._checkin_ticket(
+                order_ref, event_id, ticket_index, checkin_status, user_id, db, qr_code_uuid=qr_code_uuid
+            )
+            if status_code != 200:
                 return {'error': 'QR code não encontrado ou inválido para este evento'}, 404
-            order_ref = db.collection('orders').document(found_order.id)
-            order_snapshot = order_ref.get()
-            current_order_data = order_snapshot.to_dict()
-            if len(current_order_data['tickets']) <= found_ticket_index:
-                return {'error': 'Participant index out of bounds'}, 400
-            current_order_data['tickets'][found_ticket_index]['checkin'] = checkin_status
-            current_order_data['tickets'][found_ticket_index]['checkin_timestamp'] = datetime.now().isoformat() if checkin_status else None
-            current_order_data['tickets'][found_ticket_index]['checkin_by'] = user_id if checkin_status else None
-            order_ref.update({
-                'tickets': current_order_data['tickets'],
-                'updated_at': datetime.now()
-            })
-            updated_ticket = current_order_data['tickets'][found_ticket_index]
+            updated_ticket = result['ticket']
+
             participant_info = {}
             if 'participants' in updated_ticket and isinstance(updated_ticket['participants'], list) and len(updated_ticket['participants']) > 0:
                 first_participant = updated_ticket['participants'][0]
@@ -767,8 +1215,8 @@ class PaymentUseCase:
                     'birthDate': first_participant.get('birthDate', '')
                 }
             flat_participant = {
-                'order_id': found_order.id,
-                'participant_index': found_ticket_index,
+                'order_id': order_id,
+                'participant_index': ticket_index,
                 'fullName': participant_info.get('fullName', 'Nome não informado'),
                 'gender': participant_info.get('gender', ''),
                 'ticket_name': updated_ticket.get('ticket_name', ''),
@@ -777,13 +1225,319 @@ class PaymentUseCase:
                 'checkin_timestamp': updated_ticket.get('checkin_timestamp', None),
                 'checkin_by': updated_ticket.get('checkin_by', None)
             }
+            if result['duplicate']:
+                # Leitura repetida: o registro original de check-in é preservado
+                return {
+                    'error': f"Ingresso já utilizado (check-in em {flat_participant['checkin_timestamp']})",
+                    'duplicate': True,
+                    'participant': flat_participant
+                }, 409
             return {
                 'message': f"Check-in {'realizado' if checkin_status else 'revertido'} com sucesso por QR code",
+                'duplicate': False,
                 'participant': flat_participant
             }, 200
         except Exception as e:
             return {'error': str(e)}, 500
+
+    def _find_qr_code_in_orders(self, event_id: str, qr_code_uuid: str, qr_index: QrIndexRepository, db):
+        """
+        Busca um QR code ainda não indexado varrendo os pedidos confirmados do
+        evento e indexa o pedido encontrado para as próximas leituras.
+        """
+        orders = db.collection('orders').where('event_id', '==', event_id).where('status', 'in', ['CONFIRMADO', 'CONFIRMED', 'RECEIVED']).stream()
+        for order in orders:
+            order_data = order.to_dict()
+            tickets = order_data.get('tickets', [])
+            if not isinstance(tickets, list):
+                continue
+            for ticket_idx, ticket in enumerate(tickets):
+                if ticket.get('qr_code_uuid') == qr_code_uuid:
+                    batch = db.batch()
+                    qr_index.index_tickets(batch, event_id, order.id, tickets)
+                    batch.commit()
+                    return {'event_id': event_id, 'order_id': order.id, 'ticket_index': ticket_idx}
+        return None
             
+    def get_checkin_snapshot(self, event_id: str, db) -> tuple:
+        """
+        Gera o snapshot de check-in do evento para validação offline nos
+        portões: QR codes válidos com nome do participante e do ingresso,
+        montado numa única passada pelos pedidos confirmados.
+
+        Returns:
+            tuple: ((gzip_bytes, version), status_code) ou (erro, status_code)
+        """
+        try:
+            orders = db.collection('orders')\
+                       .where('event_id', '==', event_id)\
+                       .where('status', 'in', ['CONFIRMADO', 'CONFIRMED', 'RECEIVED'])\
+                       .select(['tickets', 'checkins'])\
+                       .stream()
+
+            entries = []
+            for order in orders:
+                order_data = order.to_dict()
+                tickets = order_data.get('tickets', [])
+                if not isinstance(tickets, list):
+                    continue
+                for ticket_idx, ticket in enumerate(tickets):
+                    qr_code_uuid = ticket.get('qr_code_uuid')
+                    if not qr_code_uuid:
+                        continue
+                    participants = ticket.get('participants') or [{}]
+                    entries.append({
+                        'q': qr_code_uuid,
+                        'n': participants[0].get('fullName', 'Nome não informado'),
+                        't': ticket.get('ticket_name', ''),
+                        'o': order.id,
+                        'i': ticket_idx,
+                        'c': ticket_checkin_state(order_data, ticket_idx)['checkin']
+                    })
+
+            entries.sort(key=lambda entry: entry['q'])
+
+            # Só as versões de chave: o portão valida pela lista de QR codes.
+            # As chaves HMAC nunca saem do servidor (permitiriam forjar ingressos).
+            key_versions = qr_token.get_key_versions(event_id, db) if env_config.get_qr_signing_secret() else {}
+
+            version = hashlib.sha256(json.dumps([key_versions, entries], separators=(',', ':')).encode('utf-8')).hexdigest()[:16]
+            snapshot = {
+                'event_id': event_id,
+                'version': version,
+                'generated_at': datetime.now().isoformat(),
+                'count': len(entries),
+                'key_versions': key_versions,
+                'tickets': entries
+            }
+            payload = gzip.compress(json.dumps(snapshot, separators=(',', ':')).encode('utf-8'))
+            return (payload, version), 200
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+    def bulk_checkin(self, event_id: str, checkins: list, user_id: str, db) -> tuple:
+        """
+        Aplica check-ins coletados offline pelos portões.
+
+        Cada item traz qr_code_uuid, checkin_status e o timestamp (ISO) em que
+        foi registrado no dispositivo, limitado ao horário do servidor.
+        Conflitos são resolvidos por last-writer-wins: o item só é aplicado se
+        for mais recente que a última alteração de check-in do ingresso. Os
+        pedidos afetados são lidos com get_all e gravados em batch, junto com
+        a variação dos contadores de check-in; cada pedido só é gravado se
+        não mudou desde a leitura (update_time), senão é relido e reavaliado.
+        """
+        try:
+            if not checkins or not isinstance(checkins, list):
+                return {'error': 'No check-ins provided'}, 400
+
+            index_entries = QrIndexRepository(db).get_many([item.get('qr_code_uuid') for item in checkins])
+
+            now = datetime.now()
+            results = []
+            items_by_order = {}
+            for item in checkins:
+                qr_code_uuid = item.get('qr_code_uuid')
+                entry = index_entries.get(qr_code_uuid)
+                if not entry or entry.get('event_id') != event_id:
+                    results.append({'qr_code_uuid': qr_code_uuid, 'result': 'not_found'})
+                    continue
+                items_by_order.setdefault(entry['order_id'], []).append(
+                    (entry['ticket_index'], item, checkin_item_time(item, now))
+                )
+
+            pending_orders = items_by_order
+            for _ in range(BULK_CHECKIN_ATTEMPTS):
+                conflicted = self._apply_bulk_checkins(event_id, pending_orders, user_id, results, db)
+                if not conflicted:
+                    break
+                pending_orders = {order_id: items_by_order[order_id] for order_id in conflicted}
+            else:
+                results.extend(
+                    {'qr_code_uuid': item.get('qr_code_uuid'), 'result': 'conflict'}
+                    for items in pending_orders.values() for _, item, _ in items
+                )
+
+            return {
+                'applied': sum(1 for result in results if result['result'] == 'applied'),
+                'results': results
+            }, 200
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+    def _apply_bulk_checkins(self, event_id: str, items_by_order: dict, user_id: str, results: list, db) -> list:
+        """
+        Uma rodada do bulk_checkin: lê os pedidos e grava, em batches, as
+        alterações de check-in de cada um com precondição de update_time.
+
+        Returns:
+            list: IDs dos pedidos alterados por outra escrita (batch rejeitado),
+                  cujos resultados não foram registrados
+        """
+        order_refs = [db.collection('orders').document(order_id) for order_id in items_by_order]
+        orders = {doc.id: doc for doc in db.get_all(order_refs)}
+
+        checkin_stats = CheckinStatsRepository(db)
+        participants = ParticipantRepository(db)
+        conflicted = []
+        batch = db.batch()
+        batch_orders = []
+        batch_results = []
+        pending_writes = 0
+        stats_deltas = {}
+
+        def commit_batch():
+            checkin_stats.apply_counts(batch, event_id, stats_deltas)
+            try:
+                batch.commit()
+                results.extend(batch_results)
+            except FailedPrecondition:
+                # Batch atômico: nada foi gravado, os pedidos serão relidos
+                conflicted.extend(batch_orders)
+
+        for order_id, items in items_by_order.items():
+            order_doc = orders.get(order_id)
+            order_data = order_doc.to_dict() if order_doc and order_doc.exists else None
+            if not order_data or order_data.get('status') not in ['CONFIRMADO', 'CONFIRMED', 'RECEIVED']:
+                results.extend({'qr_code_uuid': item.get('qr_code_uuid'), 'result': 'not_found'} for _, item, _ in items)
+                continue
+
+            tickets = order_data.get('tickets', [])
+            order_update = {}
+            order_results = []
+            # Aplicar na ordem cronológica para que o último escritor prevaleça
+            for ticket_index, item, item_timestamp in sorted(items, key=lambda entry: entry[2]):
+                qr_code_uuid = item.get('qr_code_uuid')
+                if ticket_index >= len(tickets) or tickets[ticket_index].get('qr_code_uuid') != qr_code_uuid:
+                    order_results.append({'qr_code_uuid': qr_code_uuid, 'result': 'not_found'})
+                    continue
+
+                state = order_update.get(f'checkins.{ticket_index}') or ticket_checkin_state(order_data, ticket_index)
+                last_update = state.get('checkin_updated_at') or state.get('checkin_timestamp')
+                if last_update and item_timestamp <= parse_checkin_timestamp(last_update):
+                    order_results.append({'qr_code_uuid': qr_code_uuid, 'result': 'stale', 'checkin': state.get('checkin', False)})
+                    continue
+
+                checkin_status = bool(item.get('checkin_status', True))
+                order_update[f'checkins.{ticket_index}'] = {
+                    'checkin': checkin_status,
+                    'checkin_timestamp': item_timestamp.isoformat() if checkin_status else None,
+                    'checkin_by': (item.get('user_id') or user_id) if checkin_status else None,
+                    'checkin_updated_at': item_timestamp.isoformat(),
+                    'checkin_synced_at': datetime.now().isoformat()
+                }
+                order_results.append({'qr_code_uuid': qr_code_uuid, 'result': 'applied', 'checkin': checkin_status})
+
+            if not order_update:
+                results.extend(order_results)
+                continue
+
+            # Pedido + projeção de cada ingresso alterado + contadores
+            if pending_writes + len(order_update) + 2 > MAX_BATCH_WRITES:
+                commit_batch()
+                batch = db.batch()
+                batch_orders = []
+                batch_results = []
+                pending_writes = 0
+                stats_deltas = {}
+
+            # Variação dos contadores entre o estado gravado e o final de cada ingresso
+            for field, state in order_update.items():
+                ticket_index = int(field.split('.', 1)[1])
+                was_checked_in = ticket_checkin_state(order_data, ticket_index)['checkin']
+                if was_checked_in != state['checkin']:
+                    ticket_id = tickets[ticket_index].get('ticket_id')
+                    stats_deltas[ticket_id] = stats_deltas.get(ticket_id, 0) + (1 if state['checkin'] else -1)
+
+            pending_writes += participants.sync_order(
+                batch, order_id, order_data, merge_order_update(order_data, order_update)
+            )
+            order_update['checkin_updated_at'] = datetime.now()
+            order_update['updated_at'] = datetime.now()
+            batch.update(order_doc.reference, order_update, option=db.write_option(last_update_time=order_doc.update_time))
+            pending_writes += 1
+            batch_orders.append(order_id)
+            batch_results.extend(order_results)
+
+        if pending_writes:
+            commit_batch()
+        return conflicted
+
+    def rotate_qr_key(self, event_id: str, revoke_previous: bool, db) -> tuple:
+        """
+        Rotaciona a chave de assinatura dos QR codes do evento. Novos ingressos
+        passam a ser assinados com a nova versão; com revoke_previous, tokens
+        de versões anteriores deixam de ser aceitos e os ingressos confirmados
+        são reassinados.
+
+        Returns:
+            tuple: (resultado, status_code)
+        """
+        try:
+            if not env_config.get_qr_signing_secret():
+                return {'error': 'QR_SIGNING_SECRET not defined'}, 500
+
+            event_ref = db.collection('events').document(event_id)
+            transaction = db.transaction()
+
+            @firestore.transactional
+            def rotate_in_transaction(transaction):
+                event_snapshot = event_ref.get(transaction=transaction)
+                if not event_snapshot.exists:
+                    return None
+                event_data = event_snapshot.to_dict()
+                versions = {
+                    'current': int(event_data.get('qr_key_version', 1)) + 1,
+                    'min': int(event_data.get('qr_min_key_version', 1))
+                }
+                if revoke_previous:
+                    versions['min'] = versions['current']
+                transaction.update(event_ref, {
+                    'qr_key_version': versions['current'],
+                    'qr_min_key_version': versions['min']
+                })
+                return versions
+
+            versions = rotate_in_transaction(transaction)
+            if versions is None:
+                return {'error': 'Event not found'}, 404
+            qr_token.invalidate_key_versions(event_id)
+
+            resigned = 0
+            if revoke_previous:
+                on_update = self._on_order_update(db)
+                orders = db.collection('orders')\
+                           .where('event_id', '==', event_id)\
+                           .where('status', 'in', ['CONFIRMADO', 'CONFIRMED', 'RECEIVED'])\
+                           .stream()
+                batch = db.batch()
+                pending_writes = 0
+                for order in orders:
+                    before = order.to_dict()
+                    tickets = [dict(ticket) for ticket in before.get('tickets', []) or []]
+                    if not qr_token.sign_tickets(event_id, order.id, tickets, versions['current']):
+                        continue
+                    # Pedido + índice de QR + projeção de participantes
+                    if pending_writes + 2 * len(tickets) + 1 > MAX_BATCH_WRITES:
+                        batch.commit()
+                        batch = db.batch()
+                        pending_writes = 0
+                    batch.update(order.reference, {'tickets': tickets, 'updated_at': datetime.now()})
+                    on_update(batch, order.id, before, {**before, 'tickets': tickets})
+                    pending_writes += 1 + 2 * len(tickets)
+                    resigned += 1
+                if pending_writes:
+                    batch.commit()
+
+            return {
+                'event_id': event_id,
+                'qr_key_version': versions['current'],
+                'qr_min_key_version': versions['min'],
+                'resigned_orders': resigned
+            }, 200
+        except Exception as e:
+            return {'error': str(e)}, 500
+
     def update_order_status(self, order_id: str, status: str, db) -> tuple:
         """
         Updates the status of an order. This is primarily used for free ticket orders
@@ -812,11 +1566,10 @@ class PaymentUseCase:
             if not order_doc.exists:
                 return {'error': 'Order not found'}, 404
                 
-            # Update the order status
-            order_ref.update({
+            update_data = {
                 'status': status,
                 'updated_at': datetime.now()
-            })
+            }
             
             # For free tickets marked as confirmed, also update to indicate it's been processed
             if status == 'CONFIRMADO':
@@ -834,14 +1587,20 @@ class PaymentUseCase:
                     updated_tickets.append(ticket)
                 
                 if updated_tickets:
-                    order_ref.update({
-                        'tickets': updated_tickets
-                    })
+                    update_data['tickets'] = updated_tickets
+            
+            # Update the order (signed QR tokens, event aggregate and QR index in the same transaction)
+            EventStatsRepository(db).update_order(
+                order_ref, self._with_signed_tickets(order_id, update_data, db),
+                on_update=self._on_order_update(db), prepare=InventoryRepository(db).reclaim_or_reject
+            )
             
             return {
                 'message': f'Order status updated to {status} successfully',
                 'order_id': order_id
             }, 200
             
+        except InsufficientStockError as e:
+            return {'error': 'Ingressos esgotados', 'stock_id': e.stock_id, 'available': e.available}, 409
         except Exception as e:
             return {'error': str(e)}, 500
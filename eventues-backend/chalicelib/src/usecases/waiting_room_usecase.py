@@ -0,0 +1,146 @@
+import math
+import time
+from chalicelib.src.repositories.waiting_room_repository import WaitingRoomRepository, QueueTokenUsedError, waiting_room_config
+from chalicelib.src.config.environment import env_config
+from chalicelib.src.utils import queue_token
+
+debug_logging = env_config.get_debug_logging()
+
+QUEUE_TOKEN_HEADER = 'X-Queue-Token'
+
+
+class WaitingRoomUseCase:
+    """
+    Fila virtual para aberturas de inscrição concorridas. Cada comprador
+    entra na fila, recebe uma posição e um token assinado com o horário de
+    admissão; os endpoints de checkout só aceitam tokens já liberados, o que
+    limita as escritas no Firestore e as chamadas ao Asaas à taxa de
+    admissão configurada para o evento. Cada token vale para um único
+    pedido: o primeiro pedido (ou sessão de pagamento) criado com ele fica
+    vinculado à admissão.
+    """
+
+    def update_settings(self, event_id: str, data: dict, db) -> tuple:
+        if not isinstance(data, dict) or 'enabled' not in data:
+            return {'error': 'Missing required fields: [\'enabled\']'}, 400
+        admission_rate = data.get('admission_rate')
+        if admission_rate is not None:
+            try:
+                admission_rate = float(admission_rate)
+            except (TypeError, ValueError):
+                return {'error': 'admission_rate must be a number'}, 400
+            if admission_rate <= 0:
+                return {'error': 'admission_rate must be greater than zero'}, 400
+
+        settings = WaitingRoomRepository(db).save_settings(event_id, bool(data['enabled']), admission_rate)
+        return settings, 200
+
+    def join(self, event_id: str, db) -> tuple:
+        """
+        Entra na fila do evento.
+
+        Returns:
+            tuple: ({'enabled', 'token', 'position', 'admit_at', 'expires_at', 'wait_seconds'}, status)
+        """
+        repository = WaitingRoomRepository(db)
+        settings = repository.get_settings(event_id)
+        if not settings['enabled']:
+            return {'enabled': False}, 200
+
+        start_time = time.time()
+        slot = repository.take_slot(event_id, settings, now=start_time)
+        admit_at = math.ceil(slot['admit_at'])
+        expires_at = admit_at + waiting_room_config['token_ttl']
+        token = queue_token.issue_token(event_id, settings['opened_at'], slot['position'], admit_at, expires_at)
+        if not token:
+            return {'error': 'Queue signing secret not configured'}, 500
+        if debug_logging:
+            print(f"[PERF] waiting room {event_id}: posição {slot['position']} em {(time.time() - start_time) * 1000:.1f}ms")
+
+        return {
+            'enabled': True,
+            'token': token,
+            'position': slot['position'],
+            'admit_at': admit_at,
+            'expires_at': expires_at,
+            'wait_seconds': max(admit_at - int(start_time), 0)
+        }, 200
+
+    def get_status(self, event_id: str, token: str, db) -> tuple:
+        """
+        Situação do token na fila, calculada apenas a partir do token e da
+        taxa de admissão (sem leitura da fila).
+        """
+        settings = WaitingRoomRepository(db).get_settings(event_id)
+        if not settings['enabled']:
+            return {'enabled': False, 'admitted': True}, 200
+        claims = queue_token.verify_token(token, event_id)
+        if not claims or claims['opened_at'] != settings['opened_at']:
+            return {'error': 'Invalid or expired queue token'}, 403
+
+        wait_seconds = max(claims['admit_at'] - time.time(), 0)
+        return {
+            'enabled': True,
+            'admitted': wait_seconds == 0,
+            'position': claims['position'],
+            'ahead': math.ceil(wait_seconds * settings['admission_rate']),
+            'wait_seconds': math.ceil(wait_seconds),
+            'expires_at': claims['expires_at']
+        }, 200
+
+    def check_admission(self, event_id: str, token: str, db):
+        """
+        Valida o token de fila de uma requisição de checkout.
+
+        Returns:
+            tuple: (erro, status) se a requisição deve ser recusada, ou None
+        """
+        if not event_id:
+            return None
+        settings = WaitingRoomRepository(db).get_settings(event_id)
+        if not settings['enabled']:
+            return None
+        claims = queue_token.verify_token(token, event_id) if token else None
+        if not claims or claims['opened_at'] != settings['opened_at']:
+            return {'error': 'A valid queue token is required', 'queue_required': True}, 403
+
+        wait_seconds = claims['admit_at'] - time.time()
+        if wait_seconds > 0:
+            return {'error': 'Not admitted yet', 'retry_after': math.ceil(wait_seconds)}, 429
+        return None
+
+    def admission(self, event_id: str, token: str, db):
+        """
+        Claims do token de uma requisição já aceita por check_admission.
+
+        Returns:
+            dict: Claims do token, ou None sem token ou sem fila ativa
+        """
+        if not event_id or not token:
+            return None
+        settings = WaitingRoomRepository(db).get_settings(event_id)
+        if not settings['enabled']:
+            return None
+        return queue_token.verify_token(token, event_id)
+
+    def bind(self, event_id: str, token: str, binding: str, db):
+        """
+        Consome o token da fila para binding (pedido ou cliente da sessão de
+        pagamento). Repetições com o mesmo binding são aceitas.
+
+        Returns:
+            tuple: (erro, status) se o token já foi usado por outro, ou None
+        """
+        claims = self.admission(event_id, token, db)
+        if not claims:
+            return None
+        try:
+            WaitingRoomRepository(db).bind_admission(event_id, claims, binding)
+        except QueueTokenUsedError:
+            return queue_token_used_response()
+        return None
+
+
+def queue_token_used_response() -> tuple:
+    """Recusa de um token de fila já vinculado a outro pedido."""
+    return {'error': 'Queue token already used', 'queue_required': True}, 403
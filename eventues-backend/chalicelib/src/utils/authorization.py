@@ -0,0 +1,49 @@
+from chalicelib.src.config.environment import env_config
+
+auth_config = env_config.get_auth_config()
+
+
+def request_user_id(request):
+    """UID do Firebase autenticado pelo authorizer da rota, ou None."""
+    authorizer = (request.context or {}).get('authorizer') or {}
+    return authorizer.get('principalId')
+
+
+def is_admin(user_id) -> bool:
+    return bool(user_id) and user_id in auth_config['admin_user_ids']
+
+
+def check_admin(request):
+    """
+    Restringe a rota aos administradores da plataforma (ADMIN_USER_IDS).
+
+    Returns:
+        tuple: (erro, status) se a requisição deve ser recusada, ou None
+    """
+    user_id = request_user_id(request)
+    if not user_id:
+        return {'error': 'Authentication required'}, 401
+    if not is_admin(user_id):
+        return {'error': 'Admin access required'}, 403
+    return None
+
+
+def check_event_organizer(request, event_id: str, db):
+    """
+    Restringe a rota ao organizador do evento (campo user_id do evento) ou
+    a um administrador.
+
+    Returns:
+        tuple: (erro, status) se a requisição deve ser recusada, ou None
+    """
+    user_id = request_user_id(request)
+    if not user_id:
+        return {'error': 'Authentication required'}, 401
+    if is_admin(user_id):
+        return None
+    event_doc = db.collection('events').document(event_id).get()
+    if not event_doc.exists:
+        return {'error': 'Evento não encontrado'}, 404
+    if event_doc.to_dict().get('user_id') != user_id:
+        return {'error': 'Only the event organizer can perform this action'}, 403
+    return None
@@ -0,0 +1,140 @@
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Dict
+
+CLOSED = 'CLOSED'
+OPEN = 'OPEN'
+HALF_OPEN = 'HALF_OPEN'
+
+
+class CircuitOpenError(Exception):
+    """Chamada rejeitada sem tocar a rede porque o circuito do endpoint está aberto."""
+
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(f"Circuit open for {name}, retry after {retry_after}s")
+        self.name = name
+        self.retry_after = retry_after
+
+    def to_response(self) -> tuple:
+        """Resposta padrão "tente mais tarde" para os usecases."""
+        return {
+            'error': 'Payment provider temporarily unavailable, please retry later',
+            'retry_after': self.retry_after
+        }, 503
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker de um endpoint. Mantém uma janela deslizante das últimas
+    chamadas e abre o circuito quando a taxa de erro ou o p95 de latência
+    passam dos limites. Aberto, rejeita chamadas até open_seconds; depois
+    passa a HALF_OPEN e libera até half_open_max_calls chamadas de teste:
+    se todas tiverem sucesso o circuito fecha, e qualquer falha o reabre.
+    """
+
+    def __init__(self, name: str, window_seconds: float = 60, min_calls: int = 10,
+                 error_rate_threshold: float = 0.5, p95_latency_ms: float = 5000,
+                 open_seconds: float = 30, half_open_max_calls: int = 1):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate_threshold
+        self.p95_latency_ms = p95_latency_ms
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+
+        self.state = CLOSED
+        self.opened_at = None
+        self.half_open_in_flight = 0
+        self.half_open_successes = 0
+        self.transitions = {}
+        self.rejected = 0
+        self._calls = deque()
+        self._lock = threading.Lock()
+
+    def _transition(self, new_state: str):
+        key = f"{self.state}->{new_state}"
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        print(f"[DEBUG] Circuit {self.name}: {self.state} -> {new_state}")
+        self.state = new_state
+        if new_state == OPEN:
+            self.opened_at = time.time()
+        if new_state == HALF_OPEN:
+            self.half_open_in_flight = 0
+            self.half_open_successes = 0
+        if new_state == CLOSED:
+            self._calls.clear()
+
+    def _trim(self, now: float):
+        while self._calls and self._calls[0][0] < now - self.window_seconds:
+            self._calls.popleft()
+
+    def _stats(self) -> Dict[str, float]:
+        durations = sorted(duration for _, duration, _ in self._calls)
+        errors = sum(1 for _, _, success in self._calls if not success)
+        p95 = durations[max(math.ceil(len(durations) * 0.95) - 1, 0)] if durations else 0.0
+        return {
+            'calls': len(durations),
+            'error_rate': errors / len(durations) if durations else 0.0,
+            'p95_ms': p95
+        }
+
+    def allow(self):
+        """
+        Reserva a execução de uma chamada.
+
+        Raises:
+            CircuitOpenError: Circuito aberto ou limite de chamadas de teste atingido
+        """
+        with self._lock:
+            if self.state == OPEN:
+                elapsed = time.time() - self.opened_at
+                if elapsed < self.open_seconds:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, max(math.ceil(self.open_seconds - elapsed), 1))
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self.half_open_in_flight >= self.half_open_max_calls:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, max(math.ceil(self.open_seconds), 1))
+                self.half_open_in_flight += 1
+
+    def record(self, duration_ms: float, success: bool):
+        """Registra o resultado de uma chamada liberada por allow()."""
+        with self._lock:
+            now = time.time()
+            if self.state == HALF_OPEN:
+                self.half_open_in_flight = max(self.half_open_in_flight - 1, 0)
+                if not success or duration_ms > self.p95_latency_ms:
+                    self._transition(OPEN)
+                    return
+                self.half_open_successes += 1
+                if self.half_open_successes >= self.half_open_max_calls:
+                    self._transition(CLOSED)
+                return
+            if self.state != CLOSED:
+                return
+
+            self._calls.append((now, duration_ms, success))
+            self._trim(now)
+            stats = self._stats()
+            if stats['calls'] >= self.min_calls and (
+                stats['error_rate'] >= self.error_rate_threshold or stats['p95_ms'] > self.p95_latency_ms
+            ):
+                self._transition(OPEN)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            self._trim(time.time())
+            stats = self._stats()
+            return {
+                'state': self.state,
+                'calls_in_window': stats['calls'],
+                'error_rate': round(stats['error_rate'], 3),
+                'p95_ms': round(stats['p95_ms'], 1),
+                'rejected': self.rejected,
+                'transitions': dict(self.transitions),
+                'opened_at': self.opened_at
+            }
@@ -1,4 +1,7 @@
+import hashlib
+import time
 import firebase_admin
+from cachetools import TTLCache
 from firebase_admin import credentials, firestore, auth, storage
 from chalicelib.src.config.environment import env_config
 
@@ -15,10 +18,19 @@ firebase_admin.initialize_app(cred, {
 db = firestore.client()
 bucket = storage.bucket()
 
+# Tokens já verificados (hash do token -> uid e expiração), evitando repetir a
+# verificação da assinatura em chamadas frequentes como o polling de status
+_verified_tokens = TTLCache(maxsize=4096, ttl=env_config.get_auth_config()['token_cache_ttl'])
+
 # Função para verificar tokens de autenticação do Firebase
 def verify_token(token: str) -> str:
+    token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest() if token else None
+    cached = _verified_tokens.get(token_hash) if token_hash else None
+    if cached and cached['exp'] > time.time():
+        return cached['uid']
     try:
         decoded_token = auth.verify_id_token(token)
+        _verified_tokens[token_hash] = {'uid': decoded_token["uid"], 'exp': decoded_token.get('exp', 0)}
         return decoded_token["uid"]
     except firebase_admin.auth.InvalidIdTokenError:
         raise ValueError("Token de autenticação inválido.")
@@ -0,0 +1,154 @@
+import random
+import threading
+import time
+from typing import Any, Dict
+import requests
+from requests.adapters import HTTPAdapter
+from chalicelib.src.utils.circuit_breaker import CircuitBreaker
+
+# Status que indicam falha transitória do servidor e podem ser repetidos em GETs
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+
+class HttpClient:
+    """
+    Cliente HTTP com requests.Session compartilhada: mantém conexões TLS
+    abertas (keep-alive) entre invocações "quentes" da Lambda, aplica timeouts
+    de conexão e leitura em toda chamada e repete apenas métodos idempotentes,
+    com backoff exponencial e jitter. Registra latência por endpoint e, se
+    breaker_options for informado, protege cada endpoint com um CircuitBreaker.
+    """
+
+    def __init__(self, base_url: str, headers: Dict[str, str] = None, connect_timeout: float = 3.05,
+                 read_timeout: float = 10, max_retries: int = 2, retry_backoff: float = 0.2,
+                 pool_size: int = 10, breaker_options: Dict[str, Any] = None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+        self.session = requests.Session()
+        if headers:
+            self.session.headers.update(headers)
+        # Retries são feitos manualmente para restringi-los a métodos idempotentes
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._metrics = {}
+        self._metrics_lock = threading.Lock()
+        self.breaker_options = breaker_options
+        self._breakers = {}
+
+    def _breaker(self, name: str):
+        if self.breaker_options is None:
+            return None
+        with self._metrics_lock:
+            if name not in self._breakers:
+                self._breakers[name] = CircuitBreaker(name, **self.breaker_options)
+            return self._breakers[name]
+
+    def _record(self, name: str, duration_ms: float, status_code: int = None, error: bool = False, retries: int = 0):
+        with self._metrics_lock:
+            metric = self._metrics.setdefault(name, {
+                'calls': 0, 'errors': 0, 'retries': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'last_ms': 0.0, 'last_status': None
+            })
+            metric['calls'] += 1
+            metric['errors'] += 1 if error else 0
+            metric['retries'] += retries
+            metric['total_ms'] += duration_ms
+            metric['max_ms'] = max(metric['max_ms'], duration_ms)
+            metric['last_ms'] = duration_ms
+            metric['last_status'] = status_code
+        print(f"[PERF] HTTP {name}: {duration_ms:.1f}ms status={status_code} retries={retries}")
+
+    def get_metrics(self) -> Dict[str, Dict[str, Any]]:
+        """Snapshot das métricas por endpoint, com latência média calculada."""
+        with self._metrics_lock:
+            metrics = {
+                name: {**metric, 'avg_ms': round(metric['total_ms'] / metric['calls'], 1) if metric['calls'] else 0.0}
+                for name, metric in self._metrics.items()
+            }
+            breakers = dict(self._breakers)
+        for name, breaker in breakers.items():
+            metrics.setdefault(name, {})['circuit'] = breaker.get_metrics()
+        return metrics
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: espera aleatória entre 0 e backoff * 2^tentativa
+        return random.uniform(0, self.retry_backoff * (2 ** attempt))
+
+    def request(self, method: str, path: str, name: str = None, **kwargs) -> requests.Response:
+        """
+        Executa a requisição. Erros de rede e status transitórios são repetidos
+        até max_retries vezes apenas em métodos idempotentes.
+
+        Args:
+            method (str): Método HTTP
+            path (str): Caminho relativo à base_url
+            name (str): Nome do endpoint usado nas métricas (padrão: "MÉTODO path")
+
+        Returns:
+            requests.Response: Resposta da última tentativa
+
+        Raises:
+            requests.RequestException: Falha de rede/timeout após esgotar as tentativas
+            CircuitOpenError: Circuito do endpoint aberto (a requisição não é enviada)
+        """
+        method = method.upper()
+        name = name or f"{method} {path}"
+        retries_allowed = self.max_retries if method in IDEMPOTENT_METHODS else 0
+        kwargs.setdefault('timeout', self.timeout)
+
+        breaker = self._breaker(name)
+        if breaker:
+            breaker.allow()
+
+        start_time = time.time()
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+            except requests.RequestException as e:
+                if attempt >= retries_allowed or not isinstance(e, (requests.ConnectionError, requests.Timeout)):
+                    duration_ms = (time.time() - start_time) * 1000
+                    self._record(name, duration_ms, error=True, retries=attempt)
+                    if breaker:
+                        breaker.record(duration_ms, success=False)
+                    print(f"[ERROR] HTTP {name} falhou após {attempt + 1} tentativa(s): {str(e)}")
+                    raise
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt >= retries_allowed:
+                    duration_ms = (time.time() - start_time) * 1000
+                    self._record(name, duration_ms, status_code=response.status_code,
+                                 error=response.status_code >= 500, retries=attempt)
+                    if breaker:
+                        breaker.record(duration_ms, success=response.status_code not in RETRYABLE_STATUS_CODES)
+                    return response
+            time.sleep(self._backoff(attempt))
+            attempt += 1
+
+    def get(self, path: str, name: str = None, **kwargs) -> requests.Response:
+        return self.request('GET', path, name=name, **kwargs)
+
+    def post(self, path: str, name: str = None, **kwargs) -> requests.Response:
+        return self.request('POST', path, name=name, **kwargs)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url: str, headers: Dict[str, str] = None, **options) -> HttpClient:
+    """
+    Retorna o cliente compartilhado para a base_url/cabeçalhos, criando-o na
+    primeira chamada. Fica no escopo do módulo para ser reaproveitado entre
+    invocações no mesmo container.
+    """
+    key = (base_url, tuple(sorted((headers or {}).items())))
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = HttpClient(base_url, headers=headers, **options)
+        return _clients[key]
@@ -0,0 +1,104 @@
+import hashlib
+import math
+
+
+class HyperLogLog:
+    """
+    Sketch HyperLogLog para contagem aproximada de elementos distintos.
+
+    Usa 2^precision registradores de um byte (4 KB com a precisão padrão),
+    com erro padrão de aproximadamente 1.04 / sqrt(2^precision) (~1,6%).
+    Sketches de mesma precisão podem ser unidos pelo máximo de cada registrador.
+    """
+
+    def __init__(self, precision: int = 12, registers: bytes = None):
+        if not 4 <= precision <= 16:
+            raise ValueError("A precisão do HyperLogLog deve estar entre 4 e 16")
+
+        self.precision = precision
+        self.num_registers = 1 << precision
+        if registers is not None:
+            if len(registers) != self.num_registers:
+                raise ValueError("Quantidade de registradores incompatível com a precisão")
+            self.registers = bytearray(registers)
+        else:
+            self.registers = bytearray(self.num_registers)
+
+    def position(self, value: str) -> tuple:
+        """
+        Registrador e posto que o elemento ocupa no sketch.
+
+        Returns:
+            tuple: (índice do registrador, posto)
+        """
+        digest = hashlib.sha1(str(value).encode('utf-8')).digest()
+        hashed = int.from_bytes(digest[:8], 'big')
+
+        index = hashed >> (64 - self.precision)
+        remaining_bits = 64 - self.precision
+        remaining = hashed & ((1 << remaining_bits) - 1)
+        rank = remaining_bits - remaining.bit_length() + 1
+        return index, rank
+
+    def add(self, value: str):
+        """Adiciona um elemento ao sketch."""
+        index, rank = self.position(value)
+        self.update_register(index, rank)
+
+    def update_register(self, index: int, rank: int) -> bool:
+        """
+        Eleva o registrador ao posto informado, se for maior.
+
+        Returns:
+            bool: True se o registrador foi alterado
+        """
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def merge(self, other: 'HyperLogLog') -> bool:
+        """
+        Une outro sketch a este (máximo por registrador).
+
+        Returns:
+            bool: True se algum registrador foi alterado
+        """
+        if other.precision != self.precision:
+            raise ValueError("Não é possível unir sketches de precisões diferentes")
+
+        changed = False
+        for index, rank in enumerate(other.registers):
+            if rank > self.registers[index]:
+                self.registers[index] = rank
+                changed = True
+        return changed
+
+    def count(self) -> int:
+        """Estimativa da quantidade de elementos distintos."""
+        m = self.num_registers
+        alpha = 0.7213 / (1 + 1.079 / m)
+
+        indicator = 0.0
+        zeros = 0
+        for rank in self.registers:
+            indicator += 2.0 ** -rank
+            if rank == 0:
+                zeros += 1
+
+        estimate = alpha * m * m / indicator
+        if estimate <= 2.5 * m and zeros:
+            # Correção para cardinalidades pequenas (linear counting)
+            estimate = m * math.log(m / zeros)
+
+        return int(round(estimate))
+
+    def is_empty(self) -> bool:
+        return not any(self.registers)
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, precision: int = 12) -> 'HyperLogLog':
+        return cls(precision=precision, registers=data)
@@ -0,0 +1,116 @@
+from typing import Optional
+from cachetools import TTLCache
+from chalicelib.src.config.environment import env_config
+from chalicelib.src.utils.signing import b64url_encode, b64url_decode, derive_key, sign, verify
+
+TOKEN_PREFIX = 'EVQ1'
+
+# Versões de chave por evento (atual e mínima aceita), em cache no container
+_key_versions_cache = TTLCache(maxsize=1024, ttl=300)
+
+
+def is_signed_token(code: str) -> bool:
+    return bool(code) and code.startswith(TOKEN_PREFIX + '.')
+
+
+def event_key(event_id: str, key_version: int, secret: str = None) -> bytes:
+    """Chave HMAC do evento para a versão informada."""
+    secret = secret if secret is not None else env_config.get_qr_signing_secret()
+    return derive_key(secret, 'qr', event_id, str(key_version))
+
+
+def issue_token(event_id: str, order_id: str, ticket_index: int, key_version: int = 1,
+                secret: str = None) -> Optional[str]:
+    """
+    Emite o token assinado de um ingresso:
+    EVQ1.{versão da chave}.{base64(event_id:order_id:ticket_index)}.{HMAC}
+
+    Returns:
+        str: Token, ou None se não houver segredo configurado
+    """
+    secret = secret if secret is not None else env_config.get_qr_signing_secret()
+    if not secret:
+        return None
+    body = b64url_encode(f"{event_id}:{order_id}:{ticket_index}".encode('utf-8'))
+    message = f"{TOKEN_PREFIX}.{key_version}.{body}"
+    return f"{message}.{sign(event_key(event_id, key_version, secret), message)}"
+
+
+def verify_token(token: str, event_id: str, min_key_version: int = 1, secret: str = None) -> Optional[dict]:
+    """
+    Valida um token de ingresso sem acessar o banco.
+
+    Rejeita tokens malformados, com assinatura inválida, de outro evento ou
+    assinados com uma versão de chave revogada.
+
+    Returns:
+        dict: {'event_id', 'order_id', 'ticket_index', 'key_version'} ou None
+    """
+    secret = secret if secret is not None else env_config.get_qr_signing_secret()
+    if not secret or not is_signed_token(token):
+        return None
+    try:
+        prefix, key_version, body, signature = token.split('.')
+        key_version = int(key_version)
+        token_event_id, rest = b64url_decode(body).decode('utf-8').split(':', 1)
+        order_id, ticket_index = rest.rsplit(':', 1)
+        ticket_index = int(ticket_index)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+    if token_event_id != event_id or key_version < min_key_version:
+        return None
+    if not verify(event_key(event_id, key_version, secret), f"{prefix}.{key_version}.{body}", signature):
+        return None
+
+    return {
+        'event_id': token_event_id,
+        'order_id': order_id,
+        'ticket_index': ticket_index,
+        'key_version': key_version
+    }
+
+
+def sign_tickets(event_id: str, order_id: str, tickets: list, key_version: int = 1, secret: str = None) -> bool:
+    """
+    Substitui o qr_code_uuid de cada ingresso pelo token assinado
+    correspondente, preservando tokens já emitidos para a mesma posição.
+
+    Returns:
+        bool: True se algum ingresso foi alterado
+    """
+    secret = secret if secret is not None else env_config.get_qr_signing_secret()
+    if not secret or not isinstance(tickets, list):
+        return False
+
+    changed = False
+    for ticket_index, ticket in enumerate(tickets):
+        current = ticket.get('qr_code_uuid')
+        claims = verify_token(current, event_id, key_version, secret) if current else None
+        if claims and claims['order_id'] == order_id and claims['ticket_index'] == ticket_index:
+            continue
+        ticket['qr_code_uuid'] = issue_token(event_id, order_id, ticket_index, key_version, secret)
+        changed = True
+    return changed
+
+
+def get_key_versions(event_id: str, db) -> dict:
+    """
+    Versão atual e mínima aceita da chave de QR do evento (com cache).
+    """
+    cached = _key_versions_cache.get(event_id)
+    if cached is not None:
+        return cached
+
+    event_doc = db.collection('events').document(event_id).get()
+    event_data = event_doc.to_dict() if event_doc.exists else {}
+    versions = {
+        'current': int(event_data.get('qr_key_version', 1)),
+        'min': int(event_data.get('qr_min_key_version', 1))
+    }
+    _key_versions_cache[event_id] = versions
+    return versions
+
+
+def invalidate_key_versions(event_id: str):
+    _key_versions_cache.pop(event_id, None)
@@ -0,0 +1,65 @@
+import time
+from typing import Optional
+from chalicelib.src.config.environment import env_config
+from chalicelib.src.utils.signing import b64url_encode, b64url_decode, derive_key, sign, verify
+
+TOKEN_PREFIX = 'EVW1'
+
+
+def queue_key(event_id: str, secret: str = None) -> bytes:
+    """Chave HMAC da fila virtual do evento (separada das chaves de QR)."""
+    secret = secret if secret is not None else env_config.get_qr_signing_secret()
+    return derive_key(secret, 'queue', event_id)
+
+
+def issue_token(event_id: str, opened_at: int, position: int, admit_at: int, expires_at: int,
+                secret: str = None) -> Optional[str]:
+    """
+    Emite o token da fila virtual:
+    EVW1.{base64(event_id:opened_at:position:admit_at:expires_at)}.{HMAC}
+
+    opened_at identifica a abertura da fila; reabri-la invalida os tokens anteriores.
+
+    Returns:
+        str: Token, ou None se não houver segredo configurado
+    """
+    secret = secret if secret is not None else env_config.get_qr_signing_secret()
+    if not secret:
+        return None
+    body = b64url_encode(f"{event_id}:{opened_at}:{position}:{admit_at}:{expires_at}".encode('utf-8'))
+    message = f"{TOKEN_PREFIX}.{body}"
+    return f"{message}.{sign(queue_key(event_id, secret), message)}"
+
+
+def verify_token(token: str, event_id: str, now: float = None, secret: str = None) -> Optional[dict]:
+    """
+    Valida um token da fila sem acessar o banco. Rejeita tokens malformados,
+    com assinatura inválida, de outro evento ou já expirados. A liberação
+    (admit_at) é verificada por quem chama.
+
+    Returns:
+        dict: {'event_id', 'opened_at', 'position', 'admit_at', 'expires_at'} ou None
+    """
+    secret = secret if secret is not None else env_config.get_qr_signing_secret()
+    if not secret or not token or not token.startswith(TOKEN_PREFIX + '.'):
+        return None
+    try:
+        prefix, body, signature = token.split('.')
+        token_event_id, opened_at, position, admit_at, expires_at = b64url_decode(body).decode('utf-8').rsplit(':', 4)
+        claims = {
+            'event_id': token_event_id,
+            'opened_at': int(opened_at),
+            'position': int(position),
+            'admit_at': int(admit_at),
+            'expires_at': int(expires_at)
+        }
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+    if token_event_id != event_id:
+        return None
+    if not verify(queue_key(event_id, secret), f"{prefix}.{body}", signature):
+        return None
+    if claims['expires_at'] <= (now if now is not None else time.time()):
+        return None
+    return claims
@@ -0,0 +1,29 @@
+import base64
+import hashlib
+import hmac
+
+
+def b64url_encode(data: bytes) -> str:
+    """Base64 URL-safe sem padding (seguro para QR codes e IDs de documento)."""
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def b64url_decode(data: str) -> bytes:
+    padding = '=' * (-len(data) % 4)
+    return base64.urlsafe_b64decode(data + padding)
+
+
+def derive_key(secret: str, *context: str) -> bytes:
+    """Deriva uma chave HMAC a partir do segredo mestre e de um contexto."""
+    return hmac.new(secret.encode('utf-8'), ':'.join(context).encode('utf-8'), hashlib.sha256).digest()
+
+
+def sign(key: bytes, message: str, length: int = 16) -> str:
+    """Assinatura HMAC-SHA256 truncada em length bytes, em base64 URL-safe."""
+    digest = hmac.new(key, message.encode('utf-8'), hashlib.sha256).digest()
+    return b64url_encode(digest[:length])
+
+
+def verify(key: bytes, message: str, signature: str, length: int = 16) -> bool:
+    """Compara a assinatura em tempo constante."""
+    return hmac.compare_digest(sign(key, message, length), signature)
@@ -0,0 +1,399 @@
+import copy
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import pytest
+
+# Configuração mínima para importar os módulos sem credenciais reais
+os.environ.setdefault('ENVIRONMENT', 'sandbox')
+os.environ.setdefault('ASAAS_API_KEY', 'test-key')
+os.environ.setdefault('QR_SIGNING_SECRET', 'test-secret')
+
+from firebase_admin import firestore  # noqa: E402
+from google.api_core.exceptions import Aborted, AlreadyExists, FailedPrecondition, NotFound  # noqa: E402
+
+# Tempo máximo de espera pelo lock de um documento antes de abortar a transação
+LOCK_TIMEOUT_SECONDS = 5
+
+
+def get_field(data: dict, field_path: str):
+    """Valor de um campo (com caminho pontuado) ou None."""
+    value = data
+    for part in field_path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def _apply_value(current, value):
+    if isinstance(value, firestore.Increment):
+        return (current if isinstance(current, (int, float)) else 0) + value.value
+    if isinstance(value, firestore.Maximum):
+        return value.value if not isinstance(current, (int, float)) else max(current, value.value)
+    if value is firestore.SERVER_TIMESTAMP:
+        return datetime.now()
+    return copy.deepcopy(value)
+
+
+def _merge(target: dict, data: dict):
+    """set(merge=True): mapas são mesclados recursivamente."""
+    for key, value in data.items():
+        if value is firestore.DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict):
+            child = target.get(key)
+            target[key] = child if isinstance(child, dict) else {}
+            _merge(target[key], value)
+        else:
+            target[key] = _apply_value(target.get(key), value)
+
+
+def _update(target: dict, data: dict):
+    """update(): chaves pontuadas são caminhos de campo; mapas são substituídos."""
+    for field_path, value in data.items():
+        parts = field_path.split('.')
+        parent = target
+        for part in parts[:-1]:
+            if not isinstance(parent.get(part), dict):
+                parent[part] = {}
+            parent = parent[part]
+        if value is firestore.DELETE_FIELD:
+            parent.pop(parts[-1], None)
+        else:
+            parent[parts[-1]] = _apply_value(parent.get(parts[-1]), value)
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data, update_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self.update_time = update_time
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path: str):
+        return get_field(self._data or {}, field_path)
+
+
+class FakeQuery:
+    """Consulta sobre os documentos de uma coleção (filtros, ordem, cursor e limite)."""
+
+    def __init__(self, db, path, filters=(), orders=(), after=None, limit=None):
+        self.db = db
+        self.path = path
+        self.filters = filters
+        self.orders = orders
+        self.after = after
+        self._limit = limit
+
+    def _copy(self, **changes):
+        options = {'filters': self.filters, 'orders': self.orders, 'after': self.after, 'limit': self._limit}
+        options.update(changes)
+        return FakeQuery(self.db, self.path, **options)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self.filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction=None):
+        return self._copy(orders=self.orders + ((field_path, direction == 'DESCENDING'),))
+
+    def start_after(self, snapshot):
+        return self._copy(after=snapshot)
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def select(self, field_paths):
+        return self
+
+    @staticmethod
+    def _matches(snapshot, field_path, op, value):
+        actual = snapshot.id if field_path == '__name__' else snapshot.get(field_path)
+        if op == '==':
+            return actual == value
+        if op == '!=':
+            return actual is not None and actual != value
+        if op == 'in':
+            return actual in value
+        if op == 'not-in':
+            return actual is not None and actual not in value
+        if op == 'array_contains':
+            return isinstance(actual, list) and value in actual
+        if actual is None:
+            return False
+        if isinstance(actual, datetime) and isinstance(value, datetime):
+            actual, value = actual.replace(tzinfo=None), value.replace(tzinfo=None)
+        return {'<': actual < value, '<=': actual <= value, '>': actual > value, '>=': actual >= value}[op]
+
+    def _run(self):
+        snapshots = [
+            snapshot for snapshot in self.db._collection_snapshots(self.path)
+            if all(self._matches(snapshot, *condition) for condition in self.filters)
+        ]
+        for field_path, descending in reversed(self.orders):
+            snapshots.sort(
+                key=lambda snapshot: (snapshot.id if field_path == '__name__' else snapshot.get(field_path)) or 0,
+                reverse=descending
+            )
+        if self.after is not None:
+            after_id = self.after.id
+            ids = [snapshot.id for snapshot in snapshots]
+            snapshots = snapshots[ids.index(after_id) + 1:] if after_id in ids else []
+        if self._limit is not None:
+            snapshots = snapshots[:self._limit]
+        return snapshots
+
+    def stream(self, transaction=None):
+        if transaction is not None:
+            return iter(transaction.get(self))
+        self.db.round_trip(('query', self.path))
+        return iter(self._run())
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+
+class FakeRef(FakeQuery):
+    """Referência de documento ou coleção (coleções também são consultas)."""
+
+    def __init__(self, db, path):
+        super().__init__(db, path)
+        self.id = path.rsplit('/', 1)[-1]
+
+    @property
+    def parent(self):
+        return FakeRef(self.db, self.path.rsplit('/', 1)[0])
+
+    def collection(self, name):
+        return FakeRef(self.db, f"{self.path}/{name}")
+
+    def document(self, name=None):
+        return FakeRef(self.db, f"{self.path}/{name or uuid.uuid4().hex}")
+
+    def get(self, transaction=None, field_paths=None):
+        if self.path.count('/') % 2 == 0:
+            return super().get(transaction=transaction)
+        if transaction is not None:
+            return transaction.get(self)
+        self.db.round_trip(('get', self.path))
+        return self.db._snapshot(self)
+
+    def set(self, data, merge=False):
+        self.db._commit([('set', self, data, merge)])
+
+    def update(self, data, option=None):
+        self.db._commit([('update', self, data, option)])
+
+    def create(self, data):
+        self.db._commit([('create', self, data, None)])
+
+    def delete(self):
+        self.db._commit([('delete', self, None, None)])
+
+    def __eq__(self, other):
+        return isinstance(other, FakeRef) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+
+class FakeWriteBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, ref, data, merge=False):
+        self.writes.append(('set', ref, data, merge))
+
+    def update(self, ref, data, option=None):
+        self.writes.append(('update', ref, data, option))
+
+    def create(self, ref, data):
+        self.writes.append(('create', ref, data, None))
+
+    def delete(self, ref):
+        self.writes.append(('delete', ref, None, None))
+
+    def commit(self):
+        writes, self.writes = self.writes, []
+        self.db.round_trip(('commit', len(writes)))
+        self.db._commit(writes)
+
+
+class FakeTransaction(FakeWriteBatch):
+    """
+    Transação pessimista, como a dos SDKs de servidor: cada leitura trava o
+    documento até o commit (ou rollback) e todas as leituras precedem as
+    escritas. Transações concorrentes no mesmo documento são serializadas.
+    """
+
+    def __init__(self, db, max_attempts=5):
+        super().__init__(db)
+        self.max_attempts = max_attempts
+        self.locks = []
+
+    def _lock(self, path):
+        with self.db.lock:
+            path_lock = self.db.path_locks.setdefault(path, threading.Lock())
+        if path_lock in self.locks:
+            return
+        if not path_lock.acquire(timeout=LOCK_TIMEOUT_SECONDS):
+            raise Aborted(f"Lock timeout on {path}")
+        self.locks.append(path_lock)
+
+    def _before_read(self):
+        if self.writes:
+            raise ValueError('Firestore transactions require all reads to be executed before all writes.')
+
+    def get(self, ref_or_query):
+        self._before_read()
+        if isinstance(ref_or_query, FakeRef) and ref_or_query.path.count('/') % 2 == 1:
+            self._lock(ref_or_query.path)
+            self.db.round_trip(('get', ref_or_query.path))
+            return self.db._snapshot(ref_or_query)
+        self.db.round_trip(('query', ref_or_query.path))
+        snapshots = ref_or_query._run()
+        for snapshot in snapshots:
+            self._lock(snapshot.reference.path)
+        return snapshots
+
+    def get_all(self, refs):
+        self._before_read()
+        refs = list(refs)
+        for ref in sorted(refs, key=lambda ref: ref.path):
+            self._lock(ref.path)
+        return self.db.get_all(refs)
+
+    def commit(self):
+        try:
+            if self.writes:
+                self.db.round_trip(('commit', len(self.writes)))
+                self.db._commit(self.writes)
+        finally:
+            self.rollback()
+
+    def rollback(self):
+        for path_lock in self.locks:
+            path_lock.release()
+        self.locks, self.writes = [], []
+
+
+class FakeFirestore:
+    """
+    Firestore em memória para os testes. docs mapeia caminho → dados.
+    Cada ida ao servidor é registrada em round_trips e pode simular latência
+    (latency fixa e jitter aleatório, em segundos).
+    """
+
+    def __init__(self, docs=None, latency=0, jitter=0):
+        self.docs = docs if docs is not None else {}
+        self.update_times = dict.fromkeys(self.docs, 0)
+        self.round_trips = []
+        self.latency = latency
+        self.jitter = jitter
+        self.lock = threading.Lock()
+        self.path_locks = {}
+
+    def round_trip(self, operation):
+        with self.lock:
+            self.round_trips.append(operation)
+        delay = self.latency + (self.jitter * (uuid.uuid4().int % 1000) / 1000 if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+    def collection(self, name):
+        return FakeRef(self, name)
+
+    def document(self, path):
+        return FakeRef(self, path)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def transaction(self, max_attempts=5, **options):
+        return FakeTransaction(self, max_attempts)
+
+    @staticmethod
+    def write_option(last_update_time=None, exists=None):
+        return {'last_update_time': last_update_time, 'exists': exists}
+
+    def get_all(self, refs, field_paths=None, transaction=None):
+        if transaction is not None:
+            return transaction.get_all(refs)
+        refs = list(refs)
+        if refs:
+            self.round_trip(('get_all', len(refs)))
+        # O Firestore não garante a ordem das respostas do get_all
+        return [self._snapshot(ref) for ref in reversed(refs)]
+
+    def count(self, prefix: str) -> int:
+        """Quantidade de operações registradas de um tipo ('get', 'get_all', 'query', 'commit')."""
+        return sum(1 for operation in self.round_trips if operation[0] == prefix)
+
+    def _snapshot(self, ref):
+        with self.lock:
+            return FakeSnapshot(ref, copy.deepcopy(self.docs.get(ref.path)), self.update_times.get(ref.path))
+
+    def _collection_snapshots(self, path):
+        depth = path.count('/') + 1
+        with self.lock:
+            paths = sorted(
+                doc_path for doc_path in self.docs
+                if doc_path.startswith(path + '/') and doc_path.count('/') == depth
+            )
+        return [self._snapshot(FakeRef(self, doc_path)) for doc_path in paths]
+
+    def _commit(self, writes):
+        with self.lock:
+            for kind, ref, data, option in writes:
+                if kind == 'create' and ref.path in self.docs:
+                    raise AlreadyExists(f"Document already exists: {ref.path}")
+                if kind == 'update' and ref.path not in self.docs:
+                    raise NotFound(f"No document to update: {ref.path}")
+                if kind == 'update' and option and option.get('last_update_time') is not None \
+                        and self.update_times.get(ref.path) != option['last_update_time']:
+                    raise FailedPrecondition(f"Document changed since it was read: {ref.path}")
+            for kind, ref, data, option in writes:
+                if kind == 'delete':
+                    self.docs.pop(ref.path, None)
+                    self.update_times.pop(ref.path, None)
+                    continue
+                if kind == 'update':
+                    current = copy.deepcopy(self.docs[ref.path])
+                    _update(current, data)
+                elif isinstance(option, list):
+                    # set(merge=[campos]): só os campos listados, substituídos por inteiro
+                    current = copy.deepcopy(self.docs.get(ref.path) or {})
+                    _update(current, {field_path: get_field(data, field_path) for field_path in option})
+                else:
+                    current = copy.deepcopy(self.docs.get(ref.path) or {}) if option else {}
+                    _merge(current, data)
+                self.docs[ref.path] = current
+                self.update_times[ref.path] = time.monotonic_ns()
+
+
+def fake_transactional(function):
+    """Substituto de firestore.transactional para FakeTransaction."""
+    def run(transaction, *args, **kwargs):
+        try:
+            result = function(transaction, *args, **kwargs)
+        except BaseException:
+            transaction.rollback()
+            raise
+        transaction.commit()
+        return result
+    return run
+
+
+@pytest.fixture
+def fake_transactions(monkeypatch):
+    monkeypatch.setattr(firestore, 'transactional', fake_transactional)
@@ -0,0 +1,26 @@
+from chalicelib.src.utils import authorization
+from conftest import FakeFirestore
+
+
+class FakeRequest:
+    def __init__(self, user_id=None):
+        self.context = {'authorizer': {'principalId': user_id}} if user_id else {}
+
+
+def test_event_routes_require_the_organizer(monkeypatch):
+    monkeypatch.setitem(authorization.auth_config, 'admin_user_ids', ['admin'])
+    db = FakeFirestore({'events/event-1': {'user_id': 'owner'}})
+
+    assert authorization.check_event_organizer(FakeRequest(), 'event-1', db)[1] == 401
+    assert authorization.check_event_organizer(FakeRequest('someone'), 'event-1', db)[1] == 403
+    assert authorization.check_event_organizer(FakeRequest('owner'), 'missing', db)[1] == 404
+    assert authorization.check_event_organizer(FakeRequest('owner'), 'event-1', db) is None
+    assert authorization.check_event_organizer(FakeRequest('admin'), 'event-1', db) is None
+
+
+def test_platform_routes_require_an_admin(monkeypatch):
+    monkeypatch.setitem(authorization.auth_config, 'admin_user_ids', ['admin'])
+
+    assert authorization.check_admin(FakeRequest())[1] == 401
+    assert authorization.check_admin(FakeRequest('owner'))[1] == 403
+    assert authorization.check_admin(FakeRequest('admin')) is None
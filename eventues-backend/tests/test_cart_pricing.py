@@ -0,0 +1,102 @@
+import time
+
+import pytest
+
+from chalicelib.src.usecases.cart_pricing import CartPricing, InvalidQuantityError, calculate_platform_fee, ticket_quantity
+from chalicelib.src.usecases.payment_usecase import PaymentUseCase
+from conftest import FakeFirestore
+
+# Latência simulada de uma ida ao Firestore
+ROUND_TRIP_SECONDS = 0.005
+NUM_TICKET_TYPES = 10
+
+
+pytestmark = pytest.mark.usefixtures('fake_transactions')
+
+
+def lot_ticket():
+    return {
+        'tipo': 'Lotes', 'valor': 100, 'totalIngressos': '50',
+        'lotes': [{'valor': 80, 'quantidade': 10}, {'valor': 120, 'quantidade': 40}]
+    }
+
+
+def test_platform_fee_tiers():
+    assert calculate_platform_fee(0) == 0
+    assert calculate_platform_fee(19.99) == 2
+    assert calculate_platform_fee(100) == 7.99
+
+
+@pytest.mark.parametrize('quantity', [0, -1, '0', 'abc', None, 1.5, '2.5'])
+def test_invalid_quantities_are_rejected(quantity):
+    with pytest.raises(InvalidQuantityError):
+        ticket_quantity({'ticket_id': 'ticket-1', 'quantity': quantity})
+
+
+def test_quantity_accepts_integer_strings():
+    assert ticket_quantity({'ticket_id': 'ticket-1', 'quantity': '3'}) == 3
+    assert ticket_quantity({'ticket_id': 'ticket-1', 'quantity': 2.0}) == 2
+
+
+def test_price_uses_the_lot_on_sale_and_its_stock():
+    cart = CartPricing(FakeFirestore(latency=ROUND_TRIP_SECONDS))
+    tickets = [{'ticket_id': 'ticket-1', 'quantity': '2'}, {'ticket_id': 'ticket-2', 'quantity': 1}]
+    ticket_datas = {'ticket-1': lot_ticket(), 'ticket-2': {'valor': 10, 'totalIngressos': '0'}}
+
+    priced = cart.price(tickets, ticket_datas, lot_indexes={'ticket-1': 1, 'ticket-2': None})
+
+    assert priced['subtotal'] == 2 * 120 + 10
+    assert priced['fees'] == pytest.approx(2 * calculate_platform_fee(120) + 2)
+    assert priced['total'] == pytest.approx(priced['subtotal'] + priced['fees'])
+    assert priced['lots'] == {'ticket-1': {'index': 1, 'valor': 120}}
+    # Ingresso sem limite não gera demanda de estoque
+    assert {stock_id: entry['quantity'] for stock_id, entry in priced['demand'].items()} == {
+        'ticket-1': 2, 'ticket-1__lote_1': 2
+    }
+
+
+def test_agreed_unit_price_takes_precedence_over_the_current_lot():
+    cart = CartPricing(FakeFirestore(latency=ROUND_TRIP_SECONDS))
+    priced = cart.price(
+        [{'ticket_id': 'ticket-1', 'quantity': 1}], {'ticket-1': lot_ticket()},
+        lot_indexes={'ticket-1': 1}, unit_prices={'ticket-1': 80}
+    )
+    assert priced['subtotal'] == 80
+
+
+def test_price_rejects_non_positive_quantity():
+    cart = CartPricing(FakeFirestore(latency=ROUND_TRIP_SECONDS))
+    with pytest.raises(InvalidQuantityError):
+        cart.price([{'ticket_id': 'ticket-1', 'quantity': -2}], {'ticket-1': {'valor': 50}})
+
+
+def test_create_order_rejects_invalid_quantity_before_reading():
+    db = FakeFirestore(latency=ROUND_TRIP_SECONDS)
+    result, status_code = PaymentUseCase().create_order(
+        {'user_id': 'user-1', 'event_id': 'event-1', 'tickets': [{'ticket_id': 'ticket-1', 'quantity': 0}]}, db
+    )
+    assert status_code == 400 and 'quantity' in result['error']
+    assert db.round_trips == []
+
+
+def test_create_order_with_ten_ticket_types_reads_the_cart_once():
+    docs = {}
+    tickets = []
+    for n in range(NUM_TICKET_TYPES):
+        docs[f"events/event-1/tickets/ticket-{n}"] = {'valor': 50 + n, 'totalIngressos': '0'}
+        tickets.append({'ticket_id': f"ticket-{n}", 'quantity': 2})
+    db = FakeFirestore(docs, latency=ROUND_TRIP_SECONDS)
+
+    start_time = time.time()
+    result, status_code = PaymentUseCase().create_order({'user_id': 'user-1', 'event_id': 'event-1', 'tickets': tickets}, db)
+    duration = time.time() - start_time
+
+    assert status_code == 200
+    assert db.round_trips[0] == ('get_all', NUM_TICKET_TYPES)
+    assert db.count('get_all') + db.count('get') + db.count('query') == 1
+    order = docs[f"orders/{result['order_id']}"]
+    assert order['subtotal_amount'] == sum((50 + n) * 2 for n in range(NUM_TICKET_TYPES))
+    # Antes: um ticket_ref.get() por tipo de ingresso
+    before_seconds = NUM_TICKET_TYPES * ROUND_TRIP_SECONDS
+    print(f"[PERF] create_order com {NUM_TICKET_TYPES} tipos de ingresso: {duration * 1000:.1f}ms (antes ~{before_seconds * 1000:.0f}ms só de leituras)")
+    assert duration < before_seconds
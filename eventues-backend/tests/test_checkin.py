@@ -0,0 +1,128 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+
+from chalicelib.src.repositories.checkin_stats_repository import CheckinStatsRepository
+from chalicelib.src.usecases.payment_usecase import PaymentUseCase
+from conftest import FakeFirestore
+
+pytestmark = pytest.mark.usefixtures('fake_transactions')
+
+
+class RacingFirestore(FakeFirestore):
+    """Executa uma escrita concorrente logo após a primeira leitura dos pedidos."""
+
+    def __init__(self, docs, race):
+        super().__init__(docs)
+        self.race = race
+
+    def get_all(self, refs, field_paths=None, transaction=None):
+        refs = list(refs)
+        snapshots = super().get_all(refs, field_paths=field_paths, transaction=transaction)
+        if self.race and transaction is None and refs and refs[0].path.startswith('orders/'):
+            race, self.race = self.race, None
+            race(self)
+        return snapshots
+
+
+def confirmed_order_docs(num_tickets=2):
+    docs = {
+        'orders/order-1': {
+            'event_id': 'event-1', 'status': 'CONFIRMADO',
+            'tickets': [{'ticket_id': 'geral', 'qr_code_uuid': f"qr-{n}"} for n in range(num_tickets)]
+        }
+    }
+    for n in range(num_tickets):
+        docs[f"qr_index/qr-{n}"] = {'event_id': 'event-1', 'order_id': 'order-1', 'ticket_index': n}
+    return docs
+
+
+def iso(moment):
+    return moment.isoformat()
+
+
+def checked_in_total(db):
+    return CheckinStatsRepository(db).get('event-1')['total']
+
+
+def test_bulk_checkin_rereads_an_order_changed_by_a_concurrent_scan():
+    scanned_at = datetime.now() - timedelta(minutes=1)
+
+    def concurrent_scan(db):
+        # Portão online marca o mesmo ingresso entre a leitura e a gravação
+        db.document('orders/order-1').update({'checkins.0': {
+            'checkin': True, 'checkin_timestamp': iso(scanned_at), 'checkin_updated_at': iso(scanned_at)
+        }})
+
+    db = RacingFirestore(confirmed_order_docs(), concurrent_scan)
+    db.docs['checkin_stats/event-1'] = {'initialized': True, 'total': 1, 'por_ingresso': {'geral': 1}}
+    offline_at = scanned_at - timedelta(minutes=5)
+
+    result, status_code = PaymentUseCase().bulk_checkin('event-1', [
+        {'qr_code_uuid': 'qr-0', 'checkin_status': True, 'timestamp': iso(offline_at)},
+        {'qr_code_uuid': 'qr-1', 'checkin_status': True, 'timestamp': iso(offline_at)},
+    ], 'staff-1', db)
+
+    assert status_code == 200
+    assert {item['qr_code_uuid']: item['result'] for item in result['results']} == {'qr-0': 'stale', 'qr-1': 'applied'}
+    assert db.count('get_all') == 3
+    # O check-in concorrente não é contado de novo
+    assert checked_in_total(db) == 2
+
+
+def test_bulk_checkin_clamps_future_timestamps_to_server_time():
+    db = FakeFirestore(confirmed_order_docs(1))
+    future = datetime.now() + timedelta(days=1)
+
+    PaymentUseCase().bulk_checkin('event-1', [{'qr_code_uuid': 'qr-0', 'checkin_status': True, 'timestamp': iso(future)}], 'staff-1', db)
+    state = db.docs['orders/order-1']['checkins']['0']
+    assert datetime.fromisoformat(state['checkin_updated_at']) <= datetime.now()
+
+    # Uma desmarcação real posterior ainda prevalece
+    result, _ = PaymentUseCase().bulk_checkin('event-1', [{'qr_code_uuid': 'qr-0', 'checkin_status': False}], 'staff-1', db)
+    assert result['results'] == [{'qr_code_uuid': 'qr-0', 'result': 'applied', 'checkin': False}]
+
+
+@pytest.mark.parametrize('timestamp', [None, 'not-a-date'])
+def test_bulk_checkin_without_timestamp_uses_server_time_once(timestamp):
+    db = FakeFirestore(confirmed_order_docs(1))
+    earlier = datetime.now() - timedelta(minutes=1)
+    item = {'qr_code_uuid': 'qr-0', 'checkin_status': False}
+    if timestamp:
+        item['timestamp'] = timestamp
+
+    # Sem timestamp o item vale "agora": ordenado depois do check-in de um minuto atrás
+    result, _ = PaymentUseCase().bulk_checkin('event-1', [
+        item, {'qr_code_uuid': 'qr-0', 'checkin_status': True, 'timestamp': iso(earlier)}
+    ], 'staff-1', db)
+
+    assert [entry['result'] for entry in result['results']] == ['applied', 'applied']
+    assert db.docs['orders/order-1']['checkins']['0']['checkin'] is False
+
+
+def test_second_scan_is_a_duplicate_and_counts_once():
+    db = FakeFirestore(confirmed_order_docs(1))
+    usecase = PaymentUseCase()
+
+    first, status_code = usecase.qr_code_checkin('event-1', 'qr-0', True, 'staff-1', db)
+    assert status_code == 200 and first['duplicate'] is False
+    checked_in_at = db.docs['orders/order-1']['checkins']['0']['checkin_timestamp']
+
+    second, status_code = usecase.qr_code_checkin('event-1', 'qr-0', True, 'staff-2', db)
+    assert status_code == 409 and second['duplicate'] is True
+    # O registro original é preservado
+    assert second['participant']['checkin_by'] == 'staff-1'
+    assert db.docs['orders/order-1']['checkins']['0']['checkin_timestamp'] == checked_in_at
+    assert checked_in_total(db) == 1
+
+
+def test_concurrent_scans_of_one_ticket_check_in_once():
+    db = FakeFirestore(confirmed_order_docs(1), jitter=0.002)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        statuses = list(executor.map(
+            lambda gate: PaymentUseCase().qr_code_checkin('event-1', 'qr-0', True, f"gate-{gate}", db)[1], range(8)
+        ))
+
+    assert sorted(statuses) == [200] + [409] * 7
+    assert checked_in_total(db) == 1
@@ -0,0 +1,51 @@
+from chalicelib.src.repositories.checkin_stats_repository import CheckinStatsRepository, ticket_checkin_state
+from conftest import FakeFirestore
+
+
+class FakeWriter:
+    def __init__(self):
+        self.sets = []
+
+    def set(self, ref, data, merge=False):
+        self.sets.append((ref.path, data, merge))
+
+
+def test_check_in_deltas_go_to_a_shard():
+    writer = FakeWriter()
+    repository = CheckinStatsRepository(FakeFirestore(), num_shards=4)
+    repository.apply(writer, 'event-1', 'ticket-a', False, True)
+    repository.apply(writer, 'event-1', 'ticket-a', True, True)
+
+    assert len(writer.sets) == 1
+    path, data, merge = writer.sets[0]
+    assert path.rsplit('/', 1)[0] == 'checkin_stats/event-1/shards'
+    assert int(path.rsplit('/', 1)[1]) in range(4)
+    assert data['total'].value == 1
+    assert data['por_ingresso']['ticket-a'].value == 1
+    assert merge is True
+
+
+def test_get_sums_base_and_shards():
+    db = FakeFirestore({
+        'checkin_stats/event-1': {'initialized': True, 'total': 5, 'por_ingresso': {'a': 3, 'b': 2}},
+        'checkin_stats/event-1/shards/0': {'total': 2, 'por_ingresso': {'a': 2}},
+        'checkin_stats/event-1/shards/2': {'total': -1, 'por_ingresso': {'b': -1, 'c': 0}},
+    })
+    stats = CheckinStatsRepository(db, num_shards=3).get('event-1')
+    assert stats['total'] == 6
+    assert stats['por_ingresso'] == {'a': 5, 'b': 1, 'c': 0}
+
+
+def test_get_rebuilds_uninitialized_stats(monkeypatch):
+    repository = CheckinStatsRepository(FakeFirestore(), num_shards=2)
+    monkeypatch.setattr(repository, 'rebuild', lambda event_id: {'event_id': event_id, 'rebuilt': True})
+    assert repository.get('event-1') == {'event_id': 'event-1', 'rebuilt': True}
+
+
+def test_checkin_entry_overrides_legacy_ticket_fields():
+    order = {
+        'tickets': [{'ticket_id': 'a', 'checkin': True}, {'ticket_id': 'b'}],
+        'checkins': {'0': {'checkin': False}, '1': {'checkin': True, 'checkin_by': 'staff'}}
+    }
+    assert ticket_checkin_state(order, 0)['checkin'] is False
+    assert ticket_checkin_state(order, 1)['checkin_by'] == 'staff'
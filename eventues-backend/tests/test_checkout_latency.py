@@ -0,0 +1,57 @@
+import time
+
+import pytest
+
+from chalicelib.src.usecases.payment_usecase import PaymentUseCase
+from conftest import FakeFirestore
+
+# Latência simulada de uma ida ao Firestore
+ROUND_TRIP_SECONDS = 0.005
+NUM_TICKET_TYPES = 10
+
+
+class DecliningAsaas:
+    """Recusa a cobrança: o checkout termina logo após a fase de leitura."""
+
+    def create_payment(self, payment_data):
+        self.payment_data = payment_data
+        return {'errors': [{'description': 'declined'}]}, 400
+
+
+def make_checkout():
+    docs = {
+        'events/event-1': {'name': 'Corrida', 'slug': 'corrida'},
+        'events/event-1/coupons/coupon-1': {'uses_count': 3},
+    }
+    tickets = []
+    for n in range(NUM_TICKET_TYPES):
+        docs[f"events/event-1/tickets/ticket-{n}"] = {'valor': 50 + n, 'totalIngressos': 100}
+        tickets.append({'ticket_id': f"ticket-{n}", 'quantity': 2})
+    data = {
+        'customer': 'cus_1',
+        'event_id': 'event-1',
+        'tickets': tickets,
+        'coupon': {'coupon_id': 'coupon-1', 'discount_amount': 10},
+        'payment': {'billingType': 'PIX'}
+    }
+    return FakeFirestore(docs, latency=ROUND_TRIP_SECONDS), data
+
+
+def test_checkout_inputs_are_read_in_one_round_trip():
+    db, data = make_checkout()
+    asaas = DecliningAsaas()
+
+    start_time = time.time()
+    result, status_code = PaymentUseCase().create_payment_session(data, asaas, db)
+    duration = time.time() - start_time
+
+    assert status_code == 400 and result == {'error': 'declined'}
+    assert db.round_trips == [('get_all', 2 + NUM_TICKET_TYPES)]
+    # Antes: evento, cada ingresso duas vezes e o cupom em leituras separadas
+    point_reads = 2 * NUM_TICKET_TYPES + 2
+    print(f"[PERF] create_payment_session: {duration * 1000:.1f}ms com 1 get_all (antes ~{point_reads * ROUND_TRIP_SECONDS * 1000:.0f}ms em {point_reads} leituras)")
+    assert duration < point_reads * ROUND_TRIP_SECONDS / 2
+
+    subtotal = sum((50 + n) * 2 for n in range(NUM_TICKET_TYPES))
+    fees = sum(round((50 + n) * 7.99 / 100, 2) * 2 for n in range(NUM_TICKET_TYPES))
+    assert asaas.payment_data['value'] == pytest.approx(subtotal + fees - 10)
@@ -0,0 +1,78 @@
+import pytest
+
+from chalicelib.src.utils import circuit_breaker
+from chalicelib.src.utils.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock()
+    monkeypatch.setattr(circuit_breaker.time, 'time', fake_clock)
+    return fake_clock
+
+
+def record_calls(breaker, count, success=True, duration_ms=10):
+    for _ in range(count):
+        breaker.allow()
+        breaker.record(duration_ms, success)
+
+
+def test_opens_on_error_rate_after_min_calls(clock):
+    breaker = CircuitBreaker('asaas', min_calls=4, error_rate_threshold=0.5)
+    record_calls(breaker, 2, success=True)
+    record_calls(breaker, 1, success=False)
+    assert breaker.state == CLOSED
+    record_calls(breaker, 1, success=False)
+    assert breaker.state == OPEN
+
+
+def test_opens_on_p95_latency(clock):
+    breaker = CircuitBreaker('asaas', min_calls=5, p95_latency_ms=1000)
+    record_calls(breaker, 4, duration_ms=100)
+    record_calls(breaker, 1, duration_ms=2000)
+    assert breaker.state == OPEN
+
+
+def test_old_calls_leave_the_window(clock):
+    breaker = CircuitBreaker('asaas', window_seconds=60, min_calls=4)
+    record_calls(breaker, 3, success=False)
+    clock.now += 61
+    record_calls(breaker, 3, success=True)
+    assert breaker.state == CLOSED
+    assert breaker.get_metrics()['calls_in_window'] == 3
+
+
+def test_open_circuit_rejects_with_retry_after(clock):
+    breaker = CircuitBreaker('asaas', min_calls=1, open_seconds=30)
+    record_calls(breaker, 1, success=False)
+    clock.now += 10
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.allow()
+    assert error.value.retry_after == 20
+    assert breaker.get_metrics()['rejected'] == 1
+
+
+def test_half_open_probe_closes_or_reopens(clock):
+    breaker = CircuitBreaker('asaas', min_calls=1, open_seconds=30, half_open_max_calls=1)
+    record_calls(breaker, 1, success=False)
+
+    clock.now += 31
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.record(10, success=False)
+    assert breaker.state == OPEN
+
+    clock.now += 31
+    record_calls(breaker, 1, success=True)
+    assert breaker.state == CLOSED
+    assert breaker.get_metrics()['transitions'] == {'CLOSED->OPEN': 1, 'OPEN->HALF_OPEN': 2, 'HALF_OPEN->OPEN': 1, 'HALF_OPEN->CLOSED': 1}
@@ -0,0 +1,219 @@
+import pytest
+
+from chalicelib.src.repositories.event_stats_repository import (
+    STATS_VERSION, EventStatsRepository, merge_order_update, merge_stats, order_contribution
+)
+from conftest import FakeFirestore
+
+pytestmark = pytest.mark.usefixtures('fake_transactions')
+
+
+def _sum(*contributions):
+    total = {}
+    for contribution in contributions:
+        for key, value in contribution.items():
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+def test_confirmed_order_contribution():
+    order = {
+        'status': 'CONFIRMADO', 'total_amount': 108, 'subtotal_amount': 100,
+        'payment_details': {'billingType': 'PIX', 'status': 'RECEIVED'}
+    }
+    contribution = order_contribution(order)
+    assert contribution['valorConfirmado'] == 108
+    assert contribution['valorAReceberBruto'] == 100
+    assert contribution['saldoRepasse'] == 100
+    assert contribution['metodosPagamento.pix'] == 1
+    assert 'valorPendente' not in contribution
+
+
+def test_asaas_confirmed_counts_on_dashboard_but_not_on_transfer_balance():
+    # Dashboard considera o status do Asaas; o saldo de repasse, só o status do pedido (como antes)
+    order = {
+        'status': 'PAGAMENTO PENDENTE', 'total_amount': 50, 'subtotal_amount': 45,
+        'payment_details': {'billingType': 'BOLETO', 'status': 'RECEIVED'}
+    }
+    contribution = order_contribution(order)
+    assert contribution['valorConfirmado'] == 50
+    assert 'saldoRepasse' not in contribution
+    assert contribution['saldoRepassePendente'] == 45
+
+
+def test_transferred_order_is_not_available_for_transfer():
+    order = {
+        'status': 'CONFIRMED', 'total_amount': 30, 'subtotal_amount': 28,
+        'payment_details': {'billingType': 'CREDIT_CARD', 'transferred_to_organizer': True}
+    }
+    contribution = order_contribution(order)
+    assert contribution['valorRepassado'] == 30
+    assert 'saldoRepasse' not in contribution
+
+
+def test_status_change_delta_moves_value_between_buckets():
+    before = {'status': 'PAGAMENTO PENDENTE', 'total_amount': 20, 'subtotal_amount': 18}
+    after = merge_order_update(before, {'status': 'CONFIRMADO'})
+    old, new = order_contribution(before), order_contribution(after)
+    delta = {key: new.get(key, 0) - old.get(key, 0) for key in set(old) | set(new)}
+    assert delta['valorPendente'] == -20
+    assert delta['valorConfirmado'] == 20
+    assert delta['totalPedidos'] == 0
+
+
+def test_rebuild_equals_sum_of_contributions():
+    orders = [
+        {'status': 'CONFIRMADO', 'total_amount': 10, 'subtotal_amount': 9},
+        {'status': 'CANCELADO', 'total_amount': 5},
+        {'status': 'EXPIRADO', 'total_amount': 7},
+    ]
+    total = _sum(*(order_contribution(order) for order in orders))
+    assert total['totalPedidos'] == 3
+    assert total['valorCancelado'] == 12
+    assert total['pedidosConfirmados'] == 1
+
+
+def test_merge_order_update_handles_dotted_paths_without_mutating():
+    order = {'payment_details': {'status': 'PENDING', 'id': 'pay_1'}, 'status': 'PAGAMENTO PENDENTE'}
+    merged = merge_order_update(order, {'payment_details.status': 'RECEIVED', 'reservation.expires_at': 1})
+    assert merged['payment_details'] == {'status': 'RECEIVED', 'id': 'pay_1'}
+    assert merged['reservation'] == {'expires_at': 1}
+    assert order['payment_details']['status'] == 'PENDING'
+
+
+def test_empty_order_contributes_nothing():
+    assert order_contribution(None) == {}
+    assert order_contribution({}) == {}
+
+
+class RecordingWriter:
+    def __init__(self):
+        self.writes = []
+
+    def set(self, ref, data, merge=False):
+        self.writes.append((ref.path, data))
+
+
+def test_order_delta_goes_to_a_shard_not_the_base_document():
+    repository = EventStatsRepository(FakeFirestore({}), num_shards=4)
+    writer = RecordingWriter()
+    before = {'event_id': 'event-1', 'status': 'PAGAMENTO PENDENTE', 'total_amount': 20, 'subtotal_amount': 18}
+    repository._apply_delta(writer, 'event-1', before, merge_order_update(before, {'status': 'CONFIRMADO'}))
+
+    [(path, data)] = writer.writes
+    assert path.startswith(f"event_stats/event-1/shards/v{STATS_VERSION}_")
+    assert int(path.rsplit('_', 1)[-1]) in range(4)
+    assert data['valorConfirmado'].value == 20
+
+
+def shard_path(shard):
+    return f"event_stats/event-1/shards/v{STATS_VERSION}_{shard}"
+
+
+def done(num_shards=3):
+    return {'version': STATS_VERSION, 'num_shards': num_shards, 'backfill': {'status': 'done'}}
+
+
+def test_get_stats_sums_the_shards():
+    db = FakeFirestore({
+        'event_stats/event-1': done(),
+        shard_path(0): {'valorConfirmado': 20, 'totalPedidos': 1, 'metodosPagamento': {'pix': 1}},
+        shard_path(2): {'valorConfirmado': 100, 'repassesPendentes': 30, 'updated_at': 'ignored', 'metodosPagamento': {'cartao': 1}},
+        # Shards de outra versão do agregado não são somados
+        'event_stats/event-1/shards/v2_1': {'valorConfirmado': 999},
+    })
+    stats = EventStatsRepository(db, num_shards=3).get_stats('event-1')
+
+    assert stats['initialized'] is True
+    assert stats['valorConfirmado'] == 120
+    assert stats['totalPedidos'] == 1
+    assert stats['repassesPendentes'] == 30
+    assert stats['metodosPagamento'] == {'cartaoCredito': 0, 'pix': 1, 'boleto': 0, 'outros': 0, 'cartao': 1}
+    assert db.round_trips == [('get_all', 4)]
+
+
+def test_get_stats_keeps_reading_shards_after_the_count_is_lowered():
+    db = FakeFirestore({'event_stats/event-1': done(num_shards=4), shard_path(3): {'totalPedidos': 2}})
+    assert EventStatsRepository(db, num_shards=2).get_stats('event-1')['totalPedidos'] == 2
+    assert db.docs['event_stats/event-1']['num_shards'] == 4
+
+
+def test_get_stats_never_rebuilds_and_schedules_the_backfill():
+    db = FakeFirestore({'orders/order-1': {'event_id': 'event-1', 'status': 'CONFIRMADO', 'total_amount': 10}})
+    stats = EventStatsRepository(db, num_shards=2).get_stats('event-1')
+
+    assert stats['initialized'] is False and stats['totalPedidos'] == 0
+    assert db.count('query') == 0
+    meta = db.docs['event_stats/event-1']
+    assert meta['backfill']['status'] == 'pending' and meta['num_shards'] == 2
+
+
+def legacy_orders(count):
+    return {
+        f"orders/order-{n:02d}": {'event_id': 'event-1', 'status': 'CONFIRMADO', 'total_amount': 10, 'subtotal_amount': 9}
+        for n in range(count)
+    }
+
+
+def test_backfill_counts_each_legacy_order_once_in_pages():
+    db = FakeFirestore({
+        **legacy_orders(5),
+        'orders/other': {'event_id': 'event-2', 'status': 'CONFIRMADO', 'total_amount': 50},
+        'transfer_requests/t-1': {'event_id': 'event-1', 'status': 'PENDING', 'amount': 4},
+    })
+    repository = EventStatsRepository(db, num_shards=2)
+    repository.page_size = 2
+
+    # Sem orçamento de tempo: uma página por execução, retomada pelo cursor
+    assert repository.backfill('event-1', time_budget=0)['status'] == 'running'
+    assert repository.get_stats('event-1')['totalPedidos'] == 2
+    while repository.backfill('event-1', time_budget=0)['status'] != 'done':
+        pass
+    assert repository.backfill('event-1')['status'] == 'done'
+
+    stats = repository.get_stats('event-1')
+    assert stats['initialized'] is True
+    assert stats['totalPedidos'] == 5 and stats['valorConfirmado'] == 50
+    assert stats['repassesPendentes'] == 4
+    assert all(db.docs[path]['stats_version'] == STATS_VERSION for path in legacy_orders(5))
+
+
+def test_updates_count_only_orders_already_in_the_aggregate():
+    db = FakeFirestore(legacy_orders(1))
+    repository = EventStatsRepository(db, num_shards=2)
+    order_ref = db.document('orders/order-00')
+
+    # Ainda não contado: o backfill conta o estado final
+    repository.update_order(order_ref, {'status': 'CANCELADO'})
+    repository.backfill('event-1')
+    repository.update_order(order_ref, {'status': 'CONFIRMADO'})
+
+    stats = repository.get_stats('event-1')
+    assert stats['totalPedidos'] == 1
+    assert stats['valorCancelado'] == 0 and stats['valorConfirmado'] == 10
+
+
+def test_backfill_page_changed_after_the_read_is_read_again():
+    db = FakeFirestore(legacy_orders(2))
+    repository = EventStatsRepository(db, num_shards=2)
+    page = list(db.collection('orders').stream())
+    db.document('orders/order-01').update({'status': 'CANCELADO'})
+
+    assert repository._count_page('event-1', 'orders', page) == 2
+    stats = repository.get_stats('event-1')
+    assert stats['valorConfirmado'] == 10 and stats['valorCancelado'] == 10
+
+
+def test_created_orders_are_counted_without_backfill():
+    db = FakeFirestore()
+    repository = EventStatsRepository(db, num_shards=2)
+    repository.create_order(db.document('orders/new'), {'event_id': 'event-1', 'status': 'PAGAMENTO PENDENTE', 'total_amount': 8})
+    repository.backfill('event-1')
+
+    assert db.docs['orders/new']['stats_version'] == STATS_VERSION
+    assert repository.get_stats('event-1')['valorPendente'] == 8
+
+
+def test_merge_stats_skips_non_numeric_fields():
+    stats = merge_stats({'valorPendente': 5}, {'valorPendente': -5, 'updated_at': 'x', 'initialized': True})
+    assert stats == {'valorPendente': 0}
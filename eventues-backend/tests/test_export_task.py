@@ -0,0 +1,144 @@
+import csv
+import sys
+import time
+import types
+from datetime import datetime
+
+# utils.firebase inicializa o app com credenciais reais ao ser importado;
+# o export só usa o FormRepository, substituído abaixo
+sys.modules.setdefault('chalicelib.src.utils.firebase', types.SimpleNamespace(db=None))
+
+from chalicelib.src.models.form_model import FormField  # noqa: E402
+from chalicelib.src.tasks import export_task  # noqa: E402
+from chalicelib.src.tasks.export_task import CsvRowWriter, ExportTask  # noqa: E402
+
+NUM_ORDERS = 2000
+TICKETS_PER_ORDER = 2
+# Piso folgado para não oscilar em máquinas lentas de CI
+MIN_ROWS_PER_SECOND = 1000
+
+
+class FakeOrder:
+    def __init__(self, order_id, data):
+        self.id = order_id
+        self._data = data
+
+    def to_dict(self):
+        return self._data
+
+
+class FakeQuery:
+    def __init__(self, orders, filters=(), after=None, limit=None):
+        self.orders = orders
+        self.filters = filters
+        self.after = after
+        self._limit = limit
+
+    def where(self, field, op, value):
+        return FakeQuery(self.orders, self.filters + ((field, op, value),), self.after, self._limit)
+
+    def order_by(self, field):
+        return self
+
+    def start_after(self, doc):
+        return FakeQuery(self.orders, self.filters, doc.id, self._limit)
+
+    def limit(self, count):
+        return FakeQuery(self.orders, self.filters, self.after, count)
+
+    def _matches(self, data):
+        for field, op, value in self.filters:
+            if op == '==' and data.get(field) != value:
+                return False
+            if op == 'in' and data.get(field) not in value:
+                return False
+        return True
+
+    def stream(self):
+        FakeDb.streams += 1
+        page = [order for order in self.orders if (self.after is None or order.id > self.after) and self._matches(order.to_dict())]
+        return iter(page[:self._limit])
+
+
+class FakeDb:
+    streams = 0
+
+    def __init__(self, orders):
+        self.orders = sorted(orders, key=lambda order: order.id)
+
+    def collection(self, name):
+        return FakeQuery(self.orders)
+
+
+class FakeFormRepository:
+    def get_event_form(self, event_id):
+        return types.SimpleNamespace(fields=[FormField(id='shirt', label='Camiseta', type='select', required=False)])
+
+
+def make_orders():
+    orders = []
+    for n in range(NUM_ORDERS):
+        tickets = [{
+            'ticket_id': 'ticket-a',
+            'ticket_name': 'Inteira',
+            'participants': [{'fullName': f"Participante {n}-{i}", 'gender': 'F', 'shirt': 'M'}]
+        } for i in range(TICKETS_PER_ORDER)]
+        orders.append(FakeOrder(f"order-{n:06d}", {
+            'event_id': 'event-1',
+            'status': 'CONFIRMED' if n % 4 else 'PENDING',
+            'payment_id': f"pay_{n}",
+            'payment_details': {'billingType': 'PIX'},
+            'tickets': tickets,
+            'checkins': {'0': {'checkin': n % 2 == 0}},
+            'subtotal_amount': 100.0,
+            'total_amount': 107.99,
+            'created_at': datetime(2026, 1, 1)
+        }))
+    return orders
+
+
+def make_task(monkeypatch):
+    monkeypatch.setattr(export_task, 'FormRepository', FakeFormRepository)
+    task = ExportTask(FakeDb(make_orders()), bucket=None)
+    task.config = {**task.config, 'page_size': 500}
+    return task
+
+
+def write_rows(rows, path):
+    writer = CsvRowWriter(str(path))
+    count = 0
+    start_time = time.time()
+    try:
+        for row in rows:
+            writer.write(row)
+            count += 1
+    finally:
+        writer.close()
+    return count, time.time() - start_time
+
+
+def test_participant_rows_throughput(monkeypatch, tmp_path):
+    task = make_task(monkeypatch)
+    FakeDb.streams = 0
+    count, duration = write_rows(task._participant_rows('event-1'), tmp_path / 'participants.csv')
+
+    confirmed = NUM_ORDERS - NUM_ORDERS // 4
+    assert count == 1 + confirmed * TICKETS_PER_ORDER
+    assert FakeDb.streams == confirmed // 500 + 1
+    print(f"[PERF] participants: {count / duration:.0f} linhas/s")
+    assert count / duration > MIN_ROWS_PER_SECOND
+
+    with open(tmp_path / 'participants.csv', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header, first = next(reader), next(reader)
+    assert header[-1] == 'Camiseta'
+    assert first[2] == 'Participante 1-0' and first[-1] == 'M'
+
+
+def test_order_rows_throughput(monkeypatch, tmp_path):
+    task = make_task(monkeypatch)
+    count, duration = write_rows(task._order_rows('event-1'), tmp_path / 'orders.csv')
+
+    assert count == 1 + NUM_ORDERS
+    print(f"[PERF] orders: {count / duration:.0f} linhas/s")
+    assert count / duration > MIN_ROWS_PER_SECOND
@@ -0,0 +1,119 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from chalicelib.src.utils.circuit_breaker import CircuitOpenError
+from chalicelib.src.utils.http_client import HttpClient
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Responde com os status enfileirados em server.responses para cada caminho."""
+
+    # HTTP/1.1 mantém a conexão aberta entre requisições (keep-alive)
+    protocol_version = 'HTTP/1.1'
+
+    def _respond(self):
+        self.server.requests.append((self.command, self.path))
+        self.server.client_ports.add(self.client_address[1])
+        statuses = self.server.responses.get(self.path) or [200]
+        status = statuses.pop(0) if len(statuses) > 1 else statuses[0]
+        if status == 'slow':
+            self.server.release.wait(0.5)
+            status = 200
+        body = b'{"ok": true}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _respond
+    do_POST = _respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.responses = {}
+    server.requests = []
+    server.client_ports = set()
+    server.release = threading.Event()
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.release.set()
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(server, **options):
+    options = {'max_retries': 2, 'retry_backoff': 0.001, **options}
+    return HttpClient(f"http://127.0.0.1:{server.server_address[1]}", **options)
+
+
+def test_get_is_retried_on_transient_status(stub_server):
+    stub_server.responses['/payments/1'] = [503, 200]
+    client = make_client(stub_server)
+
+    response = client.get('/payments/1', name='get_payment')
+
+    assert response.status_code == 200
+    assert len(stub_server.requests) == 2
+    metrics = client.get_metrics()['get_payment']
+    assert metrics['calls'] == 1 and metrics['retries'] == 1 and metrics['errors'] == 0
+
+
+def test_post_is_never_retried(stub_server):
+    stub_server.responses['/payments'] = [503, 200]
+    client = make_client(stub_server)
+
+    response = client.post('/payments', name='create_payment', json={'value': 10})
+
+    assert response.status_code == 503
+    assert stub_server.requests == [('POST', '/payments')]
+    assert client.get_metrics()['create_payment']['errors'] == 1
+
+
+def test_retries_stop_after_max_retries(stub_server):
+    stub_server.responses['/status'] = [502]
+    client = make_client(stub_server, max_retries=2)
+
+    assert client.get('/status').status_code == 502
+    assert len(stub_server.requests) == 3
+
+
+def test_read_timeout_raises_after_retries(stub_server):
+    stub_server.responses['/slow'] = ['slow']
+    client = make_client(stub_server, read_timeout=0.05, max_retries=1)
+
+    with pytest.raises(requests.Timeout):
+        client.get('/slow', name='slow')
+    assert len(stub_server.requests) == 2
+    assert client.get_metrics()['slow']['errors'] == 1
+
+
+def test_connection_is_reused_between_calls(stub_server):
+    client = make_client(stub_server)
+    client.get('/a')
+    client.get('/b')
+    client.post('/c')
+    assert len(stub_server.client_ports) == 1
+
+
+def test_breaker_opens_and_rejects_without_network(stub_server):
+    stub_server.responses['/flaky'] = [500]
+    client = make_client(stub_server, max_retries=0, breaker_options={'min_calls': 3, 'open_seconds': 60})
+
+    for _ in range(3):
+        assert client.get('/flaky', name='flaky').status_code == 500
+    with pytest.raises(CircuitOpenError) as error:
+        client.get('/flaky', name='flaky')
+
+    assert len(stub_server.requests) == 3
+    assert error.value.to_response()[1] == 503
+    assert client.get_metrics()['flaky']['circuit']['state'] == 'OPEN'
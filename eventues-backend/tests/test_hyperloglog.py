@@ -0,0 +1,86 @@
+import pytest
+
+from chalicelib.src.repositories import analytics_repository
+from chalicelib.src.repositories.analytics_repository import AnalyticsRepository
+from chalicelib.src.utils.hyperloglog import HyperLogLog
+from conftest import FakeFirestore
+
+
+def sketch_of(values, precision=12):
+    sketch = HyperLogLog(precision)
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+
+def test_count_is_within_error_bound():
+    for cardinality in (10, 1000, 50000):
+        estimate = sketch_of(f"visitor-{n}" for n in range(cardinality)).count()
+        assert abs(estimate - cardinality) <= max(2, cardinality * 0.05)
+
+
+def test_duplicates_do_not_change_count():
+    sketch = sketch_of(['a', 'b', 'c'])
+    assert sketch_of(['a', 'b', 'c', 'a', 'b', 'c']).count() == sketch.count() == 3
+
+
+def test_merge_is_union_and_idempotent():
+    left = sketch_of(f"v-{n}" for n in range(500))
+    right = sketch_of(f"v-{n}" for n in range(250, 750))
+    assert left.merge(right) is True
+    assert abs(left.count() - 750) <= 750 * 0.05
+    assert left.merge(right) is False
+
+
+def test_bytes_round_trip():
+    sketch = sketch_of(['a', 'b'], precision=10)
+    restored = HyperLogLog.from_bytes(sketch.to_bytes(), precision=10)
+    assert restored.registers == sketch.registers
+    assert restored.count() == 2
+
+
+def test_merge_rejects_different_precision():
+    with pytest.raises(ValueError):
+        HyperLogLog(10).merge(HyperLogLog(12))
+
+
+def test_unique_visitors_merges_shards_and_legacy_total():
+    analytics_repository._unique_visitors_cache.clear()
+    base = 'event_analytics/event-1/unique_visitors'
+    docs = {
+        f"{base}/total": {'hll': sketch_of(['a', 'b']).to_bytes(), 'precision': 12},
+        f"{base}/total__0": {'hll': sketch_of(['b', 'c']).to_bytes(), 'precision': 12},
+        f"{base}/total__2": {'hll': sketch_of(['d']).to_bytes(), 'precision': 12},
+    }
+    db = FakeFirestore(docs)
+    repository = AnalyticsRepository(db, num_shards=3)
+
+    assert repository.get_unique_visitors('event-1') == 4
+    assert repository.get_unique_visitors('event-1') == 4
+    assert db.round_trips == [('get_all', 4)]
+
+
+def test_unbuffered_visitor_is_a_blind_register_write():
+    analytics_repository._unique_visitors_cache.clear()
+    db = FakeFirestore()
+    repository = AnalyticsRepository(db, num_shards=1)
+    for visitor in ['a', 'b', 'a', 'c']:
+        repository.record_unique_visitor('event-1', visitor)
+
+    assert db.count('get') + db.count('get_all') + db.count('transaction') == 0
+    assert db.count('commit') == 4
+    assert repository.get_unique_visitors('event-1') == 3
+
+
+@pytest.mark.usefixtures('fake_transactions')
+def test_buffered_merge_consolidates_blind_registers():
+    analytics_repository._unique_visitors_cache.clear()
+    db = FakeFirestore()
+    repository = AnalyticsRepository(db, num_shards=1)
+    repository.record_unique_visitor('event-1', 'a')
+    repository.merge_unique_visitors('event-1', {'2026-10-17': sketch_of(['b'])})
+
+    total = db.docs['event_analytics/event-1/unique_visitors/total__0']
+    assert 'registers' not in total
+    assert HyperLogLog.from_bytes(total['hll']).count() == 2
+    assert repository.get_unique_visitors('event-1') == 2
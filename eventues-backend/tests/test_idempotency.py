@@ -0,0 +1,89 @@
+import pytest
+
+from chalicelib.src.repositories.idempotency_repository import IdempotencyRepository, has_side_effect
+from conftest import FakeFirestore
+
+pytestmark = pytest.mark.usefixtures('fake_transactions')
+
+
+class Handler:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def run(repository, handler, data=None):
+    return repository.run('create-order', 'key-1', data or {'event_id': 'event-1'}, handler)
+
+
+def test_created_order_is_replayed_without_running_again():
+    repository = IdempotencyRepository(FakeFirestore())
+    handler = Handler(({'order_id': 'order-1'}, 200))
+
+    assert run(repository, handler) == ({'order_id': 'order-1'}, 200, False)
+    assert run(repository, handler) == ({'order_id': 'order-1'}, 200, True)
+    assert handler.calls == 1
+
+
+@pytest.mark.parametrize('status_code', [400, 403, 409, 429, 500, 502, 503])
+def test_responses_without_side_effect_release_the_key(status_code):
+    repository = IdempotencyRepository(FakeFirestore())
+    handler = Handler(({'error': 'falhou'}, status_code), ({'order_id': 'order-1'}, 200))
+
+    assert run(repository, handler) == ({'error': 'falhou'}, status_code, False)
+    assert run(repository, handler) == ({'order_id': 'order-1'}, 200, False)
+    assert handler.calls == 2
+
+
+def test_server_error_after_the_charge_is_replayed():
+    repository = IdempotencyRepository(FakeFirestore())
+    failed = {'error': 'Erro ao registrar o pagamento', 'payment_id': 'pay_1'}
+    handler = Handler((failed, 500))
+
+    run(repository, handler)
+    assert run(repository, handler) == (failed, 500, True)
+    assert handler.calls == 1
+
+
+def test_exception_releases_the_key():
+    repository = IdempotencyRepository(FakeFirestore())
+    handler = Handler(RuntimeError('timeout'), ({'id': 'pay_1'}, 200))
+
+    with pytest.raises(RuntimeError):
+        run(repository, handler)
+    assert run(repository, handler) == ({'id': 'pay_1'}, 200, False)
+
+
+def test_same_key_with_another_payload_is_rejected():
+    repository = IdempotencyRepository(FakeFirestore())
+    run(repository, Handler(({'order_id': 'order-1'}, 200)))
+
+    result, status_code, replayed = run(repository, Handler(), data={'event_id': 'event-2'})
+    assert status_code == 422 and not replayed
+
+
+def test_concurrent_duplicate_gets_409_while_in_progress():
+    repository = IdempotencyRepository(FakeFirestore())
+    inner = {}
+
+    def handler():
+        inner['response'] = run(repository, Handler())
+        return {'order_id': 'order-1'}, 200
+
+    run(repository, handler)
+    result, status_code, replayed = inner['response']
+    assert status_code == 409 and result['retry_after'] == 1
+
+
+def test_side_effect_detection():
+    assert has_side_effect({'order_id': 'order-1'})
+    assert has_side_effect({'id': 'pay_1', 'status': 'PENDING'})
+    assert not has_side_effect({'error': 'Ingressos esgotados', 'stock_id': 'ticket-1'})
+    assert not has_side_effect('erro')
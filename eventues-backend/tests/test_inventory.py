@@ -0,0 +1,195 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from chalicelib.src.repositories.event_stats_repository import merge_order_update
+from chalicelib.src.repositories.inventory_repository import InsufficientStockError, InventoryRepository
+from chalicelib.src.usecases.payment_usecase import PaymentUseCase
+from conftest import FakeFirestore, fake_transactional
+
+NUM_SHARDS = 4
+
+
+pytestmark = pytest.mark.usefixtures('fake_transactions')
+
+
+def in_transaction(db, function):
+    """Executa function(transaction) numa transação do fake, como @firestore.transactional."""
+    return fake_transactional(function)(db.transaction())
+
+
+def seed_stock(db, stock_id, capacity, available, sold=None, reserved=None):
+    db.docs[f"inventory/event-1/stocks/{stock_id}"] = {'capacity': capacity, 'num_shards': len(available)}
+    for shard, units in enumerate(available):
+        db.docs[f"inventory/event-1/stocks/{stock_id}/shards/{shard}"] = {
+            'available': units,
+            'sold': (sold or [0] * len(available))[shard],
+            'reserved': (reserved or [0] * len(available))[shard]
+        }
+
+
+def shard_values(db, stock_id, field):
+    return [db.docs[f"inventory/event-1/stocks/{stock_id}/shards/{shard}"].get(field, 0) for shard in range(NUM_SHARDS)]
+
+
+def reserve(repository, order_id, quantity):
+    """Reserva e grava o pedido numa transação, como o checkout."""
+    def reserve_in_transaction(transaction):
+        items = repository.allocate(transaction, 'event-1', {'ticket-1': {'quantity': quantity}})
+        order = {'event_id': 'event-1', 'status': 'PAGAMENTO PENDENTE', 'reservation': {'items': items}}
+        repository.sync_order(transaction, order_id, None, order)
+        return order
+
+    return in_transaction(repository.db, reserve_in_transaction)
+
+
+def buy(repository, order_id):
+    try:
+        return order_id, reserve(repository, order_id, 1)
+    except InsufficientStockError:
+        return order_id, None
+
+
+def test_more_buyers_than_capacity_never_oversell():
+    # Leituras com latência: compradores concorrentes esperam o lock dos shards
+    db = FakeFirestore(jitter=0.001)
+    seed_stock(db, 'ticket-1', 10, [3, 3, 2, 2])
+    repository = InventoryRepository(db, num_shards=NUM_SHARDS)
+
+    with ThreadPoolExecutor(max_workers=25) as executor:
+        results = dict(executor.map(lambda n: buy(repository, f"order-{n}"), range(25)))
+    orders = {order_id: order for order_id, order in results.items() if order}
+
+    assert len(orders) == 10
+    assert sum(shard_values(db, 'ticket-1', 'reserved')) == 10
+    assert min(shard_values(db, 'ticket-1', 'available')) == 0
+
+    batch = db.batch()
+    for order_id, order in orders.items():
+        repository.sync_order(batch, order_id, order, merge_order_update(order, {'status': 'CONFIRMADO'}))
+    batch.commit()
+
+    assert sum(shard_values(db, 'ticket-1', 'sold')) == 10
+    assert sum(shard_values(db, 'ticket-1', 'reserved')) == 0
+    assert shard_values(db, 'ticket-1', 'available') == [0] * NUM_SHARDS
+
+
+def expired_order(shard=0):
+    return {
+        'event_id': 'event-1', 'status': 'EXPIRADO', 'tickets': [{'ticket_id': 'ticket-1', 'quantity': 1}],
+        'reservation': {'items': [{'stock_id': 'ticket-1', 'shard': shard, 'quantity': 1}]}
+    }
+
+
+def test_expired_order_back_to_pending_is_rejected_without_stock():
+    # Capacidade 1: a unidade liberada pelo pedido expirado já foi reservada por outro
+    db = FakeFirestore({'orders/order-1': expired_order(shard=2)})
+    seed_stock(db, 'ticket-1', 1, [0, 0, 0, 0], reserved=[1, 0, 0, 0])
+
+    result, status_code = PaymentUseCase().update_order_participants('order-1', [{'ticket_id': 'ticket-1', 'quantity': 1}], db)
+
+    assert status_code == 409 and result['stock_id'] == 'ticket-1'
+    assert db.docs['orders/order-1']['status'] == 'EXPIRADO'
+    assert shard_values(db, 'ticket-1', 'available') == [0] * NUM_SHARDS
+    assert shard_values(db, 'ticket-1', 'reserved') == [1, 0, 0, 0]
+
+
+def test_expired_order_back_to_pending_reallocates_its_units():
+    db = FakeFirestore({'orders/order-1': expired_order(shard=2)})
+    seed_stock(db, 'ticket-1', 1, [1, 0, 0, 0])
+
+    result, status_code = PaymentUseCase().update_order_participants('order-1', [{'ticket_id': 'ticket-1', 'quantity': 1}], db)
+
+    order = db.docs['orders/order-1']
+    assert status_code == 200 and order['status'] == 'PAGAMENTO PENDENTE'
+    assert order['reservation']['items'] == [{'stock_id': 'ticket-1', 'shard': 0, 'quantity': 1}]
+    assert shard_values(db, 'ticket-1', 'available') == [0] * NUM_SHARDS
+    assert shard_values(db, 'ticket-1', 'reserved') == [1, 0, 0, 0]
+
+
+def test_gateway_status_without_stock_keeps_the_order_released():
+    db = FakeFirestore()
+    seed_stock(db, 'ticket-1', 1, [0, 0, 0, 0], reserved=[1, 0, 0, 0])
+    repository = InventoryRepository(db, num_shards=NUM_SHARDS)
+    update = {'status': 'PAGAMENTO PENDENTE', 'payment_details.status': 'RESTORED'}
+
+    prepared = in_transaction(db, lambda transaction: repository.reclaim(transaction, expired_order(), update))
+
+    assert prepared == {'payment_details.status': 'RESTORED'}
+
+
+def test_late_confirmation_reclaims_released_units():
+    db = FakeFirestore()
+    seed_stock(db, 'ticket-1', 10, [1, 0, 0, 0], sold=[0, 9, 0, 0])
+    repository = InventoryRepository(db, num_shards=NUM_SHARDS)
+    expired = {
+        'event_id': 'event-1', 'status': 'EXPIRADO',
+        'reservation': {'items': [{'stock_id': 'ticket-1', 'shard': 2, 'quantity': 1}]}
+    }
+
+    update = in_transaction(db, lambda transaction: repository.reclaim(transaction, expired, {'status': 'CONFIRMADO'}))
+
+    assert update['reservation.items'] == [{'stock_id': 'ticket-1', 'shard': 0, 'quantity': 1}]
+    assert 'oversold' not in update
+
+
+def test_late_confirmation_without_stock_is_flagged_as_oversold():
+    db = FakeFirestore()
+    seed_stock(db, 'ticket-1', 10, [0, 0, 0, 0], sold=[3, 3, 2, 2])
+    repository = InventoryRepository(db, num_shards=NUM_SHARDS)
+    items = [{'stock_id': 'ticket-1', 'shard': 1, 'quantity': 2}]
+    expired = {'event_id': 'event-1', 'status': 'EXPIRADO', 'reservation': {'items': items}}
+
+    update = in_transaction(db, lambda transaction: repository.reclaim(transaction, expired, {'status': 'CONFIRMADO'}))
+    after = merge_order_update(expired, update)
+    batch = db.batch()
+    repository.sync_order(batch, 'order-1', expired, after)
+    batch.commit()
+
+    assert update['oversold'] is True
+    assert update['reservation.oversold_items'] == items
+    assert after['status'] == 'CONFIRMADO'
+    # Sem itens na reserva, os contadores não passam da capacidade
+    assert sum(shard_values(db, 'ticket-1', 'sold')) == 10
+    assert shard_values(db, 'ticket-1', 'available') == [0] * NUM_SHARDS
+
+
+def test_reclaim_ignores_orders_that_still_hold_the_reservation():
+    repository = InventoryRepository(FakeFirestore(), num_shards=NUM_SHARDS)
+    pending = {
+        'event_id': 'event-1', 'status': 'PAGAMENTO PENDENTE',
+        'reservation': {'items': [{'stock_id': 'ticket-1', 'shard': 0, 'quantity': 1}]}
+    }
+    assert repository.reclaim(None, pending, {'status': 'CONFIRMADO'}) == {'status': 'CONFIRMADO'}
+
+
+def test_capacity_increase_is_spread_over_the_shards():
+    db = FakeFirestore()
+    seed_stock(db, 'ticket-1', 10, [3, 3, 2, 2])
+    repository = InventoryRepository(db, num_shards=NUM_SHARDS)
+
+    assert repository.resync_capacity('event-1', 'ticket-1', {'totalIngressos': '16'}) == 1
+    assert shard_values(db, 'ticket-1', 'available') == [5, 5, 3, 3]
+    assert db.docs['inventory/event-1/stocks/ticket-1']['capacity'] == 16
+
+
+def test_capacity_decrease_keeps_sold_and_reserved_units():
+    db = FakeFirestore()
+    seed_stock(db, 'ticket-1', 10, [1, 4, 2, 0], sold=[1, 0, 0, 1], reserved=[0, 1, 0, 0])
+    repository = InventoryRepository(db, num_shards=NUM_SHARDS)
+
+    repository.resync_capacity('event-1', 'ticket-1', {'totalIngressos': '4'})
+
+    available = shard_values(db, 'ticket-1', 'available')
+    assert sum(available) == 1
+    assert min(available) >= 0
+
+
+def test_resync_skips_unchanged_and_uninitialized_stocks():
+    db = FakeFirestore()
+    seed_stock(db, 'ticket-1', 10, [3, 3, 2, 2])
+    repository = InventoryRepository(db, num_shards=NUM_SHARDS)
+    ticket = {'totalIngressos': '10', 'tipo': 'Lotes', 'lotes': [{'quantidade': 5}]}
+
+    assert repository.resync_capacity('event-1', 'ticket-1', ticket) == 0
+    assert 'inventory/event-1/stocks/ticket-1__lote_0' not in db.docs
@@ -0,0 +1,105 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from chalicelib.src.repositories.inventory_repository import InsufficientStockError
+from chalicelib.src.repositories.lot_repository import LotRepository, current_lot_index, lot_capacity
+from chalicelib.src.usecases.cart_pricing import CartPricing
+from conftest import FakeFirestore
+
+NOW = datetime(2026, 5, 1, 12, 0)
+TICKET_PATH = 'events/event-1/tickets/ticket-1'
+
+
+class RecordingFirestore(FakeFirestore):
+    """Registra cada valor gravado em lote_atual, na ordem dos commits."""
+
+    def __init__(self, docs):
+        # Jitter abre espaço para outra thread intercalar entre leitura e escrita
+        super().__init__(docs, jitter=0.002)
+        self.history = []
+
+    def _commit(self, writes):
+        super()._commit(writes)
+        self.history.extend(data['lote_atual']['index'] for kind, ref, data, merge in writes if 'lote_atual' in data)
+
+
+pytestmark = pytest.mark.usefixtures('fake_transactions')
+
+
+def make_ticket(pointer=None):
+    ticket = {
+        'tipo': 'Lotes',
+        'valor': 50,
+        'lotes': [
+            {'valor': 50, 'quantidade': 10, 'viradaProximoLote': {'data': (NOW - timedelta(days=2)).isoformat()}},
+            {'valor': 60, 'viradaProximoLote': {'data': (NOW + timedelta(days=2)).isoformat(), 'quantidade': 20}},
+            {'valor': 70, 'quantidade': '5'},
+        ]
+    }
+    if pointer is not None:
+        ticket['lote_atual'] = {'index': pointer}
+    return ticket
+
+
+def test_current_lot_skips_lots_past_their_deadline():
+    assert current_lot_index(make_ticket(), now=NOW) == 1
+    assert current_lot_index(make_ticket(), now=NOW + timedelta(days=3)) == 2
+
+
+def test_current_lot_respects_a_pointer_moved_by_another_request():
+    # Outra requisição virou o lote 1 por esgotamento antes da data
+    assert current_lot_index(make_ticket(pointer=2), now=NOW) == 2
+
+
+def test_current_lot_is_none_when_every_lot_ended_or_no_lots():
+    ticket = make_ticket(pointer=2)
+    ticket['lotes'][2]['viradaProximoLote'] = {'data': (NOW - timedelta(days=1)).isoformat()}
+    assert current_lot_index(ticket, now=NOW) is None
+    assert current_lot_index({'tipo': 'Pago', 'valor': 10}, now=NOW) is None
+
+
+def test_lot_capacity_prefers_the_turnover_quantity():
+    lotes = make_ticket()['lotes']
+    assert [lot_capacity(lote) for lote in lotes] == [10, 20, 5]
+
+
+def test_concurrent_advances_never_move_the_pointer_back():
+    db = RecordingFirestore({TICKET_PATH: make_ticket(pointer=0)})
+    repository = LotRepository(db)
+    targets = [1, 2, 1, 2, 1, 2, 0, 1]
+    threads = [threading.Thread(target=repository.advance, args=('event-1', 'ticket-1', target)) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert db.docs[TICKET_PATH]['lote_atual']['index'] == 2
+    assert db.history == sorted(db.history)
+    assert len(db.history) <= 2
+
+
+def test_advance_with_stale_index_returns_the_stored_pointer():
+    db = RecordingFirestore({TICKET_PATH: make_ticket(pointer=2)})
+    assert LotRepository(db).advance('event-1', 'ticket-1', 1) == 2
+    assert db.history == []
+
+
+def test_sync_pointer_with_stale_ticket_data_does_not_rewind():
+    db = RecordingFirestore({TICKET_PATH: make_ticket(pointer=2)})
+    stale = make_ticket(pointer=0)
+    LotRepository(db).sync_pointer('event-1', 'ticket-1', stale, 1)
+
+    assert db.docs[TICKET_PATH]['lote_atual']['index'] == 2
+    assert stale['lote_atual'] == {'index': 1}
+
+
+def test_resolve_lots_raises_when_every_lot_ended():
+    ticket = make_ticket(pointer=2)
+    ticket['lotes'][2]['viradaProximoLote'] = {'data': '2000-01-01T00:00:00'}
+    cart = CartPricing(RecordingFirestore({TICKET_PATH: ticket}))
+
+    with pytest.raises(InsufficientStockError) as error:
+        cart.resolve_lots('event-1', {'ticket-1': ticket})
+    assert error.value.stock_id == 'ticket-1__lote_2'
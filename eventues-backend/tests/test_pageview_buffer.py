@@ -0,0 +1,112 @@
+from chalicelib.src.tasks.pageview_buffer import PageViewBuffer
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def commit(self):
+        if self.db.fail_commits:
+            self.db.fail_commits -= 1
+            raise RuntimeError('unavailable')
+        self.db.commits.append(self.writes)
+
+
+class FakeDb:
+    def __init__(self, fail_commits=0):
+        self.fail_commits = fail_commits
+        self.commits = []
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+class FakeAnalytics:
+    def __init__(self):
+        self.sketches = []
+
+    def increment_page_view(self, event_id, count=1, writer=None):
+        writer.writes.append((event_id, count))
+
+    def merge_unique_visitors(self, event_id, sketches_by_day):
+        self.sketches.append((event_id, sketches_by_day))
+
+
+def make_buffer(db=None, **options):
+    options = {'flush_interval': 3600, 'flush_max_hits': 5, 'max_pending': 20, **options}
+    return PageViewBuffer(db or FakeDb(), FakeAnalytics(), **options)
+
+
+def test_add_does_not_write():
+    buffer = make_buffer()
+    for _ in range(10):
+        buffer.add('event-1', visitor_id='v')
+    assert buffer.db.commits == []
+    assert buffer.stats()['pending_hits'] == 10
+
+
+def test_flush_if_due_waits_for_hit_threshold():
+    buffer = make_buffer()
+    for _ in range(4):
+        buffer.add('event-1')
+    assert buffer.flush_if_due() == 0
+    buffer.add('event-2')
+    assert buffer.flush_if_due() == 5
+    assert sorted(buffer.db.commits[0]) == [('event-1', 4), ('event-2', 1)]
+    assert buffer.stats()['pending_hits'] == 0
+
+
+def test_flush_if_due_after_interval():
+    buffer = make_buffer(flush_interval=0)
+    buffer.add('event-1')
+    assert buffer.flush_if_due() == 1
+
+
+def test_flush_is_bounded_by_events_per_batch():
+    buffer = make_buffer(flush_max_events=2)
+    for event_id in ('a', 'b', 'c'):
+        buffer.add(event_id, count=2)
+    assert buffer.flush() == 4
+    assert len(buffer.db.commits[0]) == 2
+    assert buffer.stats()['pending_hits'] == 2
+    assert buffer.flush() == 2
+
+
+def test_failed_flush_requeues_and_drops_over_max_pending():
+    buffer = make_buffer(db=FakeDb(fail_commits=2), max_pending=6)
+    buffer.add('event-1', count=5, visitor_id='v1')
+    assert buffer.flush() == 0
+    assert buffer.stats()['pending_hits'] == 5
+
+    buffer.add('event-1', count=3)
+    assert buffer.flush() == 0
+    stats = buffer.stats()
+    assert stats['dropped_hits'] == 8
+    assert stats['pending_hits'] == 0
+    assert stats['failed_flushes'] == 2
+
+
+def test_visitor_sketches_are_merged_on_flush():
+    buffer = make_buffer()
+    for visitor in ('a', 'b', 'a'):
+        buffer.add('event-1', visitor_id=visitor)
+    buffer.flush()
+    event_id, sketches_by_day = buffer.analytics_repository.sketches[0]
+    assert event_id == 'event-1'
+    assert sum(sketch.count() for sketch in sketches_by_day.values()) == 2
+
+
+def test_sketch_merges_per_flush_are_capped():
+    buffer = make_buffer(flush_max_sketch_merges=2)
+    for event_id in ('a', 'b', 'c'):
+        buffer.add(event_id, visitor_id='v1')
+    assert buffer.flush() == 3
+    assert [event_id for event_id, _ in buffer.analytics_repository.sketches] == ['a', 'b']
+    assert buffer.stats()['pending_sketch_events'] == 1
+
+    # Só sketches pendentes: sem batch de visualizações
+    assert buffer.flush() == 0
+    assert len(buffer.db.commits) == 1
+    assert [event_id for event_id, _ in buffer.analytics_repository.sketches] == ['a', 'b', 'c']
+    assert buffer.stats()['pending_sketch_events'] == 0
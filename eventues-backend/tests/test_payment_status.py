@@ -0,0 +1,84 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from chalicelib.src.usecases import assas_usecase
+from chalicelib.src.usecases.assas_usecase import AsaasUseCase
+from chalicelib.src.usecases.payment_usecase import PaymentUseCase
+
+FRESH_SECONDS = assas_usecase.checkout_config['status_fresh_seconds']
+
+
+def pending_order(**timestamps):
+    return {'payment_details': {'status': 'PENDING'}, **timestamps}
+
+
+def test_status_past_pending_is_always_fresh():
+    assert PaymentUseCase._is_status_fresh({'payment_details': {'status': 'RECEIVED'}})
+    assert not PaymentUseCase._is_status_fresh({'payment_details': {}})
+    assert not PaymentUseCase._is_status_fresh({})
+
+
+def test_pending_status_is_fresh_only_inside_the_window():
+    recent = datetime.now() - timedelta(seconds=FRESH_SECONDS / 2)
+    old = datetime.now() - timedelta(seconds=FRESH_SECONDS * 2)
+
+    assert PaymentUseCase._is_status_fresh(pending_order(updated_at=recent))
+    assert not PaymentUseCase._is_status_fresh(pending_order(updated_at=old))
+    assert not PaymentUseCase._is_status_fresh(pending_order())
+    # A última consulta ao Asaas também renova a janela
+    assert PaymentUseCase._is_status_fresh(pending_order(updated_at=old, status_checked_at=recent))
+
+
+def test_fresh_window_accepts_timestamps_with_timezone():
+    # Firestore devolve datetimes com fuso; a comparação usa o valor sem fuso
+    recent = datetime.now().replace(tzinfo=timezone.utc)
+    assert PaymentUseCase._is_status_fresh(pending_order(updated_at=recent))
+
+
+@pytest.fixture
+def asaas(monkeypatch):
+    assas_usecase._status_cache.clear()
+    assas_usecase._status_inflight.clear()
+    usecase = AsaasUseCase()
+    calls = []
+    release = threading.Event()
+
+    def get_payment_status(payment_id):
+        calls.append(payment_id)
+        release.wait(1)
+        return {'id': payment_id, 'status': 'PENDING'}
+
+    monkeypatch.setattr(usecase, 'get_payment_status', get_payment_status)
+    usecase.calls = calls
+    usecase.release = release
+    yield usecase
+    assas_usecase._status_cache.clear()
+
+
+def test_concurrent_status_lookups_share_one_asaas_call(asaas):
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(asaas.get_payment_status_coalesced, 'pay-1') for _ in range(8)]
+        time.sleep(0.05)
+        asaas.release.set()
+        results = [future.result() for future in futures]
+
+    assert asaas.calls == ['pay-1']
+    assert all(result == {'id': 'pay-1', 'status': 'PENDING'} for result in results)
+    # Dentro do intervalo, novas consultas usam o resultado em cache
+    assert asaas.get_payment_status_coalesced('pay-1')['status'] == 'PENDING'
+    assert asaas.get_payment_status_coalesced('pay-2')['id'] == 'pay-2'
+    assert asaas.calls == ['pay-1', 'pay-2']
+
+
+def test_failed_lookup_is_not_cached(asaas, monkeypatch):
+    asaas.release.set()
+    monkeypatch.setattr(asaas, 'get_payment_status', lambda payment_id: asaas.calls.append(payment_id))
+
+    assert asaas.get_payment_status_coalesced('pay-1') is None
+    assert asaas.get_payment_status_coalesced('pay-1') is None
+    assert asaas.calls == ['pay-1', 'pay-1']
+    assert not assas_usecase._status_inflight
@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta
+
+from chalicelib.src.repositories.pix_qr_repository import PixQrCodeRepository, pix_qr_expiration
+from chalicelib.src.usecases.payment_usecase import PaymentUseCase
+from conftest import FakeFirestore
+
+PIX_DATA = {'encodedImage': 'aW1n', 'payload': '000201', 'expirationDate': '2099-01-01 23:59:59'}
+
+
+class FakeAsaas:
+    def __init__(self, pix_data):
+        self.pix_data = pix_data
+        self.calls = 0
+
+    def get_pix_qr_code(self, payment_id):
+        self.calls += 1
+        return self.pix_data
+
+
+def test_qr_code_is_fetched_once_and_served_from_firestore():
+    db = FakeFirestore()
+    asaas = FakeAsaas(PIX_DATA)
+
+    assert PaymentUseCase().get_pix_qrcode('pay_1', asaas, db) == (PIX_DATA, 200)
+    # Outro container: sem cache local, lê o QR gravado
+    assert PaymentUseCase().get_pix_qrcode('pay_1', FakeAsaas(None), db) == (PIX_DATA, 200)
+    assert asaas.calls == 1
+
+
+def test_expired_qr_code_is_fetched_again():
+    db = FakeFirestore()
+    PixQrCodeRepository(db).save('pay_1', {**PIX_DATA, 'expirationDate': '2000-01-01 00:00:00'})
+    assert PixQrCodeRepository(db).get('pay_1') is None
+
+    result, status_code = PaymentUseCase().get_pix_qrcode('pay_1', FakeAsaas(None), db)
+    assert status_code == 400
+
+
+def test_expiration_defaults_when_asaas_omits_it():
+    assert pix_qr_expiration(PIX_DATA) == datetime(2099, 1, 1, 23, 59, 59)
+    assert pix_qr_expiration({}) > datetime.now() + timedelta(hours=23)
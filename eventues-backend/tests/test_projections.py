@@ -0,0 +1,112 @@
+from chalicelib.src.repositories.participant_repository import ParticipantRepository
+from chalicelib.src.repositories.payment_index_repository import PaymentIndexRepository
+from chalicelib.src.repositories.qr_index_repository import QrIndexRepository
+from conftest import FakeFirestore
+
+
+def order(status='CONFIRMADO', codes=('qr-a', 'qr-b'), **fields):
+    return {
+        'event_id': 'event-1', 'status': status,
+        'tickets': [
+            {'ticket_id': 'geral', 'ticket_name': 'Geral', 'qr_code_uuid': code, 'participants': [{'fullName': f"Ana {code}"}]}
+            for code in codes
+        ],
+        **fields
+    }
+
+
+def apply(db, hook, before, after):
+    batch = db.batch()
+    writes = hook(batch, 'order-1', before, after)
+    batch.commit()
+    return writes
+
+
+def test_qr_index_is_untouched_when_codes_do_not_change():
+    db = FakeFirestore()
+    assert apply(db, QrIndexRepository(db).index_order_update, order(), order(status='CANCELADO')) == 0
+    assert db.docs == {}
+
+
+def test_qr_index_follows_added_and_moved_tickets():
+    db = FakeFirestore()
+    apply(db, QrIndexRepository(db).index_order_update, order(codes=('qr-a',)), order(codes=('qr-c', 'qr-a')))
+
+    assert db.docs['qr_index/qr-a']['ticket_index'] == 1
+    assert db.docs['qr_index/qr-c']['order_id'] == 'order-1'
+    assert db.docs['qr_index/qr-c']['ticket_index'] == 0
+
+
+def test_qr_index_drops_codes_that_left_the_order():
+    db = FakeFirestore({
+        'qr_index/qr-a': {'event_id': 'event-1', 'order_id': 'order-1', 'ticket_index': 0},
+        'qr_index/qr-b': {'event_id': 'event-1', 'order_id': 'order-1', 'ticket_index': 1},
+    })
+    repository = QrIndexRepository(db)
+
+    # Ingresso removido
+    assert apply(db, repository.index_order_update, order(), order(codes=('qr-a',))) == 2
+    assert 'qr_index/qr-b' not in db.docs
+    # Token reemitido: o código anterior deixa de localizar o ingresso
+    apply(db, repository.index_order_update, order(codes=('qr-a',)), order(codes=('signed-a',)))
+    assert 'qr_index/qr-a' not in db.docs
+    assert repository.get('signed-a')['order_id'] == 'order-1'
+
+
+def test_participants_are_written_when_an_order_is_confirmed():
+    db = FakeFirestore()
+    assert apply(db, ParticipantRepository(db).sync_order, order(status='PAGAMENTO PENDENTE'), order()) == 2
+
+    participant = db.docs['participants/order-1_1']
+    assert participant['event_id'] == 'event-1'
+    assert participant['name_lower'] == 'ana qr-b'
+    assert participant['checkin'] is False
+
+
+def test_only_changed_participants_are_rewritten():
+    db = FakeFirestore()
+    repository = ParticipantRepository(db)
+    apply(db, repository.sync_order, None, order())
+
+    checked_in = order(checkins={'0': {'checkin': True, 'checkin_by': 'staff-1'}})
+    assert apply(db, repository.sync_order, order(), checked_in) == 1
+    assert db.docs['participants/order-1_0']['checkin_by'] == 'staff-1'
+    assert apply(db, repository.sync_order, checked_in, checked_in) == 0
+
+
+def test_participants_are_deleted_for_removed_tickets_and_unconfirmed_orders():
+    db = FakeFirestore()
+    repository = ParticipantRepository(db)
+    apply(db, repository.sync_order, None, order())
+
+    # Ingresso removido
+    assert apply(db, repository.sync_order, order(), order(codes=('qr-a',))) == 1
+    assert 'participants/order-1_1' not in db.docs
+    # Pedido deixa de estar confirmado
+    assert apply(db, repository.sync_order, order(codes=('qr-a',)), order(status='CANCELADO', codes=('qr-a',))) == 1
+    assert not any(path.startswith('participants/') for path in db.docs)
+
+
+def test_payment_index_points_to_the_current_charge():
+    db = FakeFirestore({'payments_index/pay-old': {'order_id': 'order-1', 'event_id': 'event-1'}})
+    repository = PaymentIndexRepository(db)
+
+    assert apply(db, repository.sync_order, order(), order(payment_id='pay-1')) == 1
+    assert repository.get_order_id('pay-1') == 'order-1'
+    assert apply(db, repository.sync_order, order(payment_id='pay-1'), order(status='CANCELADO', payment_id='pay-1')) == 0
+
+    # Nova cobrança: webhooks da anterior não localizam mais o pedido
+    db.docs['payments_index/pay-old'] = {'order_id': 'order-1', 'event_id': 'event-1'}
+    assert apply(db, repository.sync_order, order(payment_id='pay-old'), order(payment_id='pay-2')) == 2
+    assert 'payments_index/pay-old' not in db.docs
+    assert repository.get_order_id('pay-old') is None
+    assert repository.get_order_id('pay-2') == 'order-1'
+
+
+def test_unindexed_charge_falls_back_to_the_order_query_and_is_indexed():
+    db = FakeFirestore({'orders/order-1': order(payment_id='pay-1')})
+    repository = PaymentIndexRepository(db)
+
+    assert repository.get_order_id('pay-1') == 'order-1'
+    assert db.docs['payments_index/pay-1']['order_id'] == 'order-1'
+    assert repository.get_order_id('missing') is None
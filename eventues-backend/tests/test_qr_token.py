@@ -0,0 +1,87 @@
+import gzip
+import json
+
+from chalicelib.src.usecases.payment_usecase import PaymentUseCase
+from chalicelib.src.utils import qr_token
+from chalicelib.src.utils.signing import b64url_decode, b64url_encode, derive_key, sign, verify
+from conftest import FakeFirestore
+
+SECRET = 'test-secret'
+
+
+def test_b64url_round_trip_without_padding():
+    for data in (b'', b'a', b'ab', b'abc', b'\xff\xfe:order'):
+        encoded = b64url_encode(data)
+        assert '=' not in encoded and '+' not in encoded and '/' not in encoded
+        assert b64url_decode(encoded) == data
+
+
+def test_keys_are_separated_by_context():
+    assert derive_key(SECRET, 'qr', 'event-1', '1') != derive_key(SECRET, 'qr', 'event-1', '2')
+    assert derive_key(SECRET, 'qr', 'event-1') != derive_key(SECRET, 'queue', 'event-1')
+    key = derive_key(SECRET, 'qr', 'event-1', '1')
+    signature = sign(key, 'message')
+    assert verify(key, 'message', signature)
+    assert not verify(key, 'message!', signature)
+
+
+def test_ticket_token_round_trip():
+    token = qr_token.issue_token('event-1', 'order:1', 2, key_version=3, secret=SECRET)
+    assert qr_token.is_signed_token(token)
+    assert qr_token.verify_token(token, 'event-1', secret=SECRET) == {
+        'event_id': 'event-1', 'order_id': 'order:1', 'ticket_index': 2, 'key_version': 3
+    }
+
+
+def test_ticket_token_is_rejected_when_tampered_revoked_or_for_another_event():
+    token = qr_token.issue_token('event-1', 'order-1', 0, key_version=2, secret=SECRET)
+    prefix, version, body, signature = token.split('.')
+    other_ticket = b64url_encode(b'event-1:order-1:1')
+
+    assert qr_token.verify_token(f"{prefix}.{version}.{other_ticket}.{signature}", 'event-1', secret=SECRET) is None
+    assert qr_token.verify_token(f"{prefix}.3.{body}.{signature}", 'event-1', secret=SECRET) is None
+    assert qr_token.verify_token(token, 'event-2', secret=SECRET) is None
+    assert qr_token.verify_token(token, 'event-1', min_key_version=3, secret=SECRET) is None
+    assert qr_token.verify_token(token, 'event-1', secret='other-secret') is None
+    assert qr_token.verify_token('legacy-uuid', 'event-1', secret=SECRET) is None
+
+
+def test_sign_tickets_keeps_valid_tokens_and_replaces_the_rest():
+    tickets = [{'qr_code_uuid': 'legacy-uuid'}, {}]
+    assert qr_token.sign_tickets('event-1', 'order-1', tickets, secret=SECRET)
+    first_pass = [ticket['qr_code_uuid'] for ticket in tickets]
+    assert all(qr_token.is_signed_token(token) for token in first_pass)
+
+    assert not qr_token.sign_tickets('event-1', 'order-1', tickets, secret=SECRET)
+    assert [ticket['qr_code_uuid'] for ticket in tickets] == first_pass
+
+    # Token copiado de outra posição é reemitido
+    tickets.reverse()
+    assert qr_token.sign_tickets('event-1', 'order-1', tickets, secret=SECRET)
+    assert qr_token.verify_token(tickets[0]['qr_code_uuid'], 'event-1', secret=SECRET)['ticket_index'] == 0
+
+
+def test_sign_tickets_without_secret_leaves_tickets_unchanged():
+    tickets = [{'qr_code_uuid': 'legacy-uuid'}]
+    assert not qr_token.sign_tickets('event-1', 'order-1', tickets, secret='')
+    assert tickets == [{'qr_code_uuid': 'legacy-uuid'}]
+
+
+def test_checkin_snapshot_never_ships_signing_keys():
+    token = qr_token.issue_token('event-1', 'order-1', 0, secret=SECRET)
+    db = FakeFirestore({
+        'events/event-1': {'qr_key_version': 2, 'qr_min_key_version': 2},
+        'orders/order-1': {
+            'event_id': 'event-1', 'status': 'CONFIRMADO',
+            'tickets': [{'qr_code_uuid': token, 'ticket_name': 'Geral', 'participants': [{'fullName': 'Ana'}]}]
+        }
+    })
+    qr_token.invalidate_key_versions('event-1')
+
+    (payload, version), status_code = PaymentUseCase().get_checkin_snapshot('event-1', db)
+    snapshot = json.loads(gzip.decompress(payload))
+
+    assert status_code == 200 and snapshot['version'] == version
+    assert 'keys' not in snapshot
+    assert snapshot['key_versions'] == {'current': 2, 'min': 2}
+    assert [entry['q'] for entry in snapshot['tickets']] == [token]
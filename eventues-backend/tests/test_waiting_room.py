@@ -0,0 +1,129 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from google.api_core.exceptions import Aborted
+
+from chalicelib.src.repositories import waiting_room_repository
+from chalicelib.src.repositories.waiting_room_repository import QueueTokenUsedError, WaitingRoomRepository
+from chalicelib.src.usecases.waiting_room_usecase import WaitingRoomUseCase
+from chalicelib.src.utils import queue_token
+from conftest import FakeFirestore
+
+SECRET = 'test-secret'
+OPENED_AT = 1_700_000_000
+
+
+@pytest.fixture(autouse=True)
+def transactions(fake_transactions, monkeypatch):
+    monkeypatch.setattr(queue_token.env_config, 'get_qr_signing_secret', lambda: SECRET)
+    waiting_room_repository._settings_cache.clear()
+
+
+def settings(admission_rate=5, num_shards=10):
+    return {'enabled': True, 'admission_rate': admission_rate, 'opened_at': OPENED_AT, 'num_shards': num_shards}
+
+
+def open_room(db, **options):
+    db.docs['waiting_rooms/event-1'] = settings(**options)
+
+
+def claims(position=0, expires_at=OPENED_AT + 10_000):
+    return {'event_id': 'event-1', 'opened_at': OPENED_AT, 'position': position,
+            'admit_at': OPENED_AT, 'expires_at': expires_at}
+
+
+def test_token_round_trip():
+    token = queue_token.issue_token('event-1', OPENED_AT, 7, OPENED_AT + 5, OPENED_AT + 905, secret=SECRET)
+    assert token.startswith('EVW1.')
+    assert queue_token.verify_token(token, 'event-1', now=OPENED_AT, secret=SECRET) == {
+        'event_id': 'event-1', 'opened_at': OPENED_AT, 'position': 7,
+        'admit_at': OPENED_AT + 5, 'expires_at': OPENED_AT + 905
+    }
+
+
+def test_token_is_rejected_when_tampered_expired_or_for_another_event():
+    token = queue_token.issue_token('event-1', OPENED_AT, 7, OPENED_AT, OPENED_AT + 900, secret=SECRET)
+    prefix, body, signature = token.split('.')
+    forged_body = queue_token.b64url_encode(f"event-1:{OPENED_AT}:0:{OPENED_AT}:{OPENED_AT + 900}".encode())
+
+    assert queue_token.verify_token(f"{prefix}.{forged_body}.{signature}", 'event-1', now=OPENED_AT, secret=SECRET) is None
+    assert queue_token.verify_token(token, 'event-2', now=OPENED_AT, secret=SECRET) is None
+    assert queue_token.verify_token(token, 'event-1', now=OPENED_AT + 900, secret=SECRET) is None
+    assert queue_token.verify_token(token, 'event-1', now=OPENED_AT, secret='other-secret') is None
+    assert queue_token.issue_token('event-1', OPENED_AT, 7, OPENED_AT, OPENED_AT + 900, secret='') is None
+
+
+def test_burst_of_joins_is_admitted_at_the_configured_rate():
+    # Latência das leituras: outras entradas no mesmo shard esperam o lock
+    db = FakeFirestore(jitter=0.001)
+    repository = WaitingRoomRepository(db)
+    room = settings(admission_rate=5, num_shards=10)
+    joins = 300
+
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=30) as executor:
+        slots = list(executor.map(lambda _: repository.take_slot('event-1', room, now=OPENED_AT), range(joins)))
+    duration = time.time() - start_time
+
+    positions = [slot['position'] for slot in slots]
+    assert len(set(positions)) == joins
+    admit_times = sorted(slot['admit_at'] - OPENED_AT for slot in slots)
+    # Em qualquer janela de 10s, no máximo taxa * 10 admissões (mais um slot por shard)
+    for start in range(0, int(admit_times[-1]) + 1):
+        in_window = sum(1 for admit_time in admit_times if start <= admit_time < start + 10)
+        assert in_window <= 5 * 10 + 10
+    assert admit_times[-1] >= joins / 5 - 10
+    print(f"[PERF] waiting room: {joins} entradas em {duration * 1000:.0f}ms com {room['num_shards']} shards")
+
+
+def test_join_moves_to_another_shard_when_one_is_contended(monkeypatch):
+    db = FakeFirestore()
+    repository = WaitingRoomRepository(db)
+    take_slot_in_shard = repository._take_slot_in_shard
+    tried = []
+
+    def contended_first_shard(event_id, room, shard, now=None, single_attempt=False):
+        tried.append((shard, single_attempt))
+        if len(tried) == 1:
+            raise ValueError('Failed to commit transaction') from Aborted('contention')
+        return take_slot_in_shard(event_id, room, shard, now, single_attempt)
+
+    monkeypatch.setattr(repository, '_take_slot_in_shard', contended_first_shard)
+    slot = repository.take_slot('event-1', settings(), now=OPENED_AT)
+
+    assert len(tried) == 2 and tried[0][0] != tried[1][0]
+    assert tried[0][1] is True
+    assert slot['position'] % 10 == tried[1][0]
+
+
+def test_admission_is_bound_to_the_first_order():
+    db = FakeFirestore()
+    repository = WaitingRoomRepository(db)
+    repository.bind_admission('event-1', claims(), 'order-1')
+    # O mesmo pedido pode repetir (retry da sessão de pagamento)
+    repository.bind_admission('event-1', claims(), 'order-1')
+
+    with pytest.raises(QueueTokenUsedError) as error:
+        repository.bind_admission('event-1', claims(), 'order-2')
+    assert error.value.order_id == 'order-1'
+    repository.bind_admission('event-1', claims(position=1), 'order-2')
+
+
+def test_reused_token_is_rejected_for_another_order():
+    db = FakeFirestore()
+    open_room(db)
+    token = queue_token.issue_token('event-1', OPENED_AT, 3, OPENED_AT, int(time.time()) + 900)
+    use_case = WaitingRoomUseCase()
+
+    assert use_case.bind('event-1', token, 'order-1', db) is None
+    result, status_code = use_case.bind('event-1', token, 'order-2', db)
+    assert status_code == 403 and result['queue_required'] is True
+
+
+def test_bind_is_a_no_op_without_token_or_active_room():
+    db = FakeFirestore()
+    assert WaitingRoomUseCase().bind('event-1', None, 'order-1', db) is None
+    token = queue_token.issue_token('event-1', OPENED_AT, 3, OPENED_AT, int(time.time()) + 900)
+    assert WaitingRoomUseCase().bind('event-1', token, 'order-1', db) is None
+    assert not any('/admissions/' in path for path in db.docs)
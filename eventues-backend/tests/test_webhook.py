@@ -0,0 +1,59 @@
+import pytest
+
+from chalicelib.src.usecases.payment_usecase import PaymentUseCase, is_forward_transition
+from conftest import FakeFirestore
+
+pytestmark = pytest.mark.usefixtures('fake_transactions')
+
+
+def confirmed_order_db():
+    return FakeFirestore({
+        'payments_index/pay-1': {'order_id': 'order-1', 'event_id': 'event-1'},
+        'orders/order-1': {
+            'event_id': 'event-1', 'user_id': 'user-1', 'status': 'CONFIRMADO', 'payment_id': 'pay-1',
+            'order_stock_state': 'sold', 'total_amount': 50,
+            'payment_details': {'status': 'RECEIVED'}, 'tickets': []
+        }
+    })
+
+
+def webhook(event_id, status, event='PAYMENT_UPDATED'):
+    return {'id': event_id, 'event': event, 'payment': {'id': 'pay-1', 'status': status}}
+
+
+def test_forward_transitions_follow_the_asaas_lifecycle():
+    assert is_forward_transition('PENDING', 'CONFIRMED')
+    assert is_forward_transition('CONFIRMED', 'RECEIVED')
+    assert is_forward_transition('RECEIVED', 'REFUNDED')
+    assert not is_forward_transition('CONFIRMED', 'PENDING')
+    assert not is_forward_transition('RECEIVED', 'RECEIVED')
+    # Sem status anterior ou com status desconhecido, a transição é aplicada
+    assert is_forward_transition(None, 'PENDING')
+    assert is_forward_transition('RECEIVED', 'NEW_ASAAS_STATUS')
+
+
+def test_late_pending_after_confirmation_is_ignored():
+    db = confirmed_order_db()
+    result, status_code = PaymentUseCase().process_webhook(webhook('evt-late', 'PENDING', 'PAYMENT_CREATED'), db)
+
+    assert status_code == 200 and result['status'] == 'ignored'
+    order = db.docs['orders/order-1']
+    assert order['status'] == 'CONFIRMADO'
+    assert order['payment_details']['status'] == 'RECEIVED'
+    # O evento fica registrado para que uma nova entrega não seja reavaliada
+    assert db.docs['webhook_events/evt-late']['applied'] is False
+
+
+def test_duplicate_webhook_event_is_a_no_op():
+    db = confirmed_order_db()
+    result, _ = PaymentUseCase().process_webhook(webhook('evt-1', 'REFUNDED'), db)
+    assert result['status'] == 'success'
+    assert db.docs['orders/order-1']['status'] == 'CANCELADO'
+
+    db.docs['orders/order-1']['status'] = 'CONFIRMADO'
+    round_trips = len(db.round_trips)
+    result, status_code = PaymentUseCase().process_webhook(webhook('evt-1', 'REFUNDED'), db)
+
+    assert status_code == 200 and result['status'] == 'duplicate'
+    assert db.docs['orders/order-1']['status'] == 'CONFIRMADO'
+    assert db.round_trips[round_trips:] == [('get', 'webhook_events/evt-1')]
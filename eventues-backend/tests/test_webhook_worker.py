@@ -0,0 +1,107 @@
+from chalicelib.src.tasks import webhook_worker
+from chalicelib.src.tasks.webhook_worker import WebhookWorker
+
+
+class FakeQueueDoc:
+    def __init__(self, doc_id, payment_id, status='PAYMENT_RECEIVED'):
+        self.id = doc_id
+        self.reference = doc_id
+        self._data = {
+            'payment_id': payment_id,
+            'received_at': doc_id,
+            'payload': {'id': f"evt-{doc_id}", 'payment': {'id': payment_id, 'status': status}}
+        }
+
+    def to_dict(self):
+        return self._data
+
+
+class FakeQueue:
+    """Fila em memória: itens concluídos saem, itens com erro continuam PENDING."""
+
+    def __init__(self, docs):
+        self.pending = {doc.id: doc for doc in docs}
+        self.reads = []
+
+    def get_pending(self, limit, payment_id=None, after=None):
+        self.reads.append(after.id if after else None)
+        ordered = sorted(self.pending)
+        if after is not None:
+            ordered = [doc_id for doc_id in ordered if doc_id > after.id]
+        return [self.pending[doc_id] for doc_id in ordered[:limit]]
+
+    def complete(self, writer, queue_docs):
+        for queue_doc in queue_docs:
+            self.pending.pop(queue_doc.id, None)
+
+    def retry_or_fail(self, writer, queue_docs, error, max_attempts, permanent=False):
+        pass
+
+
+class FakeBatch:
+    def commit(self):
+        pass
+
+
+class FakeDb:
+    def batch(self):
+        return FakeBatch()
+
+
+class FakePaymentUseCase:
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.processed = []
+
+    def process_webhook(self, payload, db, superseded_ids):
+        payment_id = payload['payment']['id']
+        self.processed.append(payment_id)
+        if payment_id in self.failing:
+            return {'error': 'Order not found'}, 404
+        return {'message': 'ok'}, 200
+
+
+def make_worker(docs, failing=(), batch_size=3, budget=30):
+    worker = WebhookWorker(FakeDb(), FakePaymentUseCase(failing))
+    worker.queue = FakeQueue(docs)
+    worker.config = {**worker.config, 'batch_size': batch_size, 'drain_budget_seconds': budget}
+    return worker
+
+
+def test_drain_all_empties_the_queue_in_batches():
+    worker = make_worker([FakeQueueDoc(f"{n:03d}", f"pay_{n}") for n in range(8)])
+    totals = worker.drain_all()
+    assert totals['events'] == 8 and totals['applied'] == 8
+    assert totals['batches'] == 3
+    assert worker.queue.pending == {}
+
+
+def test_retried_items_are_not_reread_in_the_same_run():
+    docs = [FakeQueueDoc(f"{n:03d}", f"pay_{n}") for n in range(6)]
+    worker = make_worker(docs, failing={'pay_0'})
+    totals = worker.drain_all()
+    assert worker.payment_usecase.processed.count('pay_0') == 1
+    assert totals['failed'] == 1 and totals['applied'] == 5
+    assert list(worker.queue.pending) == ['000']
+    assert worker.queue.reads == [None, '002', '005']
+
+
+def test_drain_all_stops_when_the_budget_runs_out(monkeypatch):
+    clock = iter(range(100))
+    monkeypatch.setattr(webhook_worker.time, 'time', lambda: next(clock))
+    worker = make_worker([FakeQueueDoc(f"{n:03d}", f"pay_{n}") for n in range(30)], budget=4)
+    totals = worker.drain_all()
+    assert 0 < totals['batches'] < 10
+    assert worker.queue.pending
+
+
+def test_events_of_the_same_payment_are_applied_once():
+    docs = [
+        FakeQueueDoc('001', 'pay_1', 'PAYMENT_CREATED'),
+        FakeQueueDoc('002', 'pay_1', 'PAYMENT_RECEIVED'),
+        FakeQueueDoc('003', 'pay_2'),
+    ]
+    worker = make_worker(docs, batch_size=10)
+    metrics = worker.drain()
+    assert metrics == {'events': 3, 'groups': 2, 'applied': 2, 'failed': 0}
+    assert worker.payment_usecase.processed == ['pay_1', 'pay_2']